@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# Ambient Stand-in ambient_standin.py
+# Ambientの代わりに受信内容を記録するHTTPサーバを起動し、AmbientSinkの
+# 一括送信・接続の再利用・登録件数の調整を確認します。
+#
+#   実機やAmbientのアカウントは不要です。30秒ごとの集計を仮想時刻で
+#   再生し、受信したリクエスト数、データ件数、TCP接続数を表示します。
+#   停止回数を指定すると、その間だけ代替サーバがエラー(503)を応答し、
+#   スプールに保存したデータが復旧後に再送されることを確認できます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./ambient_standin.py [集計回数] [1日の登録件数の上限] [停止回数]
+#       ./ambient_standin.py 2880 3000              # 1日分(30秒×2880回)
+#       ./ambient_standin.py 2880 1000              # 上限を下げて間引きを確認
+#       ./ambient_standin.py 2880 3000 360          # 3時間の停止から再送
+
+windows = 2880                                      # 再生する集計回数(1日分)
+quota = 3000                                        # 1日あたりの登録件数の上限
+outage = 0                                          # 代替サーバの停止回数
+port = 8080                                         # 代替サーバのポート番号
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ble_ambient import AmbientSink                 # Ambientの出力先を組み込む
+from sys import argv                                # sysから引数取得を組み込む
+from time import mktime, sleep                      # 時間取得を組み込む
+import ble_ambient                                  # 送信間隔の設定用
+import tempfile                                     # 一時ディレクトリを組み込む
+import threading                                    # スレッド管理を組み込む
+import json                                         # JSON変換を組み込む
+
+requests = list()                                   # 受信したリクエストの記録
+down = [False]                                      # 代替サーバの停止中フラグ
+
+class Handler(BaseHTTPRequestHandler):              # 代替サーバの受信処理
+    protocol_version = 'HTTP/1.1'                   # keep-aliveに対応
+    def do_POST(self):                              # POST受信時の処理
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if down[0]:                                 # 停止中の時
+            self.send_response(503)                 # 503 Service Unavailable
+            self.send_header('Content-Length', '0') # 本文なし
+            self.end_headers()                      # ヘッダの終了
+            return                                  # 記録しない
+        requests.append((self.client_address, self.path, json.loads(body)))
+        self.send_response(200)                     # 200 OK
+        self.send_header('Content-Length', '0')     # 本文なし
+        self.end_headers()                          # ヘッダの終了
+    def log_message(self, format, *args):           # アクセスログ
+        pass                                        # 表示しない
+
+if len(argv) > 1:                                   # 引数がある時
+    windows = int(argv[1])                          # 集計回数を設定
+if len(argv) > 2:                                   # 引数がある時
+    quota = int(argv[2])                            # 登録件数の上限を設定
+if len(argv) > 3:                                   # 引数がある時
+    outage = int(argv[3])                           # 停止回数を設定
+
+server = ThreadingHTTPServer(('127.0.0.1', port), Handler)  # 代替サーバ
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+ble_ambient.min_interval = 0                        # 仮想時刻のため待たない
+clock = [mktime((2021, 3, 7, 0, 0, 0, 0, 0, -1))]   # 仮想時刻(0時から)
+sink = AmbientSink('0000', 'test', url='http://127.0.0.1:%d' % port,
+                   quota=quota, clock=lambda: clock[0], spool_dir=tempfile.mkdtemp())
+sink.worker.backoff = 0.01                          # 再送待ちを短縮
+for i in range(windows):                            # 各集計について
+    down[0] = windows // 4 <= i < windows // 4 + outage # 停止中かどうか
+    values = {'counter': i % 50, 'co2': 400 + i % 100, 'tvoc': i % 30, 'temp': 20}
+    sink.window(values)                             # 集計結果を通知
+    clock[0] += 30                                  # 30秒進める
+    while sink.worker.depth() > 0 or (sink.buffered == 0 and len(sink.spool) and not down[0]):
+        sleep(0.001)                                # 送信を待つ
+sink.close()                                        # 残りを送信して終了
+server.shutdown()                                   # 代替サーバを停止
+
+records = sum(len(r[2]['data']) for r in requests)  # 受信したデータ件数
+fields = sorted(requests[0][2]['data'][0]) if requests else []
+print('windows   =', windows)                       # 集計回数
+print('requests  =', len(requests))                 # 受信したリクエスト数
+print('records   =', records, '(quota %d, skipped %d)' % (quota, sink.skipped))
+print('connects  =', len({r[0] for r in requests})) # TCP接続数
+print('pending   =', len(sink.spool))               # 未送信の件数
+print('path      =', requests[0][1] if requests else None)
+print('fields    =', fields)                        # データの項目
+
+''' 実行結果の一例
+$ ./ambient_standin.py 2880 3000
+Ambient 10 records, queue = 0
+    (中略)
+windows   = 2880
+requests  = 288
+records   = 2880 (quota 3000, skipped 0)
+connects  = 1
+pending   = 0
+path      = /api/v2/channels/0000/dataarray
+fields    = ['created', 'd1', 'd2', 'd3', 'd4']
+$ ./ambient_standin.py 2880 1000
+Ambient 4 records, queue = 0
+Ambient 3 records, queue = 0
+    (中略)
+windows   = 2880
+requests  = 288
+records   = 1000 (quota 1000, skipped 1880)
+connects  = 1
+pending   = 0
+path      = /api/v2/channels/0000/dataarray
+fields    = ['created', 'd1', 'd2', 'd3', 'd4']
+$ ./ambient_standin.py 2880 3000 360
+Ambient 10 records, queue = 0
+    (中略)
+ambient ERROR HTTP 503 Service Unavailable
+    (中略)
+Ambient 370 records, queue = 0
+    (中略)
+windows   = 2880
+requests  = 255
+records   = 2880 (quota 3000, skipped 0)
+connects  = 1
+pending   = 0
+path      = /api/v2/channels/0000/dataarray
+fields    = ['created', 'd1', 'd2', 'd3', 'd4']
+'''
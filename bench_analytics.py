@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_analytics.py
+# 時間窓ごとのRSSIの分析(分布、アドレスごとの平滑化、在室数の推定)を、
+# Python の繰り返し(loop)と NumPy の配列演算(Analytics)で比較します。
+#
+#   loop      受信ごとに辞書でアドレスごとの合計と件数を数え、時間窓の終わりに
+#             アドレスごとに平滑化と重みを計算します
+#   numpy     ble_analytics.py の Analytics(受信ごとは配列に追加するだけ)
+#   どちらも同じ結果(occupancy)になることを確認します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_analytics.py [デバイス数]... [時間窓あたりの受信数/デバイス]
+#       ./bench_analytics.py 100 500 2000 60
+#
+#【実行結果の見方】
+#   events     1時間窓の受信数
+#   add us     1受信の記録に要した時間(マイクロ秒)
+#   window ms  時間窓の終わりの計算に要した時間(ミリ秒)
+#   total ms   1時間窓の処理時間の合計(記録と計算、ミリ秒)
+#   occupancy  在室数の推定(loopとnumpyで一致すること)
+
+sizes = [100, 500, 2000]                            # デバイス数
+per_device = 60                                     # 時間窓あたりの受信数/デバイス
+windows = 5                                         # 計測する時間窓の数
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from ble_analytics import Analytics, alpha, width, rssi_step, rssi_min, rssi_max
+import math                                         # 数学関数を組み込む
+import random                                       # 乱数を組み込む
+
+class LoopAnalytics:                                # Pythonの繰り返しによる実装
+    def __init__(self, target_rssi=-80):            # コンストラクタ作成
+        self.target_rssi = target_rssi              # 重み0.5のRSSI
+        self.bins = (rssi_max - rssi_min) // rssi_step + 1  # 区間の数
+        self.sums = dict()                          # アドレス→[合計,件数]
+        self.hist = [0] * self.bins                 # RSSIの分布
+        self.smoothed = dict()                      # アドレス→平滑化したRSSI
+    def add(self, addr, rssi):                      # 受信ごとの処理
+        s = self.sums.get(addr)                     # アドレスの合計と件数
+        if s is None:                               # 新しいアドレスの時
+            s = self.sums[addr] = [0, 0]            # 合計と件数
+        s[0] += rssi                                # 合計
+        s[1] += 1                                   # 件数
+        self.hist[min(max((rssi - rssi_min) // rssi_step, 0), self.bins - 1)] += 1
+    def window(self, now):                          # 時間窓の終わりの処理
+        occupancy = 0.0                             # 在室数の推定
+        for addr, (total, count) in self.sums.items():  # 各アドレスについて
+            mean = total / count                    # 時間窓内の平均
+            prev = self.smoothed.get(addr)          # 前回までの平滑化した値
+            s = mean if prev is None else alpha * mean + (1 - alpha) * prev
+            self.smoothed[addr] = s                 # 平滑化した値を更新
+            occupancy += 1 / (1 + math.exp((self.target_rssi - s) / width))
+        values = {'occupancy': round(occupancy, 1), 'rssi_hist': self.hist}
+        self.sums = dict()                          # 次の時間窓へ
+        self.hist = [0] * self.bins                 # 次の時間窓へ
+        return values                               # 分析結果を応答
+
+def sightings(devices, seed=1):                     # 1時間窓の受信の列
+    rnd = random.Random(seed)                       # 再現可能な乱数
+    base = [('%02x:%02x:%02x:%02x:%02x:%02x' % tuple(rnd.getrandbits(48).to_bytes(6, 'little')),
+             rnd.randint(-95, -45)) for i in range(devices)]
+    return [(addr, rssi + rnd.randint(-6, 6)) for i in range(per_device)
+            for addr, rssi in base]                 # 全デバイスが per_device 回ずつ
+
+def measure(impl, events):                          # 1実装の計測
+    adds = calc = 0.0                               # 記録と計算の時間
+    for w in range(windows):                        # 各時間窓について
+        add = impl.add                              # メソッドを変数に保持
+        start = perf_counter()                      # 計測開始
+        for addr, rssi in events:                   # 各受信について
+            add(addr, rssi)                         # 受信を記録
+        adds += perf_counter() - start              # 記録に要した時間
+        start = perf_counter()                      # 計測開始
+        values = impl.window(30.0 * (w + 1))        # 時間窓の終わりの計算
+        calc += perf_counter() - start              # 計算に要した時間
+    return (adds / windows / len(events) * 1e6, calc / windows * 1000,
+            (adds + calc) / windows * 1000, values['occupancy'])
+
+if len(argv) > 1:                                   # 引数がある時
+    sizes = [int(a) for a in argv[1:-1]] or sizes   # デバイス数を設定
+    per_device = int(argv[-1])                      # 受信数を設定
+
+if __name__ == '__main__':                          # 直接実行された時
+    print('per_device =', per_device, ', windows =', windows)
+    print('%7s %6s %8s %7s %10s %9s %10s' % ('devices', 'impl', 'events', 'add us',
+          'window ms', 'total ms', 'occupancy'))
+    for devices in sizes:                           # 各デバイス数について
+        events = sightings(devices)                 # 1時間窓の受信
+        for name, impl in (('loop', LoopAnalytics()), ('numpy', Analytics())):
+            r = measure(impl, events)               # 計測を実行
+            print('%7d %6s %8d %7.2f %10.2f %9.1f %10.1f' % ((devices, name, len(events)) + r))
+
+''' 実行結果の一例 (1コアの環境)
+$ ./bench_analytics.py 100 500 2000 60
+per_device = 60 , windows = 5
+devices   impl   events  add us  window ms  total ms  occupancy
+    100   loop     6000    0.33       0.03       2.0       71.1
+    100  numpy     6000    0.13       0.19       1.0       71.1
+    500   loop    30000    0.33       0.14      10.1      352.6
+    500  numpy    30000    0.13       0.81       4.8      352.6
+   2000   loop   120000    0.34       0.51      41.0     1400.1
+   2000  numpy   120000    0.14       3.04      20.1     1400.1
+'''
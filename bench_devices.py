@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_devices.py
+# アドレスごとの状態の保持方法について、メモリ使用量と処理時間を比較します。
+#
+#   dict     アドレス文字列→状態の辞書(辞書の辞書)
+#   slots    アドレス文字列→__slots__付きオブジェクト
+#   array    DeviceTable(整数化したアドレス→番号, 項目ごとの並列配列)
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_devices.py [アドレス数]...
+#       ./bench_devices.py 10000 50000
+#
+#【実行結果の見方】
+#   bytes/dev  1台あたりのメモリ(tracemalloc計測、受信したScanEntryは除く)
+#   us/update  1回の受信の記録に要した時間(マイクロ秒、1台あたり10回受信)
+
+sizes = [10000, 50000]                              # 合成するアドレス数
+sightings = 10                                      # 1台あたりの受信回数
+alpha = 0.2                                         # RSSI平滑化の係数
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from ble_devices import DeviceTable                 # 状態表を組み込む
+from ble_record import ReplayEntry                  # ScanEntry相当を組み込む
+import random                                       # 乱数を組み込む
+import tracemalloc                                  # メモリ計測を組み込む
+
+class DictTable:                                    # 辞書の辞書による状態表
+    def __init__(self):                             # コンストラクタ作成
+        self.devices = dict()                       # アドレス→状態の辞書
+    def update(self, dev, now):                     # 受信記録用メソッド
+        d = self.devices.get(dev.addr)              # アドレスの状態
+        if d is None:                               # 未記録の時
+            self.devices[dev.addr] = {'first': now, 'last': now, 'count': 1,
+                'rssi_min': dev.rssi, 'rssi_max': dev.rssi, 'rssi': float(dev.rssi),
+                'connectable': dev.connectable}
+            return                                  # 処理を終了
+        d['last'] = now                             # 最終受信時刻を更新
+        d['count'] += 1                             # 受信回数を加算
+        d['rssi_min'] = min(d['rssi_min'], dev.rssi)    # 最小値を更新
+        d['rssi_max'] = max(d['rssi_max'], dev.rssi)    # 最大値を更新
+        d['rssi'] += (dev.rssi - d['rssi']) * alpha # RSSIを平滑化
+        d['connectable'] |= dev.connectable         # 接続可否を更新
+
+class Device:                                       # __slots__付きの状態
+    __slots__ = ('first', 'last', 'count', 'rssi_min', 'rssi_max', 'rssi', 'connectable')
+    def __init__(self, dev, now):                   # コンストラクタ作成
+        self.first = self.last = now                # 初回・最終受信時刻
+        self.count = 1                              # 受信回数
+        self.rssi_min = self.rssi_max = dev.rssi    # RSSIの最小・最大値
+        self.rssi = float(dev.rssi)                 # RSSIの平滑値
+        self.connectable = dev.connectable          # 接続可否
+
+class SlotsTable:                                   # __slots__による状態表
+    def __init__(self):                             # コンストラクタ作成
+        self.devices = dict()                       # アドレス→状態の辞書
+    def update(self, dev, now):                     # 受信記録用メソッド
+        d = self.devices.get(dev.addr)              # アドレスの状態
+        if d is None:                               # 未記録の時
+            self.devices[dev.addr] = Device(dev, now)   # 状態を生成
+            return                                  # 処理を終了
+        d.last = now                                # 最終受信時刻を更新
+        d.count += 1                                # 受信回数を加算
+        if dev.rssi < d.rssi_min:                   # 最小値より小さい時
+            d.rssi_min = dev.rssi                   # 最小値を更新
+        elif dev.rssi > d.rssi_max:                 # 最大値より大きい時
+            d.rssi_max = dev.rssi                   # 最大値を更新
+        d.rssi += (dev.rssi - d.rssi) * alpha       # RSSIを平滑化
+        d.connectable |= dev.connectable            # 接続可否を更新
+
+def entries(n, seed=1):                             # 受信の列を合成
+    rnd = random.Random(seed)                       # 再現可能な乱数
+    fmt = '%02x:%02x:%02x:%02x:%02x:%02x'           # アドレスの書式
+    addrs = [fmt % tuple(rnd.getrandbits(48).to_bytes(6, 'little')) for i in range(n)]
+    return [ReplayEntry((addrs[i % n] + ' ')[:-1], 'random',    # 受信ごとに別の文字列
+                        rnd.randrange(-100, -40), i % 3 == 0, b'') for i in range(n * sightings)]
+
+def measure(make, devs):                            # 時間とメモリを計測
+    table = make()                                  # 計測用に生成
+    start = perf_counter()                          # 計測開始
+    for i, dev in enumerate(devs):                  # 各受信について
+        table.update(dev, i * 0.001)                # 記録を実行
+    elapsed = perf_counter() - start                # 処理時間
+    del table                                       # 計測用を破棄
+    tracemalloc.start()                             # メモリ計測を開始
+    table = make()                                  # 計測用に再生成
+    for i, dev in enumerate(devs):                  # 各受信について
+        table.update(dev, i * 0.001)                # 記録を実行
+    memory = tracemalloc.get_traced_memory()[0]     # 確保中のメモリ量
+    tracemalloc.stop()                              # メモリ計測を終了
+    return elapsed, memory                          # 結果を応答
+
+if len(argv) > 1:                                   # 引数がある時
+    sizes = [int(a) for a in argv[1:]]              # アドレス数を設定
+
+print('%8s %-6s %10s %10s %12s' % ('devices', 'table', 'us/update', 'bytes/dev', 'memory'))
+for n in sizes:                                     # 各アドレス数について
+    devs = entries(n)                               # 受信の列を合成
+    for name, make in (('dict', DictTable), ('slots', SlotsTable), ('array', DeviceTable)):
+        elapsed, memory = measure(make, devs)       # 計測を実行
+        print('%8d %-6s %10.2f %10.1f %10.1fMB' % (n, name, 1e6 * elapsed / len(devs),
+              memory / n, memory / 1e6))
+
+''' 実行結果の一例
+$ ./bench_devices.py
+ devices table   us/update  bytes/dev       memory
+   10000 dict         0.97      364.0        3.6MB
+   10000 slots        0.49      180.6        1.8MB
+   10000 array        1.78      128.2        1.3MB
+   50000 dict         1.56      382.3       19.1MB
+   50000 slots        0.66      198.4        9.9MB
+   50000 array        2.52      153.1        7.7MB
+'''
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_hll.py
+# 厳密カウント(AddressWindow)と近似カウント(SketchWindow)の
+# メモリ使用量と処理時間を、合成したランダムアドレスで比較します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_hll.py [アドレス数]... [誤差の目標値]
+#       ./bench_hll.py 10000 100000 1000000 0.02
+#
+#【実行結果の見方】
+#   us/add     アドレス1件の記録に要した時間(マイクロ秒)
+#   memory     カウント用の構造が確保したメモリ(tracemalloc計測)
+#   estimate   直近1時間のデバイス数(exactは真値)
+
+sizes = [10000, 100000, 1000000]                    # 合成するアドレス数
+error = 0.02                                        # 誤差の目標値
+spans = (60, 900, 3600)                             # 時間窓の長さ(秒)
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from ble_dedup import AddressWindow                 # 厳密カウントを組み込む
+from ble_hll import SketchWindow                    # 近似カウントを組み込む
+import random                                       # 乱数を組み込む
+import tracemalloc                                  # メモリ計測を組み込む
+
+def addresses(n, seed=1):                           # ランダムアドレスの合成
+    rnd = random.Random(seed)                       # 再現可能な乱数
+    fmt = '%02x:%02x:%02x:%02x:%02x:%02x'           # アドレスの書式
+    return [fmt % tuple(rnd.getrandbits(48).to_bytes(6, 'little')) for i in range(n)]
+
+def feed(counter, addrs):                           # 1時間に均等に記録
+    step = 3000 / len(addrs)                        # 記録間隔(秒)
+    add = counter.add                               # メソッドを変数に保持
+    for i, addr in enumerate(addrs):                # 各アドレスについて
+        add(addr, i * step)                         # 受信時刻付きで記録
+    return counter.count(3600, 3000)                # 直近1時間のデバイス数
+
+def measure(make, addrs):                           # 時間とメモリを計測
+    start = perf_counter()                          # 計測開始
+    estimate = feed(make(), addrs)                  # 記録を実行
+    elapsed = perf_counter() - start                # 処理時間
+    tracemalloc.start()                             # メモリ計測を開始
+    counter = make()                                # 計測用に再生成
+    feed(counter, addrs)                            # 記録を実行
+    memory = tracemalloc.get_traced_memory()[0]     # 確保中のメモリ量
+    tracemalloc.stop()                              # メモリ計測を終了
+    return elapsed, memory, estimate                # 結果を応答
+
+args = [float(a) for a in argv[1:]]                 # 引数を数値に変換
+if args and args[-1] < 1:                           # 最後の引数が1未満の時
+    error = args.pop()                              # 誤差の目標値に設定
+if args:                                            # アドレス数の指定がある時
+    sizes = [int(a) for a in args]                  # アドレス数を設定
+
+modes = (('exact', lambda: AddressWindow(spans)),
+         ('hll', lambda: SketchWindow(spans, error)))
+print('%-6s %9s %8s %12s %10s %7s' % ('mode', 'addrs', 'us/add', 'memory', 'estimate', 'error'))
+for n in sizes:                                     # 各アドレス数について
+    addrs = addresses(n)                            # アドレスを合成
+    for name, make in modes:                        # 各方式について
+        elapsed, memory, estimate = measure(make, addrs)
+        print('%-6s %9d %8.2f %10.1fkB %10d %6.2f%%' % (name, n,
+            1e6 * elapsed / n, memory / 1024, estimate, 100 * (estimate - n) / n))
+
+''' 実行結果の一例
+$ ./bench_hll.py 10000 100000 1000000
+mode       addrs   us/add       memory   estimate   error
+exact      10000     3.66     1327.4kB      10000   0.00%
+hll        10000    61.24     1874.6kB       9760  -2.40%
+exact     100000     4.24    15336.6kB     100000   0.00%
+hll       100000     8.32     1889.0kB     100125   0.12%
+exact    1000000     4.56   135768.6kB    1000000   0.00%
+hll      1000000     2.85     1890.4kB     994459  -0.55%
+
+※hllの処理時間には15秒刻みの切り替え(200回)が含まれるため、
+  アドレス数が少ないときは1件あたりの時間が大きく見えます。
+'''
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_httpd.py
+# 多数のダッシュボード(ブラウザ)が同時に棒グラフのページを読み込んだ時の
+# HTTPサーバ(ble_httpd.py)の応答性能を計測します。
+#
+#   HTTPサーバは別プロセスで起動し、動作間隔(1.01秒)ごとに値を更新します。
+#   dashboards 個のスレッドがそれぞれ繰り返しページを取得し、1秒あたりの
+#   応答数と応答時間を、次の4つの構成で比較します。
+#
+#   single     従来の構成(1件ずつ応答、毎回HTMLを作成)
+#   threaded   スレッドで並行に応答、毎回HTMLを作成
+#   cached     スレッドで並行に応答、値の更新ごとに1回だけHTMLを作成
+#   304        cached に加え、ETagを送り、変化が無い時は本文なし(304)
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_httpd.py [ダッシュボード数] [計測時間(秒)]
+#       ./bench_httpd.py 100 10
+#
+#【実行結果の見方】
+#   req/s      1秒あたりの応答数(全ダッシュボードの合計)
+#   p50/p99 ms 応答時間の中央値と99パーセンタイル
+#   304        本文なし(304 Not Modified)で応答した割合
+#   renders    HTMLを作成した回数
+#   errors     接続できなかった数
+
+dashboards = 100                                    # 同時に開くダッシュボード数
+duration = 10                                       # 計測時間(秒)
+port = 8080                                         # HTTPポート番号
+interval = 1.01                                     # 値の更新間隔(秒)
+chart = [('Temperature', 'temp', 40), ('Counter', 'counter', 10),
+         ('CO2', 'co2', 2000), ('TVOC', 'tvoc', 5000)]  # ex6_co2_chart.py と同じ
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import sleep, perf_counter                # 時間関連を組み込む
+from multiprocessing import Process                 # 別プロセスでの実行を組み込む
+from ble_httpd import HttpSink                      # HTTPサーバの出力先を組み込む
+import http.client                                  # HTTPクライアントを組み込む
+import threading                                    # スレッド管理を組み込む
+import json                                         # JSON変換を組み込む
+
+modes = (('single', False, False, False), ('threaded', True, False, False),
+         ('cached', True, True, False), ('304', True, True, True))
+
+class Source:                                       # パイプライン相当(値の供給元)
+    def __init__(self):                             # コンストラクタ作成
+        self.values = {'counter': 0, 'temp': 25.0, 'co2': 400, 'tvoc': 0}
+        self.sink = None                            # 出力先
+    def stats(self):                                # 状態の取得
+        return {'http': self.sink.stats()}          # 出力先の状態
+
+def serve(threads, cache):                          # HTTPサーバ(別プロセス)
+    source = Source()                               # 値の供給元
+    sink = source.sink = HttpSink(port, chart, threads=threads, cache=cache, access_log=False)
+    sink.start(source)                              # HTTPサーバを起動
+    i = 0                                           # 更新回数
+    while True:                                     # 永久ループ
+        sleep(interval)                             # 動作間隔だけ待機
+        i += 1                                      # 更新回数を加算
+        values = dict(source.values)                # 前回の値を複製
+        values['counter'] = i // 10 % 12            # 10回ごとに変化する値
+        values['co2'] = 400 + i // 5 % 100          # 5回ごとに変化する値
+        source.values = values                      # 最新の値を更新
+        sink.update(values)                         # 値の更新を通知
+
+def request(path, headers={}):                      # 1回のGET
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:                                            # 例外処理の監視を開始
+        conn.request('GET', path, headers=headers)  # リクエストを送信
+        res = conn.getresponse()                    # 応答を受信
+        body = res.read()                           # 本文を受信
+        return res.status, res.getheader('ETag'), body
+    finally:                                        # 終了時
+        conn.close()                                # 接続を終了
+
+def dashboard(conditional, end, results):           # 1つのダッシュボード
+    etag = None                                     # 前回受け取ったETag
+    while perf_counter() < end:                     # 計測時間の間
+        headers = {'If-None-Match': etag} if conditional and etag else {}
+        start = perf_counter()                      # 計測開始
+        try:                                        # 例外処理の監視を開始
+            status, tag, body = request('/', headers)   # ページを取得
+        except OSError:                             # 接続できなかった時
+            results.append((None, 0.0))             # エラーを記録
+            continue                                # 次の取得へ
+        results.append((status, perf_counter() - start))
+        etag = tag or etag                          # ETagを保持
+
+def measure(threads, cache, conditional):           # 1構成の計測
+    server = Process(target=serve, args=(threads, cache), daemon=True)
+    server.start()                                  # HTTPサーバを起動
+    for i in range(100):                            # 起動を待つ
+        try:                                        # 例外処理の監視を開始
+            request('/')                            # 応答があれば起動済み
+            break                                   # 待機を終了
+        except OSError:                             # 未起動の時
+            sleep(0.05)                             # 待機
+    results = list()                                # (状態,応答時間)の列
+    end = perf_counter() + duration                 # 計測の終了時刻
+    clients = [threading.Thread(target=dashboard, args=(conditional, end, results))
+               for i in range(dashboards)]          # ダッシュボードのスレッド
+    for c in clients:                               # 各ダッシュボードについて
+        c.start()                                   # 取得を開始
+    for c in clients:                               # 各ダッシュボードについて
+        c.join()                                    # 終了を待つ
+    stats = json.loads(request('/stats')[2])['http']    # サーバの状態
+    server.terminate()                              # HTTPサーバを終了
+    server.join()                                   # 終了を待つ
+    times = sorted(t for s, t in results if s)      # 応答時間の列
+    ok = len(times)                                 # 応答数
+    return {'rps': ok / duration, 'p50': times[ok // 2] * 1000 if ok else 0.0,
+            'p99': times[min(int(ok * 0.99), ok - 1)] * 1000 if ok else 0.0,
+            'not_modified': sum(1 for s, t in results if s == 304) / max(ok, 1),
+            'renders': stats['renders'], 'errors': len(results) - ok}
+
+if len(argv) > 1:                                   # 引数がある時
+    dashboards = int(argv[1])                       # ダッシュボード数を設定
+if len(argv) > 2:                                   # 引数がある時
+    duration = float(argv[2])                       # 計測時間を設定
+
+if __name__ == '__main__':                          # 直接実行された時
+    print('dashboards =', dashboards, ', seconds =', duration)
+    print('%-9s %9s %8s %8s %6s %8s %7s' % ('mode', 'req/s', 'p50 ms', 'p99 ms',
+          '304', 'renders', 'errors'))
+    for name, threads, cache, conditional in modes: # 各構成について
+        r = measure(threads, cache, conditional)    # 計測を実行
+        print('%-9s %9.1f %8.1f %8.1f %5.0f%% %8d %7d' % (name, r['rps'], r['p50'],
+              r['p99'], r['not_modified'] * 100, r['renders'], r['errors']))
+
+''' 実行結果の一例 (1コアの環境で、サーバとダッシュボードが同じCPUを使用)
+$ ./bench_httpd.py 100 10
+dashboards = 100 , seconds = 10.0
+mode          req/s   p50 ms   p99 ms    304  renders  errors
+HTTP port 8080
+single       1727.7      2.7   1023.3     0%    17279      52
+HTTP port 8080
+threaded     1495.9     66.1     84.1     0%    14961       0
+HTTP port 8080
+cached       1788.1     55.3     70.0     0%       10       0
+HTTP port 8080
+304          2026.0     47.4     75.2    99%       10       0
+'''
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_multiscan.py
+# アダプタの数を増やした時に、受信できるアドレスがどれだけ増えるかを、
+# 合成したアドバタイジング列(ble_synth.py)で確認します。
+#
+#   同じ列を各アダプタ用に再生し、アダプタごとに取りこぼしを与えます。
+#   デバイスの out_of_range の割合はそのアダプタの受信範囲外(すべて取り
+#   こぼし)、残りは loss の割合で取りこぼします(混雑時の衝突に相当)。
+#   取りこぼしはアダプタごとに独立に決めるため、アダプタを増やすと範囲外の
+#   デバイスを別のアダプタが受信し、受信できるアドレスが増えます。
+#   MultiScanner(ble_multiscan.py)の並べ直しと重複除去も同時に計測します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_multiscan.py [デバイス数] [計測時間(秒)]
+#       ./bench_multiscan.py 200 20
+#
+#【実行結果の見方】
+#   adapters   アダプタの数
+#   events     全アダプタの受信数の合計
+#   merged     重複を除いてコールバック関数へ渡した数
+#   dup        別のアダプタと重複として除いた数
+#   addrs      受信できたアドレス数(truthは列に含まれる実際のアドレス数)
+#   gain       受信できたアドレス数と、最も多いアダプタ単独の数の比
+#   order      時刻順の逆転(前の受信より古い時刻の受信)の数
+
+devices = 200                                       # デバイス数
+duration = 20                                       # 計測時間(秒)
+out_of_range = 0.3                                  # 受信範囲外のデバイスの割合
+loss = 0.5                                          # 範囲内での取りこぼしの割合
+counts = (1, 2, 3)                                  # 比較するアダプタの数
+
+from sys import argv                                # sysから引数取得を組み込む
+from ble_synth import Workload                      # 合成を組み込む
+from ble_record import ReplayScanner, ReplayEntry   # 再生を組み込む
+from ble_multiscan import MultiScanner              # 複数アダプタの受信を組み込む
+import random                                       # 乱数を組み込む
+
+def lossy(workload, seed):                          # 取りこぼしのある列
+    rnd = random.Random(seed)                       # アダプタごとの乱数
+    far = dict()                                    # アドレス→範囲外か
+    records = workload.records()                    # 合成した列
+    yield next(records)                             # 開始時刻
+    for t, dev in records:                          # 各送信について
+        if dev.addr not in far:                     # 初めてのアドレスの時
+            far[dev.addr] = rnd.random() < out_of_range # 範囲外かどうか
+        if far[dev.addr] or rnd.random() < loss:    # 取りこぼした時
+            continue                                # 受信しない
+        yield t, ReplayEntry(dev.addr, dev.addrType, dev.rssi + rnd.randint(-3, 3),
+                             dev.connectable, dev.rawData)
+
+def measure(n):                                     # アダプタn個の計測
+    workload = Workload(devices=devices, duration=duration)
+    scanners = [ReplayScanner(lossy(workload, i + 1)) for i in range(n)]
+    order = [0, 0.0]                                # 逆転数, 前回の時刻
+    def found(dev):                                 # 受信時の処理
+        t = scanner.time                            # 受信時刻
+        if t < order[1]:                            # 前の受信より古い時
+            order[0] += 1                           # 逆転数を加算
+        order[1] = t                                # 前回の時刻を更新
+    scanner = MultiScanner(found, scanners=scanners)
+    try:                                            # 再生の終了を監視
+        while True:                                 # 終了まで
+            scanner.process(1.0)                    # 受信ごとにfoundを実行
+    except EOFError:                                # 再生が終了した時
+        pass                                        # 計測を終了
+    stats = scanner.stats()                         # 受信状況
+    adapters = stats['adapters'].values()           # アダプタごとの状態
+    return {'events': sum(a['events'] for a in adapters), 'merged': stats['events'],
+            'dup': sum(a['duplicates'] for a in adapters), 'addrs': stats['addresses'],
+            'gain': stats['gain'], 'order': order[0],
+            'each': [a['addresses'] for a in adapters]}
+
+if len(argv) > 1:                                   # 引数がある時
+    devices = int(argv[1])                          # デバイス数を設定
+if len(argv) > 2:                                   # 引数がある時
+    duration = float(argv[2])                       # 計測時間を設定
+
+if __name__ == '__main__':                          # 直接実行された時
+    truth = len({dev.addr for t, i, dev in Workload(devices=devices,
+                 duration=duration).generate()})    # 列に含まれるアドレス数
+    print('devices =', devices, ', seconds =', duration, ', truth =', truth, 'addrs')
+    print('%8s %8s %8s %7s %6s %6s %6s  %s' % ('adapters', 'events', 'merged', 'dup',
+          'addrs', 'gain', 'order', 'addrs/adapter'))
+    for n in counts:                                # 各アダプタ数について
+        r = measure(n)                              # 計測を実行
+        print('%8d %8d %8d %7d %6d %6.2f %6d  %s' % (n, r['events'], r['merged'],
+              r['dup'], r['addrs'], r['gain'], r['order'], r['each']))
+
+''' 実行結果の一例 (1コアの環境)
+$ ./bench_multiscan.py 200 20
+devices = 200 , seconds = 20.0 , truth = 206 addrs
+adapters   events   merged     dup  addrs   gain  order  addrs/adapter
+       1     3627     3627       0    144   1.00      0  [144]
+       2     7262     6006    1256    191   1.31      0  [144, 146]
+       3    10753     7488    3265    199   1.36      0  [144, 146, 139]
+'''
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_pipeline.py
+# 合成したアドバタイジング列(ble_synth.py)を ble_pipeline.py の処理に最速で
+# 流し、重複除去・集計の処理性能を計測します。
+#
+#   btle.Scanner の代わりに ble_record.ReplayScanner で再生するため、実機の
+#   無線やroot権限は不要です。条件ごとに別プロセスで実行し、処理速度、
+#   動作間隔ごとの処理時間、30秒ごとの集計時間、メモリ使用量(RSS)を
+#   表示します。--json で結果をファイルに保存し、--compare で前回の結果と
+#   比較すると、性能の低下(回帰)を検出できます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_pipeline.py [オプション] [デバイス数]...
+#       ./bench_pipeline.py 100 1000 5000 --json base.json
+#       ./bench_pipeline.py 100 1000 5000 --compare base.json
+#
+#   --duration 秒   合成する時間(既定300秒)
+#   --rotation 秒   アドレスの変更周期(既定900秒)
+#   --modes 方式    計数方式をカンマ区切りで指定(既定 exact,hll)
+#   --json ファイル 結果をJSON形式で保存
+#   --compare ファイル  保存済みの結果と比較(低下時は終了コード1)
+#   --no-metrics    処理時間などの計測(ble_metrics.py)を行わない
+#
+#【実行結果の見方】
+#   events/s   1秒あたりに処理したアドバタイジング数(合成処理を含む)
+#   tick ms    動作間隔(1.01秒分)ごとの処理時間の中央値と99パーセンタイル
+#   window ms  30秒分の処理時間の最大値(30秒より十分小さいこと)
+#   rss MB     処理後のメモリ使用量(最大値)
+#   counter    30秒ごとのアドレス数の平均(truthは合成側の実数)
+#   corrected  アドレス変更を補正した300秒ごとのデバイス数の平均
+#              (devicesは合成側の実デバイス数、rawは補正前のアドレス数)
+
+devices_list = [100, 1000, 5000]                    # 計測するデバイス数
+modes = ['exact', 'hll']                            # 計測する計数方式
+duration = 300                                      # 合成する時間(秒)
+rotation = 900                                      # アドレスの変更周期(秒)
+tolerance = 0.20                                    # 回帰とみなす低下の割合
+metrics = True                                      # 処理時間などを計測する
+
+from sys import argv, exit                          # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from multiprocessing import Pool                    # 別プロセスでの実行を組み込む
+from ble_pipeline import Pipeline, target_rssi      # パイプラインを組み込む
+from ble_record import ReplayScanner                # 再生を組み込む
+from ble_sinks import Sink                          # 出力先の基底クラス
+from ble_synth import Workload                      # 合成を組み込む
+import subprocess                                   # 外部コマンドを組み込む
+import platform                                     # 実行環境の取得を組み込む
+import resource                                     # メモリ使用量の取得を組み込む
+import json                                         # JSON変換を組み込む
+
+class TimingSink(Sink):                             # 処理時間を計測する出力先
+    def __init__(self):                             # コンストラクタ作成
+        self.ticks = list()                         # 動作間隔ごとの処理時間
+        self.windows = list()                       # 30秒ごとの処理時間
+        self.counters = list()                      # 30秒ごとのデバイス数
+        self.corrected = list()                     # 補正後と補正前の300秒の値
+        self.last = self.last_window = perf_counter()
+    def update(self, values):                       # 動作間隔ごとの処理
+        now = perf_counter()                        # 現在の時刻
+        self.ticks.append(now - self.last)          # 処理時間を保持
+        self.last = now                             # 時刻を更新
+    def window(self, values):                       # 集計時の処理
+        now = perf_counter()                        # 現在の時刻
+        self.windows.append(now - self.last_window) # 処理時間を保持
+        self.last_window = now                      # 時刻を更新
+        self.counters.append(values['counter'])     # デバイス数を保持
+        if values.get('corrected_300s') is not None:    # 補正後の値がある時
+            self.corrected.append((values['corrected_300s'], values['counter_300s']))
+
+def percentile(values, p):                          # パーセンタイル値
+    values = sorted(values)                         # 昇順に並べ替え
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+def run(devices, mode):                             # 1条件の計測(別プロセス)
+    workload = Workload(devices=devices, rotation=rotation, duration=duration)
+    scanner = ReplayScanner(workload.records(), speed=0)    # 最速で再生
+    sink = TimingSink()                             # 処理時間の計測
+    pipeline = Pipeline([sink], count_mode=mode, scanner=scanner, clock=scanner.clock,
+                        metrics=metrics)            # パイプラインを生成
+    start = perf_counter()                          # 計測開始
+    pipeline.run()                                  # 最後まで再生
+    elapsed = perf_counter() - start                # 処理時間
+    truth = workload.truth(pipeline.MAC.spans[0], target_rssi)
+    devices_300s = workload.truth(300, target_rssi, devices=True)   # 実デバイス数
+    corrected = sink.corrected[9::10] or sink.corrected[-1:] or [(0, 0)]
+    return {'devices': devices, 'mode': mode, 'seconds': duration,
+            'rotation': rotation, 'events': scanner.events,
+            'elapsed': round(elapsed, 3),
+            'events_per_s': round(scanner.events / elapsed, 1),
+            'tick_ms_p50': round(percentile(sink.ticks, 0.5) * 1000, 3),
+            'tick_ms_p99': round(percentile(sink.ticks, 0.99) * 1000, 3),
+            'window_ms_max': round(max(sink.windows, default=0.0) * 1000, 1),
+            'rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'counter': round(sum(sink.counters) / max(len(sink.counters), 1), 1),
+            'truth': round(sum(truth) / max(len(truth), 1), 1),
+            'corrected': round(sum(c for c, r in corrected) / len(corrected), 1),
+            'raw_300s': round(sum(r for c, r in corrected) / len(corrected), 1),
+            'devices_300s': round(sum(devices_300s) / max(len(devices_300s), 1), 1)}
+
+def version():                                      # 計測した版(gitのコミット)
+    try:                                            # 例外処理の監視を開始
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:                                 # gitが無い時
+        return None                                 # 版は不明
+
+def compare(results, path):                         # 保存済みの結果と比較
+    with open(path) as fp:                          # ファイルを開く
+        base = json.load(fp)                        # 保存済みの結果
+    old = {(r['devices'], r['mode']): r for r in base['results']}
+    regressed = False                               # 低下の有無
+    print('compare with', path, '(%s)' % base.get('version'))
+    for r in results:                               # 各条件について
+        o = old.get((r['devices'], r['mode']))      # 同じ条件の結果
+        if o is None:                               # 前回に無い条件の時
+            continue                                # 比較しない
+        speed = r['events_per_s'] / o['events_per_s']   # 処理速度の比
+        memory = r['rss_mb'] / o['rss_mb']          # メモリ使用量の比
+        bad = speed < 1 - tolerance or memory > 1 + tolerance
+        regressed |= bad                            # 低下を記録
+        print('%7d %-6s events/s x%.2f, rss x%.2f%s' % (r['devices'], r['mode'],
+              speed, memory, '  REGRESSION' if bad else ''))
+    return regressed                                # 低下の有無を応答
+
+args = argv[1:]                                     # 引数の列
+if '--no-metrics' in args:                          # 計測しない時
+    metrics = False                                 # 計測を停止
+    args.remove('--no-metrics')                     # オプションを削除
+options = dict()                                    # オプションの値
+for name in ('--duration', '--rotation', '--modes', '--json', '--compare'):
+    if name in args:                                # オプションがある時
+        i = args.index(name)                        # オプションの位置
+        options[name] = args[i + 1]                 # 値を保持
+        del args[i:i + 2]                           # オプションを削除
+if '--duration' in options:                         # 合成する時間の指定
+    duration = float(options['--duration'])         # 合成する時間を設定
+if '--rotation' in options:                         # 変更周期の指定
+    rotation = float(options['--rotation'])         # 変更周期を設定
+if '--modes' in options:                            # 計数方式の指定
+    modes = options['--modes'].split(',')           # 計数方式を設定
+if args:                                            # デバイス数の指定がある時
+    devices_list = [int(a) for a in args]           # デバイス数を設定
+
+if __name__ == '__main__':                          # 直接実行された時
+    results = list()                                # 計測結果
+    print('seconds =', duration, ', rotation =', rotation)
+    print('%7s %-6s %10s %8s %8s %10s %7s %8s %8s %9s %8s %8s' % ('devices', 'mode',
+          'events/s', 'tick p50', 'tick p99', 'window ms', 'rss MB', 'counter', 'truth',
+          'corrected', 'devices', 'raw'))
+    for devices in devices_list:                    # 各デバイス数について
+        for mode in modes:                          # 各計数方式について
+            with Pool(1, maxtasksperchild=1) as pool:   # 計測ごとに新しいプロセス
+                r = pool.apply(run, (devices, mode))    # 計測を実行
+            results.append(r)                       # 結果を保持
+            print('%7d %-6s %10.1f %8.3f %8.3f %10.1f %7.1f %8.1f %8.1f %9.1f %8.1f %8.1f' % (
+                r['devices'], r['mode'], r['events_per_s'], r['tick_ms_p50'],
+                r['tick_ms_p99'], r['window_ms_max'], r['rss_mb'], r['counter'], r['truth'],
+                r['corrected'], r['devices_300s'], r['raw_300s']))
+    report = {'version': version(), 'python': platform.python_version(),
+              'machine': platform.machine(), 'results': results}
+    if '--json' in options:                         # 保存先の指定がある時
+        with open(options['--json'], 'w') as fp:    # ファイルを作成
+            json.dump(report, fp, indent=1)         # JSON形式で保存
+    if '--compare' in options and compare(results, options['--compare']):
+        exit(1)                                     # 低下時は終了コード1
+
+''' 実行結果の一例
+$ ./bench_pipeline.py 100 1000 5000 --duration 120
+seconds = 120.0 , rotation = 900
+devices mode     events/s tick p50 tick p99  window ms  rss MB  counter    truth corrected  devices      raw
+    100 exact     79962.4    1.609    9.563       97.8    28.4     98.2     98.2      98.0     97.0    111.0
+    100 hll       91328.5    1.276    7.016       90.1    29.5    100.5     98.2       0.0     97.0      0.0
+   1000 exact    146892.1   16.694   26.654      539.6    34.4    949.0    949.0     947.0    945.0   1058.0
+   1000 hll      237453.0   10.360   14.115      321.8    34.3    957.8    949.0       0.0    945.0      0.0
+   5000 exact    124512.8  101.048  120.814     3059.3    54.8   4758.2   4758.2    4763.0   4751.0   5263.0
+   5000 hll      209180.0   59.741   72.368     1827.7    49.8   4819.5   4758.2       0.0   4751.0      0.0
+$ ./bench_pipeline.py 1000 --duration 900 --rotation 300 --modes exact
+seconds = 900.0 , rotation = 300.0
+devices mode     events/s tick p50 tick p99  window ms  rss MB  counter    truth corrected  devices      raw
+   1000 exact    142276.1   17.611   23.024      543.3    36.3   1000.7   1001.3     964.7    959.3   1801.7
+$ ./bench_pipeline.py 100 1000 --duration 120 --json base.json
+    (中略)
+$ ./bench_pipeline.py 100 1000 --duration 120 --compare base.json
+    (中略)
+compare with base.json (d9281df-dirty)
+    100 exact  events/s x1.02, rss x1.00
+    100 hll    events/s x1.01, rss x1.00
+   1000 exact  events/s x1.03, rss x1.00
+   1000 hll    events/s x0.97, rss x1.00
+'''
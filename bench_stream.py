@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_stream.py
+# scanner.scan(interval)のループと連続スキャン(StreamScanner)を比較します。
+#
+#   実機の無線は使わず、合成したアドバタイジング列を仮想時刻で再生します。
+#   scan()方式では、スキャンの停止・再開と処理時間の間に届いた
+#   アドバタイジングが失われます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_stream.py [デバイス数] [再生時間(秒)] [再開時間(秒)]
+#
+#【実行結果の見方】
+#   events/s   アプリケーションに届いたアドバタイジング数(1秒あたり)
+#   heard      送信されたアドバタイジングのうち受信できた割合
+#   distinct   30秒ごとの発見デバイス数の平均(truthは送信側の実数)
+
+devices_n = 200                                     # 合成するデバイス数
+duration = 120                                      # 再生時間(秒)
+restart_gap = 0.1                                   # scan()の停止・再開時間(秒)
+interval = 1.01                                     # 動作間隔(秒)
+target_rssi = -80                                   # 最低受信強度
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from ble_stream import StreamScanner                # 連続スキャンを組み込む
+import random                                       # 乱数を組み込む
+
+class ReplayEntry:                                  # ScanEntry相当のクラス
+    def __init__(self, addr, rssi):                 # コンストラクタ作成
+        self.addr = addr                            # アドレス
+        self.addrType = 'random'                    # アドレス種別
+        self.rssi = rssi                            # 受信強度
+        self.connectable = False                    # 接続可否
+
+class ReplayScanner:                                # btle.Scanner相当のクラス
+    def __init__(self, events):                     # コンストラクタ作成
+        self.events = events                        # (時刻, ReplayEntry)の列
+        self.pos = 0                                # 次に再生する位置
+        self.clock = 0.0                            # 仮想時刻(秒)
+        self.heard = 0                              # 受信できた数
+        self.delegate = None                        # デリゲート
+        self.scanned = dict()                       # 受信済みデバイス
+    def withDelegate(self, delegate):               # デリゲートの登録
+        self.delegate = delegate                    # デリゲートを保持
+        return self                                 # 自身を応答
+    def clear(self):                                # 受信済みデバイスの消去
+        self.scanned = dict()                       # 辞書を空にする
+    def start(self, passive=False):                 # スキャン開始
+        pass                                        # 仮想時刻では処理なし
+    def stop(self):                                 # スキャン停止
+        pass                                        # 仮想時刻では処理なし
+    def skip(self, seconds):                        # スキャン停止中の経過
+        self.clock += seconds                       # 仮想時刻を進める
+        while self.pos < len(self.events) and self.events[self.pos][0] < self.clock:
+            self.pos += 1                           # 受信できずに失われる
+    def process(self, timeout):                     # timeout秒間の受信処理
+        self.clock += timeout                       # 仮想時刻を進める
+        while self.pos < len(self.events) and self.events[self.pos][0] < self.clock:
+            dev = self.events[self.pos][1]          # 受信したデバイス
+            self.pos += 1                           # 次の位置へ
+            self.heard += 1                         # 受信数を加算
+            self.scanned[dev.addr] = dev            # 受信済みに追加
+            if self.delegate is not None:           # デリゲート登録時
+                self.delegate.handleDiscovery(dev, True, True)
+    def scan(self, timeout):                        # scan()方式の受信処理
+        self.clear()                                # 受信済みデバイスを消去
+        self.process(timeout)                       # timeout秒間の受信処理
+        self.skip(restart_gap)                      # 停止・再開中は受信不可
+        return list(self.scanned.values())          # 発見したデバイスを応答
+
+def synth(n, seconds, seed=1):                      # アドバタイジング列の合成
+    rnd = random.Random(seed)                       # 再現可能な乱数
+    events = list()                                 # (時刻, ReplayEntry)の列
+    for i in range(n):                              # 各デバイスについて
+        addr = ':'.join('%02x' % rnd.randrange(256) for j in range(6))
+        dev = ReplayEntry(addr, int(rnd.gauss(-72, 8)))
+        adv = rnd.uniform(0.1, 2.0)                 # 送信間隔(秒)
+        t = rnd.uniform(0, adv)                     # 最初の送信時刻
+        while t < seconds:                          # 再生時間内について
+            events.append((t, dev))                 # 送信を追加
+            t += adv + rnd.uniform(0, 0.01)         # 次の送信(advDelay付き)
+    events.sort(key=lambda e: e[0])                 # 時刻順に並べ替え
+    return events                                   # 合成結果を応答
+
+def truth(events, seconds):                         # 30秒ごとの実デバイス数
+    windows = dict()                                # 窓番号ごとのアドレス集合
+    for t, dev in events:                           # 各送信について
+        if dev.rssi >= target_rssi:                 # 受信強度が閾値以上の時
+            windows.setdefault(int(t // 30), set()).add(dev.addr)
+    return sum(len(s) for s in windows.values()) / max(len(windows), 1)
+
+def run_loop(events):                               # scan()ループ方式
+    scanner = ReplayScanner(events)                 # 再生用scannerを生成
+    delivered = 0                                   # アプリに届いた数
+    counts = list()                                 # 30秒ごとのカウント値
+    MAC = list()                                    # アドレス保存用の配列変数
+    time_prev = 0.0                                 # 窓の開始時刻
+    while scanner.clock < duration:                 # 再生時間内について
+        devices = scanner.scan(interval)            # BLEアドバタイジング取得
+        start = perf_counter()                      # 処理時間の計測開始
+        for dev in devices:                         # 発見した各デバイスについて
+            delivered += 1                          # 届いた数を加算
+            if dev.rssi < target_rssi:              # 受信強度が閾値未満の時
+                continue                            # forループの先頭に戻る
+            if dev.addr not in MAC:                 # アドレスが配列内に無い時
+                MAC.append(dev.addr)                # 配列変数にアドレスを追加
+        if time_prev + 30 <= scanner.clock:         # 30秒以上経過した時
+            counts.append(len(MAC))                 # カウント値を保持
+            MAC = list()                            # アドレスを廃棄
+            time_prev = scanner.clock               # 窓の開始時刻を更新
+        scanner.skip(perf_counter() - start)        # 処理中はスキャン停止
+    return delivered, scanner.heard, counts         # 結果を応答
+
+def run_stream(events):                             # 連続スキャン方式
+    replay = ReplayScanner(events)                  # 再生用scannerを生成
+    MAC = set()                                     # アドレス保存用の集合
+    counts = list()                                 # 30秒ごとのカウント値
+    def found(dev):                                 # アドバタイジング受信時
+        if dev.rssi >= target_rssi:                 # 受信強度が閾値以上の時
+            MAC.add(dev.addr)                       # アドレスを追加
+    scanner = StreamScanner(found, scanner=replay)  # 連続スキャンを生成
+    time_prev = 0.0                                 # 窓の開始時刻
+    while replay.clock < duration:                  # 再生時間内について
+        delivered = scanner.process(interval)       # 受信ごとにfoundを実行
+        if time_prev + 30 <= replay.clock:          # 30秒以上経過した時
+            counts.append(len(MAC))                 # カウント値を保持
+            MAC.clear()                             # アドレスを廃棄
+            time_prev = replay.clock                # 窓の開始時刻を更新
+    scanner.stop()                                  # スキャンを停止
+    return delivered, replay.heard, counts          # 結果を応答
+
+if len(argv) > 1:                                   # 引数がある時
+    devices_n = int(argv[1])                        # デバイス数を設定
+if len(argv) > 2:                                   # 引数がある時
+    duration = float(argv[2])                       # 再生時間を設定
+if len(argv) > 3:                                   # 引数がある時
+    restart_gap = float(argv[3])                    # 再開時間を設定
+
+events = synth(devices_n, duration)                 # アドバタイジング列を合成
+sent = sum(1 for t, dev in events if t < duration)  # 送信された数
+print('devices =', devices_n, ', seconds =', duration, ', sent =', sent, end=', ')
+print('truth = %.1f distinct/30s' % truth(events, duration))
+print('%-8s %10s %8s %10s' % ('mode', 'events/s', 'heard', 'distinct'))
+for name, run in (('loop', run_loop), ('stream', run_stream)):
+    delivered, heard, counts = run(events)          # 再生を実行
+    print('%-8s %10.1f %7.1f%% %10.1f' % (name, delivered / duration,
+        100 * heard / sent, sum(counts) / max(len(counts), 1)))
+
+''' 実行結果の一例
+$ ./bench_stream.py
+devices = 200 , seconds = 120 , sent = 39617, truth = 179.0 distinct/30s
+mode       events/s    heard   distinct
+loop          151.0    91.0%      179.0
+stream        330.1   100.0%      179.0
+$ ./bench_stream.py 1000 60 0.2
+devices = 1000 , seconds = 60.0 , sent = 93436, truth = 868.0 distinct/30s
+mode       events/s    heard   distinct
+loop          692.0    83.1%      867.5
+stream       1557.3   100.0%      868.0
+'''
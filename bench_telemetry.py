@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Benchmark bench_telemetry.py
+# ノードから集計用のPC(ble_collector.py)へ送る値の形式について、通信量と
+# 作成・分解に要する時間を比較します。
+#
+#   csv      従来のテキスト形式(UdpSink、1サンプル1行1パケット)
+#   binary   バイナリ形式(ble_telemetry.py、集計ごとに batch サンプルを
+#            1パケットにまとめる、スケッチなし)
+#
+#   どちらも動作間隔ごとの値(サンプル)を送る場合で比較します(テキスト形式で
+#   同じ細かさの値を送るには、1サンプルごとに1パケットが必要です)。
+#   分解は受信側が値を取り出すまで(csvは項目の分割と数値への変換、binaryは
+#   Decoder.feed)を計測します。loopback は実際にUDP(127.0.0.1)で送り、
+#   受信側のスレッドが分解できた1秒あたりのサンプル数です。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./bench_telemetry.py [サンプル数]
+#       ./bench_telemetry.py 300000
+#
+#【実行結果の見方】
+#   bytes/smp  1サンプルあたりのUDPの本文のバイト数
+#   pkts/smp   1サンプルあたりのパケット数
+#   enc us     1サンプルの作成に要した時間(マイクロ秒)
+#   dec us     1サンプルの分解に要した時間(マイクロ秒)
+#   loopback   UDPで送受信し、受信側が分解できたサンプル数(1秒あたり)
+#   recv       送ったサンプルのうち分解できた割合(送信側は待たずに送り続けるため、
+#              受信が追いつかない分は受信バッファからあふれます)
+
+samples = 300000                                    # 計測するサンプル数
+batch = 30                                          # 1パケットのサンプル数(30秒分)
+port = 11024                                        # loopback計測のポート番号
+loopback_seconds = 3                                # loopback計測の時間(秒)
+
+from sys import argv                                # sysから引数取得を組み込む
+from time import perf_counter                       # 処理時間の計測を組み込む
+from ble_telemetry import encode, to_sample, Decoder    # バイナリ形式を組み込む
+import threading                                    # スレッド管理を組み込む
+import socket                                       # ソケット通信を組み込む
+import random                                       # 乱数を組み込む
+
+def make_values(n):                                 # 値(サンプル)の列を合成
+    rnd = random.Random(1)                          # 再現可能な乱数
+    return [(1600000000 + i, {'temp': round(rnd.uniform(18, 30), 1),
+             'co2': rnd.randrange(400, 2000), 'tvoc': rnd.randrange(0, 1000),
+             'counter': rnd.randrange(0, 200)}) for i in range(n)]
+
+def csv_encode(values):                             # テキスト形式で作成
+    packets = list()                                # パケットの列
+    for t, v in values:                             # 各サンプルについて
+        udp_s = 'e_co2_3, ' + str(v.get('temp', 0)) + ', 0, 0, '   # UdpSinkと同じ
+        udp_s += str(v.get('co2', 0)) + ', ' + str(v.get('tvoc', 0))
+        udp_s += ', ' + str(v['counter'])           # カウンタ値を追加
+        packets.append((udp_s + '\n').encode())     # 1行1パケット
+    return packets                                  # パケットの列を応答
+
+def csv_decode(data):                               # テキスト形式を分解
+    fields = [f.strip() for f in data.decode().split(',')]  # ble_collector.pyと同じ
+    return [(fields[0], float(fields[1]), int(fields[4]), int(fields[5]), int(fields[6]))]
+
+def binary_encode(values):                          # バイナリ形式で作成
+    packets = list()                                # パケットの列
+    for i in range(0, len(values), batch):          # batchサンプルごとに
+        packets.append(encode('e_co2_3', i // batch,
+                              [to_sample(t, v) for t, v in values[i:i + batch]]))
+    return packets                                  # パケットの列を応答
+
+def binary_decode(data, decoder=Decoder()):         # バイナリ形式を分解
+    return decoder.feed(data)['samples']            # サンプルの列
+
+def loopback(packets, decode, per):                 # UDPで送受信
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    rx.bind(('127.0.0.1', port))                    # 受信用のソケット
+    rx.settimeout(0.5)                              # 送信の終了の検出用
+    received = [0]                                  # 分解できたサンプル数
+    def receiver():                                 # 受信スレッド
+        try:                                        # 例外処理の監視を開始
+            while True:                             # タイムアウトまで
+                received[0] += len(decode(rx.recv(65536)))
+        except socket.timeout:                      # 送信が終わった時
+            pass                                    # 受信を終了
+    thread = threading.Thread(target=receiver)      # 受信スレッド
+    thread.start()                                  # 受信を開始
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0                                        # 送信したサンプル数
+    start = perf_counter()                          # 計測開始
+    end = start + loopback_seconds                  # 計測の終了時刻
+    while perf_counter() < end:                     # 計測時間の間
+        for data in packets[:1000]:                 # 1000パケットずつ
+            tx.sendto(data, ('127.0.0.1', port))    # UDP送信
+        sent += per * 1000                          # 送信したサンプル数
+    elapsed = perf_counter() - start                # 送信に要した時間
+    thread.join()                                   # 受信の終了を待つ
+    rx.close()                                      # ソケットを閉じる
+    tx.close()                                      # ソケットを閉じる
+    return received[0] / elapsed, received[0] / sent
+
+def measure(name, encoder, decoder, values):        # 1形式の計測
+    start = perf_counter()                          # 計測開始
+    packets = encoder(values)                       # パケットを作成
+    enc = perf_counter() - start                    # 作成に要した時間
+    start = perf_counter()                          # 計測開始
+    n = sum(len(decoder(data)) for data in packets) # 分解したサンプル数
+    dec = perf_counter() - start                    # 分解に要した時間
+    rate, ratio = loopback(packets, decoder, n // len(packets))   # UDPで送受信
+    print('%-7s %10.1f %9.3f %7.2f %7.2f %10.0f/s %4.0f%%' % (name,
+          sum(map(len, packets)) / n, len(packets) / n, enc / n * 1e6, dec / n * 1e6,
+          rate, ratio * 100))
+
+if len(argv) > 1:                                   # 引数がある時
+    samples = int(argv[1])                          # サンプル数を設定
+
+if __name__ == '__main__':                          # 直接実行された時
+    values = make_values(samples)                   # 値の列を合成
+    print('samples =', samples, ', batch =', batch)
+    print('%-7s %10s %9s %7s %7s %12s %5s' % ('format', 'bytes/smp', 'pkts/smp',
+          'enc us', 'dec us', 'loopback', 'recv'))
+    measure('csv', csv_encode, csv_decode, values) # テキスト形式
+    measure('binary', binary_encode, binary_decode, values)    # バイナリ形式
+
+''' 実行結果の一例 (1コアの環境で、送信側と受信側が同じCPUを使用)
+$ ./bench_telemetry.py 300000
+samples = 300000 , batch = 30
+format   bytes/smp  pkts/smp  enc us  dec us     loopback  recv
+csv           35.0     1.000    1.69    2.71     107398/s   70%
+binary        12.6     0.033    3.02    0.46    1005935/s   21%
+'''
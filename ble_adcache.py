@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE AD Cache ble_adcache.py
+# アドバタイジングのデータ(AD)の変換結果を、生データをキーとして保持します。
+#
+#   同じビーコンは同じ内容のADを1分間に数百回も送信しますが、getScanData()
+#   は受信ごとに(タイプ,名前,値)の列と16進数の文字列を作り直します。
+#   本モジュールでは、ADの生データをキーとするLRUキャッシュに変換結果
+#   (Advertisement)を保持し、同じ内容の2回目以降は変換を行いません。
+#   bluepy の rawData は最後に受信したパケット(アドバタイジングかスキャン
+#   応答)だけのため、両方をまとめた scanData からキーを作ります。
+#   各項目(Flags、送信電力、メーカ固有データ、サービスデータ、デバイス名)は
+#   参照された時に初めて変換し、その結果も保持します。
+#   stats() でキャッシュのヒット率を確認できます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_adcache import AdCache
+#   ads = AdCache()                                 # キャッシュを生成
+#   ad = ads.decode(dev)                            # ScanEntryのADを取得
+#   print(ad.local_name, ad.tx_power)               # 'nRF5x' -12 (無い時はNone)
+#   print(ad.manufacturer)                          # (0x0059, b'\x8c\x5d...')
+#   for d in ads.scan_data(dev):                    # getScanData()と同じ形式
+#       print(d[0], d[1], '=', d[2])
+#   print(ads.stats())                              # {'hit_ratio': 0.98, ...}
+
+maxsize = 1024                                      # 保持するADの種類数
+
+from collections import OrderedDict                 # 順序付き辞書を組み込む
+try:                                                # 例外処理の監視を開始
+    from functools import cached_property           # 参照時の変換を組み込む
+except ImportError:                                 # Python 3.7以前の時
+    class cached_property:                          # 参照時に1度だけ変換する属性
+        def __init__(self, func):                   # コンストラクタ作成
+            self.func = func                        # 変換する関数
+            self.name = func.__name__               # 属性名
+        def __get__(self, obj, cls=None):           # 属性の参照時
+            if obj is None:                         # クラスから参照した時
+                return self                         # 自分を応答
+            value = obj.__dict__[self.name] = self.func(obj)    # 次回からは保持した値
+            return value                            # 変換結果を応答
+from ble_record import parse_ad, uuid_text, merged_ad   # ADの変換を組み込む
+
+class Advertisement:                                # 1種類のADの変換結果
+    def __init__(self, raw):                        # コンストラクタ作成
+        self.raw = raw                              # ADの生データ
+    @cached_property
+    def fields(self):                               # タイプ→データの列
+        fields = dict()                             # 変換結果
+        raw, i = self.raw, 0                        # 生データと読み出し位置
+        while i + 1 < len(raw):                     # ADが残っている間
+            n = raw[i]                              # ADの長さ(タイプを含む)
+            if n == 0 or i + 1 + n > len(raw):      # 終端または途中の時
+                break                               # 変換を終了
+            fields.setdefault(raw[i + 1], []).append(raw[i + 2:i + 1 + n])
+            i += 1 + n                              # 次のADへ
+        return fields                               # {タイプ: [データ,...]}
+    def field(self, tag):                           # タイプの最初のデータ
+        data = self.fields.get(tag)                 # タイプのデータの列
+        return data[0] if data else None            # 無い時はNone
+    @cached_property
+    def flags(self):                                # Flags(整数)
+        data = self.field(0x01)                     # Flagsのデータ
+        return data[0] if data else None            # 無い時はNone
+    @cached_property
+    def tx_power(self):                             # 送信電力(dBm)
+        data = self.field(0x0a)                     # 送信電力のデータ
+        return int.from_bytes(data[:1], 'little', signed=True) if data else None
+    @cached_property
+    def manufacturer(self):                         # (メーカID, データ)
+        data = self.field(0xff)                     # メーカ固有データ
+        if data is None or len(data) < 2:           # 無い時
+            return None                             # Noneを応答
+        return (int.from_bytes(data[:2], 'little'), data[2:])
+    @cached_property
+    def service_data(self):                         # {UUID文字列: データ}
+        services = dict()                           # 変換結果
+        for tag, size in ((0x16, 2), (0x20, 4), (0x21, 16)):    # 16/32/128ビット
+            for data in self.fields.get(tag, ()):   # 各サービスデータについて
+                services[uuid_text(data[:size])] = data[size:]
+        return services                             # 変換結果を応答
+    @cached_property
+    def local_name(self):                           # デバイス名(文字列)
+        data = self.field(0x09) or self.field(0x08) # 完全名または短縮名
+        return None if data is None else data.decode('utf-8', 'replace')
+    @cached_property
+    def scan_data(self):                            # getScanData()と同じ形式
+        return parse_ad(self.raw)                   # (タイプ,名前,値)の列
+
+class AdCache:                                      # クラスAdCacheの定義
+    def __init__(self, maxsize=maxsize):            # コンストラクタ作成
+        self.maxsize = maxsize                      # 保持するADの種類数
+        self.cache = OrderedDict()                  # 生データ→Advertisement
+        self.hits = 0                               # キャッシュにあった数
+        self.misses = 0                             # キャッシュに無かった数
+        self.evictions = 0                          # 古い順に削除した数
+    def get(self, raw):                             # 生データの変換結果
+        ad = self.cache.get(raw)                    # キャッシュを参照
+        if ad is not None:                          # キャッシュにある時
+            self.hits += 1                          # ヒット数を加算
+            self.cache.move_to_end(raw)             # 最も新しい位置へ移動
+            return ad                               # 変換結果を応答
+        self.misses += 1                            # ミス数を加算
+        ad = self.cache[raw] = Advertisement(raw)   # 新しい変換結果
+        if len(self.cache) > self.maxsize:          # 上限を超えた時
+            self.cache.popitem(last=False)          # 最も古いものを削除
+            self.evictions += 1                     # 削除数を加算
+        return ad                                   # 変換結果を応答
+    def decode(self, dev):                          # ScanEntryのAD
+        return self.get(merged_ad(dev))             # まとめたADで検索
+    def scan_data(self, dev):                       # getScanData()の代わり
+        if getattr(dev, 'rawData', None) is None and not getattr(dev, 'scanData', None):
+            return dev.getScanData()                # 従来どおり取得
+        return self.decode(dev).scan_data           # 保持した変換結果
+    def stats(self):                                # 状態の取得
+        total = self.hits + self.misses             # 参照した数
+        return {'entries': len(self.cache), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 3) if total else None}
+    def __len__(self):                              # len()は保持中の種類数
+        return len(self.cache)                      # 種類数を応答
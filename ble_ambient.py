@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Ambient ble_ambient.py
+# BLEビーコン数とセンサ値をクラウドサービスAmbientへまとめて送信します。
+#
+#   ・counter, co2, tvoc, temp を d1～d8 に割り当てて1件のデータにします
+#   ・データを貯めておき、一括送信用のAPI(dataarray)でまとめて送ります
+#   ・HTTP(S)の接続を切らずに再利用します(keep-alive)
+#   ・1日あたりの登録件数の上限(quota)を超えないよう、残り件数と残り時間
+#     から記録間隔を自動で広げます。本日の登録件数はスプールの隣のファイル
+#     に保存し、再起動しても上限を超えないようにします
+#   ・データはいったんスプール(ble_spool.py)に保存し、送信に成功した分だけ
+#     消します。回線断や再起動の後も、古い順にまとめて再送します
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【参考文献】
+#   https://ambidata.io/refs/spec/
+#       1チャネルあたりのデータ登録は1日3,000件まで、送信間隔は5秒以上
+
+ambient_chid='0000'                                 # ここにAmbientで取得したチャネルIDを入力
+ambient_wkey='0123456789abcdef'                     # ここにはライトキーを入力
+ambient_fields = {'d1':'counter', 'd2':'co2', 'd3':'tvoc', 'd4':'temp'}
+                                                    # ↑データ番号と値の名前
+ambient_url = 'https://ambidata.io'                 # 送信先(試験時は差し替え)
+quota = 3000                                        # 1日あたりの登録件数の上限
+batch = 10                                          # 一括送信する件数
+flush_interval = 300                                # 一括送信の最大間隔(秒)
+min_interval = 5                                    # 送信間隔の下限(秒)
+drain_batch = 100                                   # 再送時に一括送信する件数
+
+from ble_sinks import Sink                          # 出力先の基底クラス
+from ble_delivery import DeliveryWorker             # 送信スレッドを組み込む
+from ble_spool import open_spool, spool_dir         # スプールを組み込む
+from urllib.parse import urlsplit                   # URLの分解を組み込む
+from time import time, localtime, strftime, mktime, sleep   # 時間取得を組み込む
+import http.client                                  # HTTP通信を組み込む
+import json                                         # JSON変換を組み込む
+import os                                           # ファイル操作を組み込む
+
+class AmbientConnection:                            # 接続を再利用する送信処理
+    def __init__(self, url):                        # コンストラクタ作成
+        url = urlsplit(url)                         # URLを分解
+        self.https = (url.scheme == 'https')        # HTTPSかどうか
+        self.host = url.hostname                    # 送信先のホスト名
+        self.port = url.port                        # 送信先のポート番号
+        self.conn = None                            # 接続(未接続はNone)
+        self.connects = 0                           # 接続した回数
+    def post(self, path, body, timeout):            # JSONをPOSTする
+        if self.conn is None:                       # 未接続の時
+            if self.https:                          # HTTPSの時
+                self.conn = http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+            else:                                   # HTTPの時
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+            self.connects += 1                      # 接続回数を加算
+        head = {'Content-Type':'application/json', 'Connection':'keep-alive'}
+        try:                                        # 例外処理の監視を開始
+            self.conn.request('POST', path, json.dumps(body).encode(), head)
+            res = self.conn.getresponse()           # 応答を取得
+            res.read()                              # 接続再利用のため読み切る
+        except Exception:                           # 例外処理発生時
+            self.close()                            # 次回は接続し直す
+            raise                                   # 例外を送信スレッドへ
+        if res.will_close:                          # サーバが切断する時
+            self.close()                            # 次回は接続し直す
+        if res.status >= 300:                       # エラー応答の時
+            raise Exception('HTTP %d %s' % (res.status, res.reason))
+    def close(self):                                # 切断用メソッド
+        if self.conn is not None:                   # 接続中の時
+            self.conn.close()                       # 切断
+            self.conn = None                        # 未接続に設定
+
+class AmbientSink(Sink):                            # Ambient送信用の出力先
+    def __init__(self, chid=ambient_chid, wkey=ambient_wkey, fields=ambient_fields,
+                 url=ambient_url, quota=quota, batch=batch,
+                 flush_interval=flush_interval, clock=time, spool_dir=spool_dir):
+        self.path = '/api/v2/channels/' + chid + '/dataarray'   # 一括送信先
+        self.wkey = wkey                            # ライトキー
+        self.fields = fields                        # データ番号と値の名前
+        self.quota = quota                          # 1日の登録件数の上限
+        self.batch = batch                          # 一括送信する件数
+        self.flush_interval = flush_interval        # 一括送信の最大間隔(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.conn = AmbientConnection(url)          # 接続を再利用する送信処理
+        self.spool = open_spool(spool_dir and os.path.join(spool_dir, 'ambient_' + chid))
+        self.quota_file = spool_dir and os.path.join(spool_dir, 'ambient_' + chid + '.quota')
+        self.worker = DeliveryWorker(self.send, name='ambient', policy='drop_oldest')
+        self.buffered = 0                           # 前回の一括送信後の件数
+        self.day = None                             # 登録件数を数えている日
+        self.used = 0                               # 本日の登録件数
+        self.skipped = 0                            # 上限のため見送った件数
+        self.next_record = 0                        # 次に記録できる時刻
+        self.last_flush = clock()                   # 前回の一括送信時刻
+        self.quota_errors = 0                       # 登録件数の保存・読込の失敗数
+        self.load_quota()                           # 前回の起動時の登録件数
+    def load_quota(self):                           # 登録件数を読み込む
+        if not self.quota_file:                     # 保存先が無い時
+            return                                  # 0から数える
+        try:                                        # 例外処理の監視を開始
+            with open(self.quota_file) as fp:       # ファイルを開く
+                day, used = fp.read().split()       # 日付と登録件数
+            self.day, self.used = day, int(used)    # 日付が同じなら続きから数える
+        except FileNotFoundError:                   # 保存が無い時
+            pass                                    # 0から数える
+        except (OSError, ValueError):               # 読めない・壊れている時
+            self.quota_errors += 1                  # 失敗数を加算
+            self.day, self.used = None, 0           # 0から数える
+    def save_quota(self):                           # 登録件数を保存
+        if not self.quota_file:                     # 保存先が無い時
+            return                                  # 保存しない
+        try:                                        # 例外処理の監視を開始
+            with open(self.quota_file + '.tmp', 'w') as fp:
+                fp.write('%s %d\n' % (self.day, self.used))    # 日付と登録件数
+            os.replace(self.quota_file + '.tmp', self.quota_file)   # 一括で置き換え
+        except OSError:                             # 書き込めない時
+            self.quota_errors += 1                  # 失敗数を加算
+    def send(self, item, timeout):                  # 送信スレッドでの送信処理
+        while True:                                 # スプールが空になるまで
+            records = self.spool.peek(drain_batch)  # 古い順に取得
+            if not records:                         # 未送信のデータが無い時
+                return                              # 送信完了
+            self.conn.post(self.path, {'writeKey': self.wkey, 'data': records}, timeout)
+            self.spool.ack()                        # 送信済みとして消す
+            if len(self.spool):                     # 再送が続く時
+                sleep(min_interval)                 # 送信間隔を空ける
+    def record(self, values, now):                  # 1件のデータを作成
+        record = {'created': strftime('%Y-%m-%d %H:%M:%S', localtime(now))}
+        for tag, key in self.fields.items():        # 各データ番号について
+            if values.get(key) is not None:         # 値がある時
+                record[tag] = values[key]           # データ番号に値を設定
+        return record                               # データを応答
+    def rollover(self, now):                        # 日付が変わった時の処理
+        day = strftime('%Y-%m-%d', localtime(now))  # 本日の日付
+        if day != self.day:                         # 日付が変わった時
+            self.day = day                          # 日付を更新
+            self.used = 0                           # 登録件数を0に
+    def schedule(self, now):                        # 次に記録できる時刻を計算
+        self.rollover(now)                          # 日付が変わった時は0から
+        t = localtime(now)                          # 現在の日時
+        midnight = mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        left = max(self.quota - self.used, 0)       # 本日の残り件数
+        if left == 0:                               # 残り件数が無い時
+            return midnight                         # 翌日まで記録しない
+        return now + max(min_interval, (midnight - now) / left)
+    def window(self, values):                       # 集計時の処理
+        now = self.clock()                          # 現在の時刻
+        if now < self.next_record:                  # 記録間隔に満たない時
+            self.skipped += 1                       # 見送り数を加算
+        else:                                       # 記録できる時
+            self.spool.append(self.record(values, now)) # スプールに保存
+            self.buffered += 1                      # 未送信の件数を加算
+            self.rollover(now)                      # 日付が変わった時は0から
+            self.used += 1                          # 登録件数を加算
+            self.next_record = self.schedule(now)   # 次の記録時刻を計算
+            self.save_quota()                       # 登録件数を保存
+        if self.buffered >= self.batch or now - self.last_flush >= self.flush_interval:
+            self.flush(now)                         # 一括送信
+    def flush(self, now=None):                      # 一括送信用メソッド
+        if len(self.spool):                         # 未送信のデータがある時
+            print('Ambient', len(self.spool), 'records, queue =', self.worker.depth())
+            self.worker.put(None, key='drain')      # スプールの送信を待ち行列へ
+            self.buffered = 0                       # 未送信の件数を0に
+        self.last_flush = self.clock() if now is None else now
+    def stats(self):                                # 状態の取得
+        stats = self.worker.stats()                 # 送信スレッドの状態
+        stats.update({'used': self.used, 'skipped': self.skipped,
+                      'buffered': self.buffered, 'connects': self.conn.connects,
+                      'quota_errors': self.quota_errors})
+        stats['spool'] = self.spool.stats()         # スプールの状態
+        return stats                                # 状態を応答
+    def close(self):                                # 終了時の処理
+        self.flush()                                # 残りを一括送信
+        self.worker.close(5)                        # 未送信を5秒まで待つ
+        self.conn.close()                           # 切断
+        self.spool.close()                          # 未送信は次回の起動時に再送
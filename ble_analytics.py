@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Analytics ble_analytics.py
+# 集計(時間窓)ごとに、受信したアドバタイジングのRSSIを NumPy の配列で
+# まとめて分析します。
+#
+#   rssi_hist   時間窓内の全受信のRSSIの分布(rssi_step dBごとの件数)
+#   smoothed    アドレスごとの平滑化したRSSI(時間窓ごとの平均の指数移動平均)
+#   occupancy   近さで重み付けした在室数の推定
+#               各アドレスの平滑化したRSSIを、target_rssi で 0.5、それより
+#               width dB 強いと約0.73、弱いと約0.27 になるロジスティック関数で
+#               重み(0～1)に変換した合計です。閾値ちょうどのデバイスを1人と
+#               数える counter と違い、遠い(弱い)デバイスほど少なく数えます。
+#
+#   受信時(add)はRSSIとアドレスの番号を配列(array)に追加するだけで、時間窓
+#   の終わり(window)に np.bincount 等でまとめて計算します。アドレスごとの
+#   状態も番号で引く配列のため、デバイスごとの Python の繰り返しはありません。
+#   NumPy が無い時は、ble_pipeline.py はこの分析を行いません。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_analytics import Analytics
+#   analytics = Analytics(target_rssi=-80)
+#   analytics.add(dev.addr, dev.rssi)               # 受信ごと
+#   values = analytics.window(now)                  # {'occupancy': 12.3, 'rssi_hist': [...]}
+#   analytics.report()                              # HTTPサーバの /analytics 用
+#
+#【実行方法】
+#   合成したアドバタイジング列(ble_synth.py)で分析します
+#       ./ble_analytics.py
+
+rssi_min = -100                                     # 分布の下限(dBm)
+rssi_max = -30                                      # 分布の上限(dBm)
+rssi_step = 5                                       # 分布の区間の幅(dB)
+alpha = 0.3                                         # 平滑化の係数(新しい平均の重み)
+width = 5.0                                         # 重みの変化の幅(dB)
+ttl = 300                                           # アドレスを忘れるまでの時間(秒)
+
+from array import array                             # 数値配列を組み込む
+try:                                                # 例外処理の監視を開始
+    import numpy as np                              # NumPyを組み込む
+except ImportError:                                 # NumPyが無い時
+    np = None                                       # 分析は使用不可
+
+class Analytics:                                    # クラスAnalyticsの定義
+    def __init__(self, target_rssi=-80, rssi_min=rssi_min, rssi_max=rssi_max,
+                 rssi_step=rssi_step, alpha=alpha, width=width, ttl=ttl):
+        if np is None:                              # NumPyが無い時
+            raise Exception('NumPyNotFound')        # 例外を応答
+        self.target_rssi = target_rssi              # 重み0.5のRSSI
+        self.edges = list(range(rssi_min, rssi_max + 1, rssi_step)) # 区間の下端
+        self.rssi_step = rssi_step                  # 区間の幅
+        self.alpha = alpha                          # 平滑化の係数
+        self.width = width                          # 重みの変化の幅
+        self.ttl = ttl                              # アドレスを忘れるまでの時間
+        self.rssi = array('h')                      # 時間窓内の受信のRSSI
+        self.ids = array('i')                       # 時間窓内の受信のアドレス番号
+        self.index = dict()                         # アドレス→番号
+        self.addrs = list()                         # 番号→アドレス(空きはNone)
+        self.free = list()                          # 空いている番号
+        self.smoothed = np.full(0, np.nan)          # 番号→平滑化したRSSI
+        self.last = np.zeros(0)                     # 番号→最後に受信した時刻
+        self.values = {'occupancy': 0.0, 'rssi_hist': [0] * len(self.edges)}
+        self.devices = None                         # 最後の時間窓のアドレスごとの値(配列)
+        self.events = 0                             # 分析した受信数
+        self.windows = 0                            # 分析した時間窓の数
+    def add(self, addr, rssi):                      # 受信ごとの処理
+        i = self.index.get(addr)                    # アドレスの番号
+        if i is None:                               # 新しいアドレスの時
+            i = self.free.pop() if self.free else len(self.addrs)
+            if i == len(self.addrs):                # 空きが無い時
+                self.addrs.append(addr)             # 番号を追加
+            else:                                   # 空きを使う時
+                self.addrs[i] = addr                # 番号を再利用
+            self.index[addr] = i                    # 番号を登録
+        self.rssi.append(rssi)                      # RSSIを追加
+        self.ids.append(i)                          # アドレス番号を追加
+    def grow(self, n):                              # 番号の配列を拡張
+        if len(self.smoothed) < n:                  # 足りない時
+            size = max(n, 2 * len(self.smoothed))   # 倍々に拡張
+            self.smoothed = np.concatenate((self.smoothed, np.full(size - len(self.smoothed), np.nan)))
+            self.last = np.concatenate((self.last, np.zeros(size - len(self.last))))
+    def window(self, now):                          # 時間窓の終わりの処理
+        rssi = np.frombuffer(self.rssi, dtype=np.int16).astype(np.float64)
+        ids = np.frombuffer(self.ids, dtype=np.int32)   # アドレス番号の配列
+        n = len(self.addrs)                         # 番号の数
+        self.grow(n)                                # 配列を拡張
+        bins = np.clip((rssi - self.edges[0]) // self.rssi_step, 0, len(self.edges) - 1)
+        hist = np.bincount(bins.astype(np.intp), minlength=len(self.edges))
+        count = np.bincount(ids, minlength=n)       # アドレスごとの受信数
+        total = np.bincount(ids, weights=rssi, minlength=n) # アドレスごとのRSSIの合計
+        seen = np.flatnonzero(count)                # 受信したアドレス番号
+        mean = total[seen] / count[seen]            # 時間窓内の平均
+        prev = self.smoothed[seen]                  # 前回までの平滑化した値
+        smoothed = np.where(np.isnan(prev), mean, self.alpha * mean + (1 - self.alpha) * prev)
+        self.smoothed[seen] = smoothed              # 平滑化した値を更新
+        self.last[seen] = now                       # 受信時刻を更新
+        weight = 1 / (1 + np.exp((self.target_rssi - smoothed) / self.width))
+        self.devices = (seen, smoothed, count[seen], weight)    # 応答時に変換
+        self.expire(now)                            # 古いアドレスを忘れる
+        self.values = {'occupancy': round(float(weight.sum()), 1), 'rssi_hist': hist.tolist()}
+        self.events += len(rssi)                    # 分析した受信数を加算
+        self.windows += 1                           # 時間窓の数を加算
+        self.rssi = array('h')                      # 次の時間窓へ
+        self.ids = array('i')                       # 次の時間窓へ
+        return self.values                          # 分析結果を応答
+    def expire(self, now):                          # 古いアドレスを忘れる
+        n = len(self.addrs)                         # 番号の数
+        old = np.flatnonzero((self.last[:n] < now - self.ttl) & ~np.isnan(self.smoothed[:n]))
+        for i in old.tolist():                      # 忘れるアドレスについて(少数)
+            del self.index[self.addrs[i]]           # 番号の登録を削除
+            self.addrs[i] = None                    # 番号を空ける
+            self.free.append(i)                     # 空きに追加
+        self.smoothed[old] = np.nan                 # 平滑化した値を消去
+    def report(self):                               # 分析結果(/analytics)
+        devices = list()                            # アドレスごとの値(近い順)
+        if self.devices is not None:                # 分析済みの時
+            seen, smoothed, count, weight = self.devices    # 最後の時間窓の値
+            for i in np.argsort(-smoothed).tolist():    # RSSIの強い順に
+                devices.append({'addr': self.addrs[seen[i]], 'rssi': round(float(smoothed[i]), 1),
+                                'count': int(count[i]), 'weight': round(float(weight[i]), 3)})
+        return {'edges': self.edges, 'rssi_hist': self.values['rssi_hist'],
+                'occupancy': self.values['occupancy'], 'target_rssi': self.target_rssi,
+                'devices': devices}
+    def stats(self):                                # 状態の取得
+        return {'addresses': len(self.index), 'events': self.events,
+                'windows': self.windows, 'pending': len(self.rssi)}
+
+if __name__ == '__main__':                          # 直接実行された時
+    from ble_synth import Workload                  # 合成を組み込む
+    analytics = Analytics()                         # 分析
+    records = Workload(devices=200, duration=120).records()
+    origin = next(records)                          # 開始時刻
+    end = 30                                        # 時間窓の終わり
+    for t, dev in records:                          # 各送信について
+        while t >= end:                             # 時間窓を過ぎた時
+            values = analytics.window(origin + end) # 時間窓の分析
+            print(end, values, analytics.stats())   # 分析結果を表示
+            end += 30                               # 次の時間窓へ
+        analytics.add(dev.addr, dev.rssi)           # 受信を追加
+    print(analytics.report()['devices'][:3])        # 最も近いアドレス
+
+''' 実行結果の一例 (200台、120秒間の合成した列)
+$ ./ble_analytics.py
+30 {'occupancy': 134.3, 'rssi_hist': [379, 571, 1055, 2000, 2852, 3197, 2604, 1487, 743, 408, 177, 57, 3, 2, 0]} {'addresses': 209, 'events': 15535, 'windows': 1, 'pending': 0}
+60 {'occupancy': 132.1, 'rssi_hist': [399, 537, 1096, 1957, 2932, 3244, 2536, 1432, 749, 409, 159, 60, 9, 1, 0]} {'addresses': 213, 'events': 31055, 'windows': 2, 'pending': 0}
+90 {'occupancy': 133.9, 'rssi_hist': [353, 553, 1109, 1956, 2951, 3228, 2450, 1499, 784, 417, 180, 57, 10, 0, 0]} {'addresses': 220, 'events': 46602, 'windows': 3, 'pending': 0}
+[{'addr': '57:99:97:8e:66:0a', 'rssi': -45.1, 'count': 37, 'weight': 0.999}, {'addr': '67:7a:fa:b3:9d:c6', 'rssi': -48.0, 'count': 63, 'weight': 0.998}, {'addr': '60:f5:d3:cb:23:30', 'rssi': -49.8, 'count': 144, 'weight': 0.998}]
+'''
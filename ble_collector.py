@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Collector ble_collector.py
+# 複数のノード(ex6_co2_udp.py を実行する Raspberry Pi)からUDPで届く値を
+# 集計し、会場全体のデバイス数とノードごとのCO2・TVOC・温度をHTTPで配信
+# します。
+#
+#   ノードは集計ごと(30秒)に値の行と、アドレスのスケッチ(ble_hll.py)の行を
+#   送信します(UdpSink(sketch=True))。
+#       e_co2_3, 25, 0, 0, 650, 120, 12             名前,温度,0,0,CO2,TVOC,カウンタ
+#       e_co2_3, hll, 30, 12:eJzt...                名前,hll,時間窓,スケッチ
+#   値の行の8番目の項目は在室数の推定(occupancy、ble_analytics.py)で、
+#   NumPy の無いノードは送信しません。
+#   各ノードの最新のスケッチを結合すると、複数のノードが同じスマートフォンを
+#   受信していても1台と数えた会場全体のデバイス数(counter)が求まります。
+#   スケッチは固定の大きさ(約4KB、圧縮して送信)のため、数百のノードでも
+#   1台のPCで集計できます。受信したスケッチは時間窓(SketchWindow)にも
+#   結合し、5分間・1時間の会場全体のデバイス数も求めます。
+#
+#   バイナリ形式(ble_telemetry.py の TelemetrySink)のパケットも受信でき、
+#   連番からノードごとの欠落数(lost)を求めます。マルチキャストのアドレス
+#   group に参加するため、ノードはブロードキャストの代わりにマルチキャスト
+#   で送信できます。
+#
+#   counter_sum は各ノードのカウンタの合計(重複を除かない場合の値)で、
+#   counter との差がノード間で重複して数えていたデバイス数です。
+#   co2, tvoc, temp は応答中のノードの平均、co2_max は最大値、occupancy は
+#   各ノードの推定の合計です。
+#
+#   HTTPサーバ(ble_httpd.py)の / に会場全体の値、/nodes にノードごとの値、
+#   /history に値の履歴、/stats に受信数などの状態を応答します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   ./ble_collector.py [UDPポート番号] [HTTPポート番号]
+#       ./ble_collector.py 1024 8080
+#
+#   各ノードの ex6_co2_udp.py で udp_sketch = True を設定してください。
+#       curl http://localhost:8080/                 # 会場全体の値
+#       curl http://localhost:8080/nodes            # ノードごとの値
+
+udp_port = 1024                                     # UDP受信ポート番号
+http_port = 8080                                    # HTTPポート番号
+interval = 1.0                                      # 動作間隔(秒)
+spans = (30, 300, 3600)                             # 時間窓の長さ(秒)
+node_ttl = 90                                       # 応答中とみなす時間(秒)
+node_expire = 3600                                  # ノードを削除するまでの時間(秒)
+error = 0.02                                        # スケッチの誤差(ノードと同じ)
+group = '239.255.24.1'                              # 参加するマルチキャストのアドレス
+
+from ble_hll import HyperLogLog, SketchWindow       # 近似カウントを組み込む
+from ble_history import History                     # 値の履歴を組み込む
+from ble_httpd import HttpSink                      # HTTP出力先を組み込む
+from ble_sinks import PrintSink                     # 表示の出力先を組み込む
+from ble_telemetry import Decoder, join_group, magic    # バイナリ形式を組み込む
+from ble_scheduler import Scheduler                 # 予定表を組み込む
+from time import time, monotonic                    # 時間関連を組み込む
+import threading                                    # スレッド管理を組み込む
+import socket                                       # ソケット通信を組み込む
+import struct                                       # バイナリ変換を組み込む
+import zlib                                         # 圧縮を組み込む
+
+class Node:                                         # ノードごとの状態
+    def __init__(self, name):                       # コンストラクタ作成
+        self.name = name                            # デバイス識別名
+        self.addr = None                            # 送信元のIPアドレス
+        self.values = dict()                        # 最新の値
+        self.sketch = None                          # 最新のスケッチ
+        self.last = 0.0                             # 最終受信時刻
+        self.reports = 0                            # 受信数
+        self.lost = 0                               # 欠落したパケット数(バイナリ形式)
+    def record(self, now):                          # 応答用の辞書
+        record = {'name': self.name, 'addr': self.addr, 'age': round(now - self.last, 1),
+                  'reports': self.reports, 'lost': self.lost}
+        record.update(self.values)                  # 最新の値
+        if self.sketch is not None:                 # スケッチがある時
+            record['distinct'] = self.sketch.count()    # ノード単独のデバイス数
+        return record                               # 辞書を応答
+
+class Collector:                                    # クラスCollectorの定義
+    def __init__(self, sinks, port=udp_port, interval=interval, spans=spans,
+                 error=error, node_ttl=node_ttl, group=group, clock=time):
+        self.sinks = list(sinks)                    # 出力先のリスト
+        self.port = port                            # UDP受信ポート番号
+        self.group = group                          # マルチキャストのアドレス
+        self.decoder = Decoder()                    # バイナリ形式のデコーダ
+        self.interval = interval                    # 動作間隔(秒)
+        self.node_ttl = node_ttl                    # 応答中とみなす時間(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.p = HyperLogLog(error).p               # スケッチの精度
+        self.MAC = SketchWindow(spans, error, clock=clock)  # 会場全体の時間窓
+        self.history = History(clock=clock)         # 値の履歴
+        self.nodes = dict()                         # 名前→ノード
+        self.lock = threading.Lock()                # ノードの排他制御
+        self.values = {'counter': 0, 'nodes': 0}    # 最新の値
+        self.datagrams = 0                          # 受信数
+        self.errors = 0                             # 解釈できなかった数
+        self.dirty = True                           # 結合し直す必要がある
+        self.live = list()                          # 前回結合した応答中のノード名
+        self.merged = 0                             # 前回結合したデバイス数
+        self.scheduler = Scheduler(monotonic, clock)    # 予定表(集計は時計に揃える)
+    def handle(self, data, addr=None):              # 1件の受信の処理
+        if data[:2] == magic:                       # バイナリ形式の時
+            try:                                    # 例外処理の監視を開始
+                packet = self.decoder.feed(data)    # パケットを分解
+            except (ValueError, struct.error, zlib.error) as e:
+                self.errors += 1                    # 解釈できなかった数を加算
+                print('Collector ERROR', addr, e)   # エラー内容を表示
+                return                              # 処理を終了
+            values = None                           # 最新の値
+            if packet['samples']:                   # サンプルがある時
+                t, temp, co2, tvoc, counter = packet['samples'][-1]
+                values = {key: val for key, val in (('temp', temp), ('co2', co2),
+                          ('tvoc', tvoc), ('counter', counter)) if val is not None}
+            self.record(packet['name'], addr, values, packet['sketch'], packet['lost'])
+            return                                  # 処理を終了
+        for line in data.decode(errors='replace').splitlines():
+            fields = [f.strip() for f in line.split(',')]   # 項目に分解
+            if len(fields) < 2 or not fields[0]:    # 空行などの時
+                continue                            # 次の行へ
+            try:                                    # 例外処理の監視を開始
+                self.report(fields, addr)           # 値またはスケッチを記録
+            except (ValueError, IndexError, zlib.error) as e:   # 形式が不正な時
+                self.errors += 1                    # 解釈できなかった数を加算
+                print('Collector ERROR', addr, e)   # エラー内容を表示
+    def report(self, fields, addr):                 # 1行の記録(テキスト形式)
+        if fields[1] == 'hll':                      # スケッチの時
+            self.record(fields[0], addr, sketch=HyperLogLog.loads(fields[3]))
+        else:                                       # 値の時(ex6_co2_udp.pyの形式)
+            values = {'temp': float(fields[1]), 'co2': int(fields[4]),
+                      'tvoc': int(fields[5]), 'counter': int(fields[6])}
+            if len(fields) > 7:                     # 在室数の推定がある時
+                values['occupancy'] = float(fields[7])  # ble_analytics.py の推定
+            self.record(fields[0], addr, values)    # ノードへ記録
+    def record(self, name, addr, values=None, sketch=None, lost=0):    # ノードへ記録
+        now = self.clock()                          # 現在の時刻
+        if sketch is not None and sketch.p != self.p:   # 精度が異なる時
+            self.errors += 1                        # 解釈できなかった数を加算
+            print('Collector ERROR', name, 'HyperLogLog precision', sketch.p)
+            sketch = None                           # スケッチは使わない
+        with self.lock:                             # ノードと排他
+            node = self.nodes.get(name)             # 名前のノード
+            if node is None:                        # 初めてのノードの時
+                node = self.nodes[name] = Node(name)
+            if sketch is not None:                  # スケッチがある時
+                node.sketch = sketch                # 最新のスケッチ
+                self.MAC.merge(sketch, now)         # 会場全体の時間窓へ結合
+            if values is not None:                  # 値がある時
+                node.values = values                # 最新の値
+            node.lost += lost                       # 欠落数を加算
+            node.addr = addr and addr[0]            # 送信元のIPアドレス
+            node.last = now                         # 最終受信時刻
+            node.reports += 1                       # 受信数を加算
+            self.datagrams += 1                     # 受信数を加算
+            self.dirty = True                       # 結合し直す
+    def receiver(self):                             # UDP受信スレッド
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)  # 集中に備える
+        sock.bind(('', self.port))                  # 全アドレスで受信
+        if self.group:                              # マルチキャストを受信する時
+            try:                                    # 例外処理の監視を開始
+                join_group(sock, self.group)        # グループに参加
+            except OSError as e:                    # 参加できない時
+                print('Multicast', self.group, e)   # エラー内容を表示
+        print('UDP port', self.port)                # ポート番号を表示
+        while True:                                 # 永久ループ
+            data, addr = sock.recvfrom(65536)       # 1件を受信
+            self.handle(data, addr)                 # 受信を処理
+    def tick(self):                                 # 動作間隔ごとの処理
+        now = self.clock()                          # 現在の時刻
+        with self.lock:                             # ノードと排他
+            for name in [n for n, node in self.nodes.items() if now - node.last > node_expire]:
+                del self.nodes[name]                # 応答の無いノードを削除
+            live = [n for n in self.nodes.values() if now - n.last <= self.node_ttl]
+            names = [n.name for n in live]          # 応答中のノード名
+            if self.dirty or names != self.live:    # 受信かnode_ttl切れがあった時
+                self.dirty = False                  # 結合済み
+                self.live = names                   # 結合したノード名
+                merged = HyperLogLog(p=self.p)      # 最新のスケッチの結合
+                for node in live:                   # 応答中の各ノードについて
+                    if node.sketch is not None:     # スケッチがある時
+                        merged.merge(node.sketch)   # 結合
+                self.merged = merged.count()        # 結合したデバイス数
+            values = {'counter': self.merged, 'nodes': len(live),
+                      'counter_sum': sum(n.values.get('counter', 0) for n in live)}
+            occupancy = [n.values['occupancy'] for n in live if 'occupancy' in n.values]
+            if occupancy:                           # 在室数の推定がある時
+                values['occupancy'] = round(sum(occupancy), 1)  # 各ノードの推定の合計
+        for span, n in self.MAC.counts(now).items():    # 各時間窓について
+            values['counter_%ds' % span] = n        # 会場全体のデバイス数
+        values['counter_%ds' % self.MAC.spans[0]] = values['counter']
+        for key in ('co2', 'tvoc', 'temp'):         # 各センサ値について
+            vals = [n.values[key] for n in live if key in n.values]
+            if vals:                                # 値がある時
+                values[key] = round(sum(vals) / len(vals), 1)   # 平均
+                if key == 'co2':                    # CO2の時
+                    values['co2_max'] = max(vals)   # 最大値
+        self.values = values                        # 最新の値を更新
+        self.history.add(values, now)               # 履歴に追加
+        return values                               # 値を応答
+    def update(self):                               # 動作間隔ごとの処理
+        values = self.tick()                        # 会場全体の値
+        for sink in self.sinks:                     # 各出力先について
+            sink.update(values)                     # 最新の値を通知
+    def window(self):                               # 集計時の処理
+        for sink in self.sinks:                     # 各出力先について
+            sink.window(self.values)                # 集計結果を通知
+    def report_nodes(self):                         # ノードごとの値(/nodes)
+        now = self.clock()                          # 現在の時刻
+        with self.lock:                             # ノードと排他
+            return [node.record(now) for node in self.nodes.values()]
+    def stats(self):                                # 状態の取得
+        stats = {'nodes': len(self.nodes), 'datagrams': self.datagrams,
+                 'errors': self.errors, 'telemetry': self.decoder.stats(),
+                 'history': self.history.stats(), 'scheduler': self.scheduler.stats()}
+        for i, sink in enumerate(self.sinks):       # 各出力先について
+            s = sink.stats()                        # 出力先の状態
+            if s:                                   # 状態がある時
+                stats['%d_%s' % (i, type(sink).__name__)] = s
+        return stats                                # 状態を応答
+    def run(self):                                  # 永久ループ
+        for sink in self.sinks:                     # 各出力先について
+            sink.start(self)                        # 出力先を開始
+        threading.Thread(target=self.receiver, daemon=True).start()
+        self.scheduler.every('update', self.interval, self.update, delay=self.interval)
+        self.scheduler.every('window', self.MAC.spans[0], self.window, align=True)
+        try:                                        # 例外処理の監視を開始
+            self.scheduler.run()                    # 予定表に沿って実行
+        finally:                                    # 終了時
+            for sink in self.sinks:                 # 各出力先について
+                sink.close()                        # 出力先を終了
+
+if __name__ == '__main__':                          # 直接実行された時
+    from sys import argv                            # sysから引数取得を組み込む
+    if len(argv) > 1:                               # 引数がある時
+        udp_port = int(argv[1])                     # UDPポート番号を設定
+    if len(argv) > 2:                               # 引数がある時
+        http_port = int(argv[2])                    # HTTPポート番号を設定
+    sinks = [PrintSink(), HttpSink(http_port)]      # 表示とHTTPサーバ
+    Collector(sinks, udp_port).run()                # 集計を実行
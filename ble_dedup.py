@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Dedup ble_dedup.py
+# アドバタイジングのアドレスを最終受信時刻と共に保持し、重複を除いた
+# デバイス数を時間窓(直近30秒／5分／1時間など)ごとに求めます。
+#
+#   アドレスは辞書で管理するため、検索はリストの線形探索ではなくハッシュ
+#   による定数時間です。各時間窓は最終受信時刻の古い順に並んでおり、
+#   期限切れのアドレスは先頭から順に削除されます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_dedup import AddressWindow
+#   MAC = AddressWindow((30, 300, 3600))            # 30秒, 5分, 1時間の窓
+#   MAC.add(dev.addr)                               # 受信したアドレスを記録
+#   print(len(MAC))                                 # 直近30秒間のデバイス数
+#   print(MAC.counts())                             # {30: n, 300: n, 3600: n}
+
+spans = (30, 300, 3600)                             # 時間窓の長さ(秒)
+
+from collections import OrderedDict                 # 順序付き辞書を組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+from ble_hll import HyperLogLog, error              # 近似カウントを組み込む
+
+class AddressWindow:                                # クラスAddressWindowの定義
+    def __init__(self, spans=spans, clock=monotonic):   # コンストラクタ作成
+        self.spans = tuple(sorted(spans))           # 時間窓の長さ(短い順)
+        self.clock = clock                          # 時刻取得関数
+        self.windows = [OrderedDict() for s in self.spans]  # アドレス→時刻
+    def _expire(self, seen, limit):                 # 期限切れアドレスの削除
+        while seen:                                 # アドレスがある間
+            addr = next(iter(seen))                 # 最も古いアドレス
+            if seen[addr] > limit:                  # 期限内の時
+                return                              # 削除を終了
+            del seen[addr]                          # 期限切れを削除
+    def add(self, addr, now=None):                  # アドレス記録用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        new = False                                 # 最短の窓で新規か
+        for span, seen in zip(self.spans, self.windows):
+            self._expire(seen, now - span)          # 期限切れを削除
+            if addr in seen:                        # 窓内に有る時
+                seen.move_to_end(addr)              # 最も新しい位置へ移動
+            elif seen is self.windows[0]:           # 最短の窓に無い時
+                new = True                          # 新規として応答
+            seen[addr] = now                        # 最終受信時刻を更新
+        return new                                  # 新規かどうかを応答
+    def count(self, span=None, now=None):           # デバイス数取得用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        i = 0 if span is None else self.spans.index(span)
+        self._expire(self.windows[i], now - self.spans[i])
+        return len(self.windows[i])                 # 窓内のアドレス数を応答
+    def counts(self, now=None):                     # 全窓のデバイス数を取得
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        return {span: self.count(span, now) for span in self.spans}
+    def sketch(self, span=None, now=None, error=error): # 時間窓のスケッチを作成
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        i = 0 if span is None else self.spans.index(span)
+        self._expire(self.windows[i], now - self.spans[i])
+        hll = HyperLogLog(error)                    # 空のスケッチ
+        for addr in self.windows[i]:                # 窓内の各アドレスについて
+            hll.add(addr)                           # スケッチに記録
+        return hll                                  # スケッチを応答(送信用)
+    def last_seen(self, addr):                      # 最終受信時刻を取得
+        return self.windows[-1].get(addr)           # 未受信時はNone
+    def __contains__(self, addr):                   # in演算子(最短の窓)
+        t = self.windows[0].get(addr)               # 最終受信時刻
+        return t is not None and t > self.clock() - self.spans[0]
+    def __len__(self):                              # len()は最短の窓の数
+        return self.count()                         # デバイス数を応答
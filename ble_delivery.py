@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Delivery ble_delivery.py
+# クラウド(Ambient、LINE)への送信を別スレッドで行い、スキャンを止めません。
+#
+#   スキャン側は put() で送信内容を待ち行列に入れるだけです。送信スレッドが
+#   タイムアウト付きで送信し、失敗時は間隔を倍にしながら再送します。
+#   待ち行列には上限があり、あふれた時の扱いを policy で選びます。
+#       drop_oldest   最も古い送信内容を捨てる(既定)
+#       drop_newest   新しい送信内容を捨てる
+#   put() に key を指定すると、同じ key の未送信の内容を置き換えます(集約)。
+#   1回ごとの送信時間と失敗数は /metrics(ble_metrics.py)に出力します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_delivery import DeliveryWorker
+#   def send(item, timeout):                        # 送信処理(失敗時は例外)
+#       urllib.request.urlopen(item, timeout=timeout)
+#   worker = DeliveryWorker(send)                   # 送信スレッドを起動
+#   worker.put(post)                                # 待ち行列に入れるだけ
+#   print(worker.stats())                           # 待ち行列の長さや遅延
+
+maxsize = 32                                        # 待ち行列の上限
+timeout = 10                                        # 1回の送信のタイムアウト(秒)
+retries = 3                                         # 再送回数
+backoff = 2.0                                       # 最初の再送までの待ち時間(秒)
+max_backoff = 60.0                                  # 再送待ち時間の上限(秒)
+
+from collections import deque                       # 両端キューを組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+from ble_metrics import Counter, Histogram          # 計測値を組み込む
+import threading                                    # スレッド管理を組み込む
+
+post_seconds = Histogram('ble_sink_post_seconds', 'Duration of one post attempt to a sink.',
+                         ('sink',), (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+post_failures = Counter('ble_sink_post_failures_total', 'Failed post attempts to a sink.',
+                        ('sink',))
+
+class DeliveryWorker:                               # クラスDeliveryWorkerの定義
+    def __init__(self, send, maxsize=maxsize, timeout=timeout, retries=retries,
+                 backoff=backoff, policy='drop_oldest', name='delivery'):
+        self.send = send                            # 送信用の関数
+        self.maxsize = maxsize                      # 待ち行列の上限
+        self.timeout = timeout                      # 送信のタイムアウト(秒)
+        self.retries = retries                      # 再送回数
+        self.backoff = backoff                      # 最初の再送待ち時間(秒)
+        self.policy = policy                        # あふれた時の扱い
+        self.name = name                            # 送信先の名前
+        self.queue = deque()                        # 待ち行列(時刻,key,内容)
+        self.cond = threading.Condition()           # 待ち行列の排他と通知
+        self.counts = {'enqueued': 0, 'sent': 0, 'dropped': 0,
+                       'coalesced': 0, 'failed': 0, 'retried': 0}
+        self.latency = None                         # 最後の送信遅延(秒)
+        self.latency_max = 0.0                      # 最大の送信遅延(秒)
+        self.post_seconds = post_seconds.labels(name)   # 送信時間の分布
+        self.post_failures = post_failures.labels(name) # 送信失敗数
+        self.running = True                         # 動作中フラグ
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()                         # 送信スレッドの起動
+    def put(self, item, key=None):                  # 送信内容を待ち行列へ
+        with self.cond:                             # 排他制御
+            self.counts['enqueued'] += 1            # 受付数を加算
+            if key is not None:                     # 集約用のkeyがある時
+                for i, (t, k, old) in enumerate(self.queue):
+                    if k == key:                    # 同じkeyが未送信の時
+                        self.queue[i] = (t, key, item)  # 内容だけ置き換え
+                        self.counts['coalesced'] += 1   # 集約数を加算
+                        return True                 # 受付完了
+            if len(self.queue) >= self.maxsize:     # 待ち行列が満杯の時
+                self.counts['dropped'] += 1         # 破棄数を加算
+                if self.policy == 'drop_newest':    # 新しい内容を捨てる時
+                    return False                    # 受付せずに終了
+                self.queue.popleft()                # 最も古い内容を捨てる
+            self.queue.append((monotonic(), key, item)) # 待ち行列に追加
+            self.cond.notify()                      # 送信スレッドへ通知
+        return True                                 # 受付完了
+    def run(self):                                  # 送信スレッド
+        while self.running:                         # 動作中の間
+            with self.cond:                         # 排他制御
+                while self.running and not self.queue:  # 待ち行列が空の間
+                    self.cond.wait()                # 通知を待つ
+                if not self.running:                # 停止指示の時
+                    return                          # スレッドを終了
+                (t, key, item) = self.queue.popleft()   # 先頭を取り出す
+            self.deliver(t, item)                   # 送信を実行
+    def deliver(self, t, item):                     # 再送付きの送信
+        wait = self.backoff                         # 再送までの待ち時間
+        for n in range(self.retries + 1):           # 初回と再送について
+            start = monotonic()                     # 送信の開始時刻
+            try:                                    # 例外処理の監視を開始
+                self.send(item, self.timeout)       # 送信を実行
+            except Exception as e:                  # 例外処理発生時
+                self.post_seconds.observe(monotonic() - start)  # 送信時間を記録
+                self.post_failures.inc()            # 送信失敗数を加算
+                print(self.name, 'ERROR', e)        # エラー内容を表示
+                if n >= self.retries:               # 再送回数を超えた時
+                    break                           # 送信を諦める
+                self.counts['retried'] += 1         # 再送数を加算
+                with self.cond:                     # 排他制御
+                    self.cond.wait_for(lambda: not self.running, wait)
+                if not self.running:                # 停止指示の時
+                    break                           # 送信を諦める
+                wait = min(wait * 2, max_backoff)   # 待ち時間を倍に
+                continue                            # 再送する
+            self.post_seconds.observe(monotonic() - start)  # 送信時間を記録
+            latency = monotonic() - t               # 受付からの遅延
+            self.latency = latency                  # 最後の遅延を保持
+            self.latency_max = max(self.latency_max, latency)
+            self.counts['sent'] += 1                # 送信数を加算
+            return True                             # 送信成功
+        self.counts['failed'] += 1                  # 失敗数を加算
+        return False                                # 送信失敗
+    def depth(self):                                # 待ち行列の長さ
+        return len(self.queue)                      # 未送信の数を応答
+    def stats(self):                                # 状態の取得
+        stats = dict(self.counts)                   # 各種の件数
+        stats['depth'] = self.depth()               # 待ち行列の長さ
+        stats['latency'] = self.latency             # 最後の送信遅延(秒)
+        stats['latency_max'] = self.latency_max     # 最大の送信遅延(秒)
+        return stats                                # 状態を応答
+    def close(self, wait=None):                     # 送信スレッドの停止
+        if wait:                                    # 待ち時間の指定がある時
+            end = monotonic() + wait                # 待ち終了時刻
+            while self.queue and monotonic() < end: # 未送信がある間
+                self.thread.join(0.1)               # 少し待つ
+        with self.cond:                             # 排他制御
+            self.running = False                    # 停止を指示
+            self.cond.notify_all()                  # 送信スレッドへ通知
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Devices ble_devices.py
+# アドレスごとの状態(初回・最終受信時刻、受信回数、RSSIの最小・最大・平滑値、
+# 接続可否)を、1台あたり固定の小さなメモリで保持する表です。
+#
+#   アドレスは48ビットの整数に変換して番号を割り当て(intern)、各項目は
+#   番号を添字とする array の配列(並列配列)に格納します。辞書の辞書に
+#   比べて1台あたりのメモリが約1/3になり、Pi Zeroでも数万台を保持できます
+#   (bench_devices.py で比較できます)。
+#   ttl 秒より長く受信していないアドレスの番号は再利用します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_devices import DeviceTable
+#   table = DeviceTable()                           # 状態表を生成
+#   table.update(dev)                               # 受信したScanEntryを記録
+#   print(table.get(dev.addr))                      # {'count': 5, 'rssi': -61.2, ...}
+#   print(table.records(since=30))                  # 直近30秒間に受信した一覧
+
+ttl = 3600                                          # 状態を保持する時間(秒)
+alpha = 0.2                                         # RSSI平滑化の係数
+
+from array import array                             # 配列を組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+import sys                                          # メモリ量の取得用
+
+def addr2int(addr):                                 # アドレスを整数に変換
+    return int(addr.replace(':', ''), 16)           # 48ビットの整数
+
+def int2addr(key):                                  # 整数をアドレスに変換
+    h = '%012x' % key                               # 12桁の16進数
+    return ':'.join(h[i:i + 2] for i in range(0, 12, 2))
+
+class DeviceTable:                                  # クラスDeviceTableの定義
+    def __init__(self, ttl=ttl, clock=monotonic):   # コンストラクタ作成
+        self.ttl = ttl                              # 状態を保持する時間(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.ids = dict()                           # アドレス(整数)→番号
+        self.addrs = array('Q')                     # 番号→アドレス(整数)
+        self.first = array('d')                     # 初回受信時刻
+        self.last = array('d')                      # 最終受信時刻
+        self.count = array('L')                     # 受信回数
+        self.rssi_min = array('b')                  # RSSIの最小値
+        self.rssi_max = array('b')                  # RSSIの最大値
+        self.rssi_avg = array('f')                  # RSSIの平滑値
+        self.flags = array('B')                     # bit0:接続可, bit1:random
+        self.free = list()                          # 再利用できる番号
+        self.next_expire = 0.0                      # 次に期限切れを調べる時刻
+    def update(self, dev, now=None):                # 受信記録用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        key = addr2int(dev.addr)                    # アドレスを整数に変換
+        rssi = max(-128, min(127, dev.rssi))        # int8の範囲に制限
+        flags = bool(dev.connectable) | (dev.addrType == 'random') << 1
+        i = self.ids.get(key)                       # アドレスの番号
+        if i is not None:                           # 記録済みの時
+            self.last[i] = now                      # 最終受信時刻を更新
+            self.count[i] += 1                      # 受信回数を加算
+            if rssi < self.rssi_min[i]:             # 最小値より小さい時
+                self.rssi_min[i] = rssi             # 最小値を更新
+            elif rssi > self.rssi_max[i]:           # 最大値より大きい時
+                self.rssi_max[i] = rssi             # 最大値を更新
+            self.rssi_avg[i] += (rssi - self.rssi_avg[i]) * alpha
+            self.flags[i] |= flags                  # 一度でも接続可なら接続可
+        elif self.free:                             # 再利用できる番号がある時
+            i = self.free.pop()                     # 番号を再利用
+            self.ids[key] = i                       # 番号を割り当て
+            self.addrs[i] = key                     # アドレス
+            self.first[i] = self.last[i] = now      # 初回・最終受信時刻
+            self.count[i] = 1                       # 受信回数
+            self.rssi_min[i] = self.rssi_max[i] = rssi  # RSSIの最小・最大値
+            self.rssi_avg[i] = rssi                 # RSSIの平滑値
+            self.flags[i] = flags                   # フラグ
+        else:                                       # 新しい番号の時
+            i = len(self.addrs)                     # 末尾の番号
+            self.ids[key] = i                       # 番号を割り当て
+            self.addrs.append(key)                  # アドレス
+            self.first.append(now)                  # 初回受信時刻
+            self.last.append(now)                   # 最終受信時刻
+            self.count.append(1)                    # 受信回数
+            self.rssi_min.append(rssi)              # RSSIの最小値
+            self.rssi_max.append(rssi)              # RSSIの最大値
+            self.rssi_avg.append(rssi)              # RSSIの平滑値
+            self.flags.append(flags)                # フラグ
+        if now >= self.next_expire:                 # 期限切れを調べる時刻の時
+            self.expire(now - self.ttl)             # 期限切れを削除
+            self.next_expire = now + self.ttl / 60  # 次は ttl/60 秒後
+        return i                                    # 番号を応答
+    def expire(self, limit):                        # 期限切れの番号を解放
+        last = self.last                            # 最終受信時刻の配列
+        old = [key for key, i in self.ids.items() if last[i] < limit]
+        for key in old:                             # 期限切れの各アドレスについて
+            self.free.append(self.ids.pop(key))     # 番号を再利用へ
+        return len(old)                             # 解放した数を応答
+    def record(self, i):                            # 番号の状態を辞書で取得
+        return {'addr': int2addr(self.addrs[i]), 'first': self.first[i],
+                'last': self.last[i], 'count': self.count[i],
+                'rssi_min': self.rssi_min[i], 'rssi_max': self.rssi_max[i],
+                'rssi': round(self.rssi_avg[i], 1),
+                'connectable': bool(self.flags[i] & 1), 'random': bool(self.flags[i] & 2)}
+    def get(self, addr):                            # アドレスの状態を取得
+        i = self.ids.get(addr2int(addr))            # アドレスの番号
+        return None if i is None else self.record(i)
+    def records(self, since=None, now=None):        # 受信したアドレスの一覧
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        limit = now - (self.ttl if since is None else since)
+        ids = [i for i in list(self.ids.values()) if self.last[i] >= limit]
+        ids.sort(key=lambda i: self.last[i], reverse=True)  # 新しい順
+        return [self.record(i) for i in ids]        # 辞書の列を応答
+    def active(self, since, now=None):              # 直近since秒間のアドレス数
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        last, limit = self.last, now - since        # 最終受信時刻と期限
+        return sum(1 for i in list(self.ids.values()) if last[i] >= limit)
+    def nbytes(self):                               # 使用中のメモリ量(概算)
+        arrays = (self.addrs, self.first, self.last, self.count, self.rssi_min,
+                  self.rssi_max, self.rssi_avg, self.flags)
+        keys = sys.getsizeof(1 << 47) + sys.getsizeof(1 << 20)  # 辞書のキーと値
+        return (sum(a.buffer_info()[1] * a.itemsize for a in arrays)
+                + sys.getsizeof(self.ids) + len(self.ids) * keys + sys.getsizeof(self.free))
+    def stats(self):                                # 状態の取得
+        return {'devices': len(self.ids), 'slots': len(self.addrs),
+                'free': len(self.free), 'bytes': self.nbytes()}
+    def __contains__(self, addr):                   # in演算子
+        return addr2int(addr) in self.ids           # 記録済みかどうか
+    def __len__(self):                              # len()は保持中のアドレス数
+        return len(self.ids)                        # アドレス数を応答
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Events ble_events.py
+# 値の変化を Server-Sent Events(SSE, text/event-stream)で多数のブラウザへ
+# 配信します。
+#
+#   購読中の接続は1つのスレッドが selectors でまとめて扱い、接続ごとに
+#   スレッドを使いません。publish() は各接続の送信バッファに追加するだけで
+#   送信を待たないため、遅いブラウザがあってもスキャンは止まりません。
+#   送信バッファが max_buffer を超えた接続は切断します(ブラウザの
+#   EventSource は自動的に再接続し、最新の値を受け取り直します)。
+#   新しい接続には、まず最新の値(スナップショット)を送ります。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_events import EventStream
+#   stream = EventStream()                          # 配信スレッドを起動
+#   stream.subscribe(sock)                          # 接続済みのソケットを登録
+#   stream.publish({'counter': 3}, snapshot)        # 変化分と最新の値を配信
+#
+#【ブラウザ側】
+#   var es = new EventSource('/events');
+#   es.onmessage = function(e) { var v = JSON.parse(e.data); ... };
+
+max_buffer = 64 * 1024                              # 接続ごとの送信バッファの上限
+keepalive = 15                                      # 無通信時の確認間隔(秒)
+retry = 3000                                        # 再接続までの待ち時間(ミリ秒)
+
+from time import monotonic                          # 単調増加時刻を組み込む
+import selectors                                    # 入出力の多重化を組み込む
+import threading                                    # スレッド管理を組み込む
+import socket                                       # ソケットを組み込む
+import json                                         # JSON変換を組み込む
+
+header = (b'HTTP/1.0 200 OK\r\nContent-Type: text/event-stream\r\n'
+          b'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n\r\n'
+          b'retry: %d\n\n' % retry)                 # 購読開始時の応答ヘッダ
+
+def message(values, id=None):                       # SSEの1件を作成
+    data = json.dumps(values, separators=(',', ':'))    # 小さなJSON
+    return ('' if id is None else 'id: %d\n' % id).encode() + b'data: ' + data.encode() + b'\n\n'
+
+class EventStream:                                  # クラスEventStreamの定義
+    def __init__(self, max_buffer=max_buffer, keepalive=keepalive):
+        self.max_buffer = max_buffer                # 送信バッファの上限
+        self.keepalive = keepalive                  # 無通信時の確認間隔(秒)
+        self.clients = dict()                       # ソケット→送信バッファ
+        self.lock = threading.Lock()                # 送信バッファの排他制御
+        self.snapshot = b''                         # 新しい接続に送る最新の値
+        self.id = 0                                 # 配信した番号
+        self.dropped = 0                            # 切断した数(遅い・閉じた)
+        self.selector = selectors.DefaultSelector() # 入出力の多重化
+        self.wake_r, self.wake_w = socket.socketpair()  # 配信スレッドの起床用
+        self.wake_w.setblocking(False)              # 起床の通知は待たない
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()                         # 配信スレッドを起動
+    def wake(self):                                 # 配信スレッドを起こす
+        try:                                        # 例外処理の監視を開始
+            self.wake_w.send(b'\0')                 # 1バイト送信
+        except (BlockingIOError, OSError):          # 通知済み(満杯)の時
+            pass                                    # 起床済み
+    def subscribe(self, sock):                      # 購読を開始
+        sock.setblocking(False)                     # 送信を待たない
+        with self.lock:                             # 送信バッファと排他
+            self.clients[sock] = bytearray(header + self.snapshot)
+        self.wake()                                 # 配信スレッドを起こす
+    def publish(self, values, snapshot=None):       # 変化分を配信
+        with self.lock:                             # 送信バッファと排他
+            self.id += 1                            # 配信した番号を進める
+            data = message(values, self.id)         # 変化分のメッセージ
+            if snapshot is not None:                # 最新の値がある時
+                self.snapshot = message(snapshot, self.id)  # 新しい接続に送る値
+            for buf in self.clients.values():       # 各接続について
+                buf += data                         # 送信バッファに追加
+        self.wake()                                 # 配信スレッドを起こす
+    def _drop(self, sock):                          # 接続を切断
+        if sock in self.selector.get_map():         # 登録済みの時
+            self.selector.unregister(sock)          # 登録を解除
+        sock.close()                                # ソケットを閉じる
+        del self.clients[sock]                      # 送信バッファを削除
+        self.dropped += 1                           # 切断した数を加算
+    def loop(self):                                 # 配信スレッド
+        registered = self.selector.get_map()        # 登録済みのソケット
+        next_ping = monotonic() + self.keepalive    # 次の確認時刻
+        while True:                                 # 永久ループ
+            with self.lock:                         # 送信バッファと排他
+                for sock, buf in list(self.clients.items()):
+                    if len(buf) > self.max_buffer:  # 受け取れていない時
+                        self._drop(sock)            # 切断(再接続を待つ)
+                        continue                    # 次の接続へ
+                    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if buf else 0)
+                    key = registered.get(sock)      # 登録内容
+                    if key is None:                 # 未登録の時
+                        self.selector.register(sock, events)
+                    elif key.events != events:      # 送信の有無が変わった時
+                        self.selector.modify(sock, events)
+            ready = self.selector.select(max(next_ping - monotonic(), 0))
+            with self.lock:                         # 送信バッファと排他
+                for key, mask in ready:             # 各入出力について
+                    sock = key.fileobj              # ソケット
+                    if sock is self.wake_r:         # 起床の通知の時
+                        sock.recv(4096)             # 通知を読み捨てる
+                        continue                    # 次の入出力へ
+                    if sock not in self.clients:    # 切断済みの時
+                        continue                    # 次の入出力へ
+                    try:                            # 例外処理の監視を開始
+                        if mask & selectors.EVENT_READ and not sock.recv(4096):
+                            raise ConnectionError   # ブラウザが閉じた時
+                        if mask & selectors.EVENT_WRITE:    # 送信できる時
+                            buf = self.clients[sock]    # 送信バッファ
+                            del buf[:sock.send(buf)]    # 送信できた分を削除
+                    except BlockingIOError:         # まだ送受信できない時
+                        pass                        # 次回に送信
+                    except OSError:                 # 切断された時
+                        self._drop(sock)            # 接続を削除
+                if monotonic() >= next_ping:        # 確認時刻の時
+                    for buf in self.clients.values():   # 各接続について
+                        buf += b': ping\n\n'        # コメント(切断の検出用)
+                    next_ping = monotonic() + self.keepalive
+    def stats(self):                                # 状態の取得
+        return {'subscribers': len(self.clients), 'published': self.id,
+                'dropped': self.dropped}
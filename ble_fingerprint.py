@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Fingerprint ble_fingerprint.py
+# ランダムアドレスの変更(ローテーション)を追跡し、同じデバイスを1台として
+# 数える「ローテーション補正後」のデバイス数を求めます。
+#
+#   スマートフォン(接触確認アプリの0xFD6F等)は10～20分ごとにアドレスを
+#   変更するため、長い時間窓ではアドレス数がデバイス数を上回ります。
+#   本モジュールでは、アドレスが変わっても変化しない特徴(サービスUUID、
+#   メーカIDと種別、送信電力、ADの並びと長さ)を指紋として辞書に登録し、
+#   新しいアドレスが現れた時に、同じ指紋で直前に途絶えたアドレスのうち
+#   RSSIが最も近いものの後継として結び付けます。
+#
+#   ・新しいアドレスは settle 秒だけ様子を見てから判定します。その間に
+#     受信が続いている(途絶えていない)デバイスは候補から外れます
+#   ・候補は指紋ごとの辞書を最終受信順に保持し、link_window 秒より古い
+#     ものから削除するため、検索は定数時間で履歴も増え続けません
+#   ・結び付けた後に古いアドレスを再び受信した時は、誤りとして分離します
+#   ・公開アドレスと固定のランダムアドレス(static)はそのまま数えます
+#   ・途絶えたかどうかはRSSIの閾値未満の受信でも判断するため、add() には
+#     全ての受信を渡し、数えない受信には count=False を指定します
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_fingerprint import FingerprintIndex
+#   FP = FingerprintIndex((30, 300, 3600))          # 30秒, 5分, 1時間の窓
+#   FP.add(dev)                                     # 受信したScanEntryを記録
+#   print(FP.counts())                              # 補正後の {30: n, ...}
+
+spans = (30, 300, 3600)                             # 時間窓の長さ(秒)
+settle = 2.0                                        # 新しいアドレスの判定待ち(秒)
+link_window = 10.0                                  # 途絶えてから後継までの最大(秒)
+rssi_tolerance = 10                                 # 同じデバイスとみなすRSSI差(dB)
+alpha = 0.3                                         # RSSI平滑化の係数
+
+from collections import OrderedDict                 # 順序付き辞書を組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+from ble_dedup import AddressWindow                 # 時間窓付きの表を組み込む
+from ble_record import merged_ad                    # まとめたADの取得を組み込む
+
+service_data = {0x16: 2, 0x20: 4, 0x21: 16}         # サービスデータのUUID長
+
+def features(raw):                                  # ADから変化しない特徴を抽出
+    layout = list()                                 # (タイプ, 長さ, 特徴)の列
+    i = 0                                           # 読み出し位置
+    while i + 1 < len(raw):                         # ADが残っている間
+        n = raw[i]                                  # ADの長さ(タイプを含む)
+        if n == 0 or i + 1 + n > len(raw):          # 終端または途中の時
+            break                                   # 抽出を終了
+        tag, data = raw[i + 1], raw[i + 2:i + 1 + n]    # タイプとデータ
+        if tag <= 10:                               # Flags,UUID列,名前,送信電力
+            stable = data                           # 全体が特徴
+        elif tag in service_data:                   # サービスデータの時
+            stable = data[:service_data[tag]]       # UUIDだけが特徴
+        elif tag == 0xff:                           # メーカ固有データの時
+            stable = data[:3]                       # メーカIDと種別が特徴
+        else:                                       # その他
+            stable = b''                            # タイプと長さのみ
+        layout.append((tag, n, stable))             # 特徴を追加
+        i += 1 + n                                  # 次のADへ
+    return tuple(layout)                            # 辞書のキーに使える形で応答
+
+def rotating(dev):                                  # アドレスを変更するデバイスか
+    return dev.addrType == 'random' and int(dev.addr[0], 16) >> 2 != 3
+
+class Identity:                                     # 1台のデバイス(アドレスの系列)
+    __slots__ = ('id', 'addr', 'key', 'rssi', 'last')
+    def __init__(self, id, addr, key, rssi, now):   # コンストラクタ作成
+        self.id = id                                # デバイスの番号
+        self.addr = addr                            # 現在のアドレス
+        self.key = key                              # 指紋(変更しない時はNone)
+        self.rssi = rssi                            # 平滑化したRSSI
+        self.last = now                             # 最終受信時刻
+
+class FingerprintIndex:                             # クラスFingerprintIndexの定義
+    def __init__(self, spans=spans, clock=monotonic, settle=settle,
+                 link_window=link_window, rssi_tolerance=rssi_tolerance):
+        self.spans = tuple(sorted(spans))           # 時間窓の長さ(短い順)
+        self.clock = clock                          # 時刻取得関数
+        self.settle = settle                        # 判定待ち(秒)
+        self.link_window = link_window              # 後継までの最大(秒)
+        self.rssi_tolerance = rssi_tolerance        # 同一とみなすRSSI差
+        self.window = AddressWindow(self.spans, clock)  # デバイス番号の時間窓
+        self.addrs = OrderedDict()                  # アドレス→(デバイス, 時刻)
+        self.pending = OrderedDict()                # 判定待ち→[初回,RSSI,指紋,数える]
+        self.buckets = dict()                       # 指紋→{番号: デバイス}
+        self.next_id = 0                            # 次のデバイスの番号
+        self.links = 0                              # 後継として結び付けた数
+        self.splits = 0                             # 誤りとして分離した数
+    def _new(self, addr, key, rssi, now):           # 新しいデバイスを登録
+        self.next_id += 1                           # 番号を進める
+        return Identity(self.next_id, addr, key, rssi, now)
+    def _touch(self, ident, addr, rssi, now, count=True):   # 受信を記録
+        ident.rssi += (rssi - ident.rssi) * alpha   # RSSIを平滑化
+        ident.last = now                            # 最終受信時刻を更新
+        self.addrs[addr] = (ident, now)             # アドレスの最終受信時刻
+        self.addrs.move_to_end(addr)                # 最も新しい位置へ移動
+        if ident.key is not None:                   # アドレスを変更する時
+            bucket = self.buckets.setdefault(ident.key, OrderedDict())
+            bucket[ident.id] = ident                # 指紋の候補に登録
+            bucket.move_to_end(ident.id)            # 最も新しい位置へ移動
+            self._expire_bucket(ident.key, now - self.settle - self.link_window)
+        if count:                                   # 数える受信の時
+            self.window.add(ident.id, now)          # デバイス番号を記録
+    def _expire_bucket(self, key, limit):           # 古い候補を削除
+        bucket = self.buckets[key]                  # 指紋の候補
+        while bucket:                               # 候補がある間
+            ident = next(iter(bucket.values()))     # 最も古い候補
+            if ident.last >= limit:                 # 期限内の時
+                return                              # 削除を終了
+            del bucket[ident.id]                    # 候補から削除
+        del self.buckets[key]                       # 空の指紋を削除
+    def _link(self, addr, first, rssi, key):        # 途絶えたデバイスを探す
+        if key in self.buckets:                     # 同じ指紋の候補がある時
+            self._expire_bucket(key, first - self.link_window)  # 古い候補を削除
+        bucket = self.buckets.get(key)              # 同じ指紋の候補
+        best = None                                 # 最もRSSIが近い候補
+        for ident in (bucket or {}).values():       # 古い順に
+            if ident.last >= first:                 # 新しいアドレスの後も受信
+                break                               # 以降は途絶えていない
+            diff = abs(ident.rssi - rssi)           # RSSIの差
+            if diff <= self.rssi_tolerance and (best is None or diff <= abs(best.rssi - rssi)):
+                best = ident                        # 候補を更新
+        if best is None:                            # 候補が無い時
+            return self._new(addr, key, rssi, first)    # 新しいデバイス
+        del bucket[best.id]                         # 候補から削除(二重の後継を防ぐ)
+        best.addr = addr                            # アドレスを後継に変更
+        self.links += 1                             # 結び付けた数を加算
+        return best                                 # 後継元のデバイスを応答
+    def _resolve(self, now):                        # 判定待ちのアドレスを判定
+        while self.pending:                         # 判定待ちがある間
+            addr, (first, rssi, key, count) = next(iter(self.pending.items()))
+            if first > now - self.settle:           # 判定待ちの時間内の時
+                return                              # 判定を終了
+            del self.pending[addr]                  # 判定待ちから削除
+            self._touch(self._link(addr, first, rssi, key), addr, rssi, now, count)
+    def _expire(self, limit):                       # 古いアドレスを削除
+        while self.addrs:                           # アドレスがある間
+            addr, (ident, t) = next(iter(self.addrs.items()))
+            if t > limit:                           # 期限内の時
+                return                              # 削除を終了
+            del self.addrs[addr]                    # 期限切れを削除
+            bucket = self.buckets.get(ident.key)    # 指紋の候補
+            if bucket and ident.addr == addr and bucket.pop(ident.id, None) and not bucket:
+                del self.buckets[ident.key]         # 空の指紋を削除
+    def add(self, dev, now=None, count=True):       # 受信記録用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._resolve(now)                          # 判定待ちを処理
+        self._expire(now - self.spans[-1])          # 最長の窓より古いものを削除
+        entry = self.addrs.get(dev.addr)            # 記録済みのアドレスか
+        if entry is not None:                       # 記録済みの時
+            ident = entry[0]                        # デバイス
+            if ident.addr != dev.addr:              # 後継に結び付けた古いアドレス
+                self.splits += 1                    # 誤りとして分離
+                ident = self._new(dev.addr, ident.key, dev.rssi, now)
+            self._touch(ident, dev.addr, dev.rssi, now, count)  # 受信を記録
+            return                                  # 処理を終了
+        p = self.pending.get(dev.addr)              # 判定待ちのアドレスか
+        if p is not None:                           # 判定待ちの時
+            p[1] += (dev.rssi - p[1]) * alpha       # RSSIを平滑化
+            p[3] = p[3] or count                    # 数える受信があったか
+            p[2] = (dev.connectable, features(merged_ad(dev)))  # スキャン応答を含む特徴
+        elif rotating(dev):                         # アドレスを変更するデバイス
+            key = (dev.connectable, features(merged_ad(dev)))   # 広告とスキャン応答の特徴
+            self.pending[dev.addr] = [now, dev.rssi, key, count]    # 判定待ちに追加
+        else:                                       # 変更しないデバイスの時
+            ident = self._new(dev.addr, None, dev.rssi, now)    # 新しいデバイス
+            self._touch(ident, dev.addr, dev.rssi, now, count)  # 受信を記録
+    def count(self, span=None, now=None):           # デバイス数取得用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._resolve(now)                          # 判定待ちを処理
+        return self.window.count(span, now)         # 補正後のデバイス数を応答
+    def counts(self, now=None):                     # 全窓のデバイス数を取得
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._resolve(now)                          # 判定待ちを処理
+        return self.window.counts(now)              # {30: n, 300: n, 3600: n}
+    def stats(self):                                # 状態の取得
+        return {'addresses': len(self.addrs), 'pending': len(self.pending),
+                'fingerprints': len(self.buckets), 'links': self.links,
+                'splits': self.splits}
+    def __len__(self):                              # len()は最短の窓の数
+        return self.count()                         # デバイス数を応答
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE History ble_history.py
+# デバイス数やセンサ値(counter, co2, tvoc, temp など)の履歴を、固定の大きさの
+# リングバッファに複数の解像度で保持します。
+#
+#   動作間隔ごとの値(raw)を直近 10分間、1分・15分・1時間ごとの最小値・
+#   平均値・最大値を、それぞれ 24時間・7日間・30日間 保持します。
+#   各解像度の区間は時計の区切り(毎分0秒、毎時0分など)に合わせます。
+#   配列は最初に確保し、古いものから上書きするため、長時間動作させても
+#   メモリ使用量は増えません(1項目あたり約64KB)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_history import History
+#   history = History()                             # 履歴を生成
+#   history.add({'counter': 3, 'co2': 420})         # 動作間隔ごとに値を記録
+#   print(history.get('co2', res=60, since=3600))   # 直近1時間の1分ごとの値
+#                                                   # [[時刻,最小,平均,最大],...]
+
+levels = ((0, 600), (60, 1440), (900, 672), (3600, 720))    # (解像度秒, 保持数)
+
+from array import array                             # 配列を組み込む
+from time import time                               # 時間取得を組み込む
+
+class Ring:                                         # 固定長のリングバッファ
+    def __init__(self, size, columns):              # コンストラクタ作成
+        self.size = size                            # 保持数
+        self.t = array('d', bytes(8 * size))        # 時刻(区間の開始時刻)
+        self.columns = [array('f', bytes(4 * size)) for i in range(columns)]
+        self.pos = 0                                # 次に書き込む位置
+        self.count = 0                              # 保持している数
+    def append(self, t, *values):                   # 1件を追加
+        i = self.pos                                # 書き込む位置
+        self.t[i] = t                               # 時刻を書き込む
+        for column, value in zip(self.columns, values):
+            column[i] = value                       # 値を書き込む
+        self.pos = (i + 1) % self.size              # 次の位置(末尾の次は先頭)
+        self.count = min(self.count + 1, self.size) # 保持している数
+    def items(self, since=None):                    # 古い順に(時刻,値...)を取得
+        start = self.pos - self.count               # 最も古い位置
+        for j in range(start, self.pos):            # 古い順に
+            i = j % self.size                       # 配列上の位置
+            if since is None or self.t[i] >= since: # 指定時刻以降の時
+                yield (self.t[i],) + tuple(round(c[i], 2) for c in self.columns)
+    def nbytes(self):                               # 使用中のメモリ量
+        return sum(a.buffer_info()[1] * a.itemsize for a in [self.t] + self.columns)
+
+class Series:                                       # 1項目の複数解像度の履歴
+    def __init__(self, levels=levels):              # コンストラクタ作成
+        self.raw = Ring(levels[0][1], 1)            # 動作間隔ごとの値
+        self.levels = [(res, Ring(size, 3)) for res, size in levels[1:]]
+        self.buckets = [None] * len(self.levels)    # 集計中の[開始,最小,合計,最大,数]
+    def add(self, t, value):                        # 値を記録
+        self.raw.append(t, value)                   # そのまま記録
+        for k, (res, ring) in enumerate(self.levels):   # 各解像度について
+            b = self.buckets[k]                     # 集計中の区間
+            start = t - t % res                     # 値が属する区間の開始時刻
+            if b is not None and b[0] != start:     # 区間が変わった時
+                ring.append(b[0], b[1], b[2] / b[4], b[3])  # 最小,平均,最大を記録
+                b = None                            # 新しい区間へ
+            if b is None:                           # 新しい区間の時
+                self.buckets[k] = [start, value, value, value, 1]
+            else:                                   # 同じ区間の時
+                b[1] = min(b[1], value)             # 最小値
+                b[2] += value                       # 合計
+                b[3] = max(b[3], value)             # 最大値
+                b[4] += 1                           # 数
+    def get(self, res=0, since=None):               # 履歴を取得
+        if res == 0:                                # 動作間隔ごとの時
+            return [[t, v, v, v] for t, v in self.raw.items(since)]
+        for k, (r, ring) in enumerate(self.levels): # 各解像度について
+            if r == res:                            # 指定の解像度の時
+                points = [list(p) for p in ring.items(since)]
+                b = self.buckets[k]                 # 集計中の区間
+                if b is not None and (since is None or b[0] >= since):
+                    points.append([b[0], b[1], round(b[2] / b[4], 2), b[3]])    # 途中の区間
+                return points                       # [[時刻,最小,平均,最大],...]
+        raise ValueError('unknown resolution: %s' % res)
+    def nbytes(self):                               # 使用中のメモリ量
+        return self.raw.nbytes() + sum(ring.nbytes() for res, ring in self.levels)
+
+class History:                                      # クラスHistoryの定義
+    def __init__(self, keys=None, levels=levels, clock=time):   # コンストラクタ作成
+        self.keys = keys                            # 記録する項目(Noneは数値全て)
+        self.levels = levels                        # (解像度秒, 保持数)の列
+        self.clock = clock                          # 時刻取得関数
+        self.series = dict()                        # 項目名→Series
+    def add(self, values, now=None):                # 動作間隔ごとの値を記録
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        for key, value in values.items():           # 各項目について
+            if self.keys is not None and key not in self.keys:
+                continue                            # 記録しない項目
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue                            # 数値以外(未取得のNone等)
+            series = self.series.get(key)           # 項目の履歴
+            if series is None:                      # 初めての項目の時
+                series = self.series[key] = Series(self.levels)
+            series.add(now, value)                  # 値を記録
+    def get(self, key, res=0, since=None, now=None):    # 直近since秒間の履歴
+        if since is not None:                       # 期間の指定がある時
+            if now is None:                         # 時刻が未指定の時
+                now = self.clock()                  # 現在の時刻を取得
+            since = now - since                     # 開始時刻
+        return self.series[key].get(res, since)     # [[時刻,最小,平均,最大],...]
+    def stats(self):                                # 状態の取得
+        return {'keys': sorted(self.series), 'levels': [res for res, size in self.levels],
+                'bytes': sum(s.nbytes() for s in self.series.values())}
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE HyperLogLog ble_hll.py
+# 大量のランダムアドレスを固定メモリで数える近似カウント(HyperLogLog)です。
+#
+#   アドレスを保持しないため、数千～数百万のアドレスが届いてもメモリ量は
+#   一定です。誤差の目標値(error)から登録簿(レジスタ)の数を決めます。
+#   スケッチ同士は結合(merge)できるため、時間窓や複数ノードの集計に
+#   使えます。dumps() / loads() は、スケッチをUDPで送るための文字列
+#   (精度p:圧縮したレジスタのBase64)への変換です(ble_collector.py)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_hll import SketchWindow
+#   MAC = SketchWindow((60, 900, 3600), error=0.02) # 1分, 15分, 1時間の窓
+#   MAC.add(dev.addr)                               # 受信したアドレスを記録
+#   print(MAC.counts())                             # {60: n, 900: n, 3600: n}
+#
+#【参考文献】
+#   P. Flajolet et al., "HyperLogLog: the analysis of a near-optimal
+#   cardinality estimation algorithm", 2007
+
+spans = (60, 900, 3600)                             # 時間窓の長さ(秒)
+error = 0.02                                        # 誤差の目標値(標準誤差)
+slot = 15                                           # 時間窓の刻み(秒)
+
+from hashlib import blake2b                         # ハッシュ関数を組み込む
+from math import ceil, log, log2                    # 数学関数を組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+import base64                                       # Base64変換を組み込む
+import zlib                                         # 圧縮を組み込む
+
+_inverse = [2.0 ** -r for r in range(66)]           # 2のマイナスr乗の表
+_high = dict()                                      # レジスタ数ごとの最上位ビット列
+
+def lanemax(a, b, high):                            # バイトごとの最大値(整数演算)
+    ge = ((a | high) - b) & high                    # a >= b のバイトに最上位ビット
+    mask = (ge >> 7) * 0xff                         # a >= b のバイトを0xffに
+    return (a & mask) | (b & ~mask)                 # 大きい方のバイトを選択
+
+def hash64(addr):                                   # アドレスの64ビットハッシュ
+    if isinstance(addr, str):                       # 文字列の時
+        addr = addr.encode()                        # バイト列へ変換
+    return int.from_bytes(blake2b(addr, digest_size=8).digest(), 'big')
+
+class HyperLogLog:                                  # クラスHyperLogLogの定義
+    def __init__(self, error=error, p=None):        # コンストラクタ作成
+        if p is None:                               # 精度pが未指定の時
+            p = ceil(log2((1.04 / error) ** 2))     # 誤差から精度pを決定
+        self.p = min(max(p, 4), 16)                 # 精度pを4～16に制限
+        self.m = 1 << self.p                        # レジスタ数
+        self.registers = bytearray(self.m)          # レジスタ(固定メモリ)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)  # 補正係数
+        if self.m not in _high:                     # 最上位ビット列が未作成の時
+            _high[self.m] = int.from_bytes(b'\x80' * self.m, 'big')
+        self.high = _high[self.m]                   # 各バイトの最上位ビット(共有)
+    def add(self, addr):                            # アドレス記録用メソッド
+        h = hash64(addr)                            # ハッシュ値を計算
+        i = h >> (64 - self.p)                      # 上位pビットでレジスタ選択
+        w = h & ((1 << (64 - self.p)) - 1)          # 残りのビット
+        rank = 64 - self.p - w.bit_length() + 1     # 先頭から連続する0の数+1
+        if rank > self.registers[i]:                # 最大値を更新する時
+            self.registers[i] = rank                # レジスタを更新
+            return True                             # 変化ありを応答
+        return False                                # 変化なしを応答
+    def merge(self, other):                         # 他のスケッチとの結合
+        if other.p != self.p:                       # 精度が異なる時
+            raise ValueError('HyperLogLog precision mismatch')
+        self.from_int(lanemax(self.to_int(), other.to_int(), self.high))
+        return self                                 # 自身を応答
+    def to_int(self):                               # レジスタを整数へ変換
+        return int.from_bytes(self.registers, 'big') # 1バイト1レジスタ
+    def from_int(self, value):                      # 整数からレジスタへ変換
+        self.registers[:] = value.to_bytes(self.m, 'big')
+    def dumps(self):                                # 送信用の文字列へ変換
+        data = base64.b64encode(zlib.compress(bytes(self.registers), 9))
+        return '%d:%s' % (self.p, data.decode())    # 精度p:圧縮したレジスタ
+    @classmethod
+    def loads(cls, text):                           # 文字列からスケッチを生成
+        p, data = text.split(':', 1)                # 精度pとレジスタ
+        hll = cls(p=int(p))                         # 同じ精度で生成
+        registers = zlib.decompress(base64.b64decode(data))
+        if len(registers) != hll.m:                 # レジスタ数が合わない時
+            raise ValueError('HyperLogLog size mismatch')
+        hll.registers[:] = registers                # レジスタを復元
+        return hll                                  # スケッチを応答
+    def copy(self):                                 # 複製用メソッド
+        hll = HyperLogLog(p=self.p)                 # 同じ精度で生成
+        hll.registers[:] = self.registers           # レジスタを複製
+        return hll                                  # 複製を応答
+    def clear(self):                                # 消去用メソッド
+        self.registers[:] = bytes(self.m)           # レジスタを0に
+    def count(self):                                # 推定デバイス数を取得
+        raw = self.alpha * self.m * self.m / sum(map(_inverse.__getitem__, self.registers))
+        zeros = self.registers.count(0)             # 未使用レジスタ数
+        if raw <= 2.5 * self.m and zeros:           # 少数の時
+            return round(self.m * log(self.m / zeros))  # 線形カウントで推定
+        return round(raw)                           # 推定値を応答
+    def __len__(self):                              # len()で推定数を応答
+        return self.count()                         # 推定デバイス数を応答
+
+class SketchWindow:                                 # クラスSketchWindowの定義
+    def __init__(self, spans=spans, error=error, slot=slot, clock=monotonic):
+        self.spans = tuple(sorted(spans))           # 時間窓の長さ(短い順)
+        self.slot = slot                            # 時間窓の刻み(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.n = ceil(self.spans[-1] / slot) + 1    # 刻みの数(現在の刻みを含む)
+        self.ring = [HyperLogLog(error) for i in range(self.n)]    # 刻みごと
+        self.frozen = [0] * self.n                  # 完了した刻み(整数表現)
+        self.merged = {span: 0 for span in self.spans} # 完了済みの刻みの結合
+        self.current = None                         # 現在の刻み番号
+    def _rotate(self, now):                         # 刻みの切り替え
+        k = int(now // self.slot)                   # 現在の刻み番号
+        if k == self.current:                       # 同じ刻みの時
+            return                                  # 処理を終了
+        if self.current is not None:                # 過去の刻みがある時
+            i = self.current % self.n               # 完了した刻みの位置
+            self.frozen[i] = self.ring[i].to_int()  # 整数表現で保持
+            for i in range(1, min(k - self.current, self.n) + 1):
+                i = (self.current + i) % self.n     # 古い刻みの位置
+                self.ring[i].clear()                # 古い刻みを消去
+                self.frozen[i] = 0                  # 整数表現も消去
+        self.current = k                            # 刻み番号を更新
+        high = self.ring[0].high                    # 各バイトの最上位ビット
+        total = 0                                   # 結合中のスケッチ
+        j = 0                                       # 結合済みの刻みの数
+        for span in self.spans:                     # 短い窓から順に
+            while j < ceil(span / self.slot):       # 窓内の完了済みの刻み
+                j += 1                              # 1つ前の刻みへ
+                total = lanemax(total, self.frozen[(k - j) % self.n], high)
+            self.merged[span] = total               # 結合結果を保持
+    def add(self, addr, now=None):                  # アドレス記録用メソッド
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._rotate(now)                           # 刻みを切り替え
+        return self.ring[self.current % self.n].add(addr)
+    def merge(self, hll, now=None):                 # 他のスケッチを現在の刻みへ結合
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._rotate(now)                           # 刻みを切り替え
+        self.ring[self.current % self.n].merge(hll) # 現在の刻みと結合
+    def sketch(self, span=None, now=None):          # 時間窓のスケッチを取得
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        self._rotate(now)                           # 刻みを切り替え
+        hll = self.ring[self.current % self.n].copy() # 現在の刻み
+        merged = self.merged[span or self.spans[0]] # 完了済みの刻み
+        hll.from_int(lanemax(hll.to_int(), merged, hll.high))
+        return hll                                  # 時間窓のスケッチを応答
+    def count(self, span=None, now=None):           # デバイス数取得用メソッド
+        return self.sketch(span, now).count()       # 推定デバイス数を応答
+    def counts(self, now=None):                     # 全窓のデバイス数を取得
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        return {span: self.count(span, now) for span in self.spans}
+    def __len__(self):                              # len()は最短の窓の数
+        return self.count()                         # 推定デバイス数を応答
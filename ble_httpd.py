@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE HTTPD ble_httpd.py
+# BLEビーコン数やセンサ値をHTTPサーバでLAN内に配信する出力先です。
+#
+#   chart を指定しない時は "counter = 3" 形式のテキストを、指定した時は
+#   棒グラフ付きのHTMLを応答します。/stats には送信スレッドの待ち行列の
+#   長さや送信遅延をJSONで応答します。/devices?since=秒 には直近に受信した
+#   アドレスごとの受信回数やRSSI(ble_devices.py)をJSONで応答します。
+#   /history には値の履歴(ble_history.py)をJSONで応答します。
+#   /analytics にはRSSIの分布とアドレスごとの平滑化したRSSI、在室数の推定
+#   (ble_analytics.py)をJSONで応答します。
+#   /metrics には処理時間や件数(ble_metrics.py)を Prometheus の形式で応答します。
+#   /nodes には複数のノードを集計した時(ble_collector.py)のノードごとの値を
+#   JSONで応答します。
+#       /history                            項目名と解像度の一覧
+#       /history?name=co2&res=60&since=3600 直近1時間の1分ごとの最小・平均・最大
+#                                           (res=0,60,900,3600、nameは複数指定可)
+#
+#   threads = True の時は、リクエストごとにスレッドで応答するため、複数の
+#   ダッシュボードを同時に開いても待たされません。cache = True の時は、
+#   応答を値の更新(動作間隔)ごとに1回だけ作成して保持し、以降は保持した
+#   応答を返します。応答には ETag と Last-Modified を付与し、内容が変わって
+#   いない時は 304 Not Modified を(本文なしで)返します。
+#
+#   events = True の時は、/events で値(棒グラフの項目、chart が無い時は
+#   counter, co2, tvoc, temp)の変化分を Server-Sent Events で配信します
+#   (ble_events.py)。棒グラフのページは /events を購読して表示を更新する
+#   ため、ページ全体の再読み込み(meta refresh)はJavaScriptが無い時だけです。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+threads = True                                      # スレッドで並行に応答する
+cache = True                                        # 応答を更新ごとに1回だけ作成
+access_log = True                                   # アクセスを表示する
+events = True                                       # 値の変化をSSEで配信する
+keys = ('counter', 'occupancy', 'co2', 'tvoc', 'temp')  # 配信する値(chartが無い時)
+
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler, ServerHandler
+from socketserver import ThreadingMixIn             # スレッド化を組み込む
+from email.utils import formatdate, parsedate_to_datetime   # HTTPの日時形式
+from ble_sinks import Sink                          # 出力先の基底クラス
+from ble_events import EventStream                  # SSEの配信を組み込む
+from ble_metrics import registry, content_type      # 計測値を組み込む
+from urllib.parse import parse_qs                   # クエリの分解を組み込む
+from time import time                               # 時間取得を組み込む
+import threading                                    # スレッド管理を組み込む
+import json                                         # JSON変換を組み込む
+import socket                                       # ソケットを組み込む
+import zlib                                         # CRC32(ETag用)を組み込む
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):  # スレッド化したサーバ
+    daemon_threads = True                           # 終了時に応答中でも終了
+    request_queue_size = 128                        # 接続待ちの最大数
+
+class StreamHandler(WSGIRequestHandler):            # /events を配信へ渡す
+    def handle(self):                               # 1件のリクエストの処理
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:       # リクエスト行が長すぎる時
+            self.requestline = self.request_version = self.command = ''
+            self.send_error(414)                    # 414エラーを応答
+            return                                  # 処理を終了
+        if not self.parse_request():                # 不正なリクエストの時
+            return                                  # エラーは応答済み
+        stream = getattr(self.server, 'stream', None)   # SSEの配信
+        if stream is None or self.path.split('?')[0] != '/events':
+            handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(),
+                                    self.get_environ(), multithread=False)
+            handler.request_handler = self          # アクセス表示用
+            handler.run(self.server.get_app())      # WSGIアプリを実行
+            return                                  # 処理を終了
+        self.log_request(200)                       # アクセスを表示
+        sock = socket.socket(fileno=self.request.detach())  # ソケットを引き取る
+        stream.subscribe(sock)                      # 配信スレッドへ渡す
+    def log_message(self, format, *args):           # アクセス表示の処理
+        if getattr(self.server, 'access_log', True):    # 表示する時
+            WSGIRequestHandler.log_message(self, format, *args)
+
+def barChartHtml(name, val, max, color='green'):    # 棒グラフHTMLを作成する関数
+    html = '<tr><td>' + name + '</td>\n'            # 棒グラフ名を表示
+    html += '<td align="right">'+str(val)+'</td>\n' # 変数valの値を表示
+    i= round(200 * val / max)                       # 棒グラフの長さを計算
+    if val >= max * 0.75:                           # 75％以上のとき
+        color = 'red'                               # 棒グラフの色を赤に
+        if val > max:                               # 最大値(100％)を超えた時
+            i = 200                                 # グラフ長を200ポイントに
+    html += '<td><div style="background-color: ' + color
+    html += '; width: ' + str(i) + 'px">&nbsp;</div></td>\n'
+    return html                                     # HTMLデータを返却
+
+chart_script = '''<script>
+var chart = %s;
+if (window.EventSource) {
+  new EventSource('/events').onmessage = function(e) {
+    var v = JSON.parse(e.data), rows = document.getElementById('chart').rows;
+    chart.forEach(function(c, i) {
+      if (!(c[1] in v)) return;
+      var val = v[c[1]] || 0, bar = rows[i + 1].cells[2].firstChild;
+      rows[i + 1].cells[1].textContent = val;
+      bar.style.width = (val > c[2] ? 200 : Math.round(200 * val / c[2])) + 'px';
+      bar.style.backgroundColor = val >= c[2] * 0.75 ? 'red' : 'green';
+    });
+  };
+}
+</script>
+'''                                                 # 値の変化で棒グラフを更新
+
+def not_modified_since(since, modified):            # If-Modified-Since の判定
+    if not since:                                   # 指定が無い時
+        return False                                # 更新ありとして応答
+    try:                                            # 例外処理の監視を開始
+        return parsedate_to_datetime(since).timestamp() >= modified
+    except (TypeError, ValueError):                 # 日時の形式が不正な時
+        return False                                # 更新ありとして応答
+
+class HttpSink(Sink):                               # HTTPサーバ用の出力先
+    def __init__(self, port=80, chart=None, threads=threads, cache=cache,
+                 access_log=access_log, events=events):  # コンストラクタ作成
+        self.port = port                            # HTTPポート番号
+        self.chart = chart                          # 棒グラフ(名前,キー,最大値)
+        self.threads = threads                      # スレッドで並行に応答する
+        self.cache = cache                          # 応答を保持する
+        self.access_log = access_log                # アクセスを表示する
+        self.events = events                        # 値の変化をSSEで配信する
+        self.keys = [key for name, key, max in chart] if chart else list(keys)
+        self.stream = None                          # SSEの配信(開始時に生成)
+        self.published = dict()                     # 配信済みの値
+        self.values = dict()                        # 最新の値
+        self.lock = threading.Lock()                # 応答の作成の排他制御
+        self.responses = dict()                     # (パス,クエリ)→作成した応答
+        self.tags = dict()                          # (パス,クエリ)→(ETag,更新時刻)
+        self.requests = 0                           # 応答した数
+        self.renders = 0                            # 応答を作成した数
+        self.not_modified = 0                       # 304を応答した数
+    def start(self, pipeline):                      # 開始時の処理
+        Sink.start(self, pipeline)                  # パイプラインを保持
+        self.values = pipeline.values               # 初期値を保持
+        if self.events:                             # SSEで配信する時
+            self.stream = EventStream()             # 配信スレッドを起動
+        self.thread = threading.Thread(target=self.httpd, daemon=True)
+        self.thread.start()                         # スレッドhttpdの起動
+    def update(self, values):                       # 動作間隔ごとの処理
+        with self.lock:                             # 応答の作成と排他
+            self.values = values                    # 最新の値を保持
+            self.responses = dict()                 # 作成した応答を破棄
+        if self.stream is not None:                 # SSEで配信する時
+            current = {key: values[key] for key in self.keys if key in values}
+            changed = {key: val for key, val in current.items()
+                       if key not in self.published or self.published[key] != val}
+            if changed:                             # 値が変化した時
+                self.stream.publish(changed, current)   # 変化分を配信
+                self.published = current            # 配信済みの値を更新
+    def httpd(self):                                # HTTPサーバ用スレッド
+        server = ThreadingWSGIServer if self.threads else WSGIServer
+        htserv = make_server('', self.port, self.wsgi_app, server, StreamHandler)
+        htserv.stream = self.stream                 # SSEの配信(無しはNone)
+        htserv.access_log = self.access_log         # アクセスを表示する
+        print('HTTP port', self.port)               # ポート番号を表示
+        htserv.serve_forever()                      # HTTPサーバを起動
+    def stats(self):                                # 状態の取得
+        stats = {'requests': self.requests, 'renders': self.renders,
+                 'not_modified': self.not_modified}
+        if self.stream is not None:                 # SSEで配信する時
+            stats['events'] = self.stream.stats()   # 購読数と配信数
+        return stats                                # 状態を応答
+    def wsgi_app(self, environ, start_response):    # HTTPアクセス受信時の処理
+        key = (environ.get('PATH_INFO'), environ.get('QUERY_STRING', ''))
+        if not self.cache:                          # 応答を保持しない時
+            self.requests += 1                      # 応答した数を加算
+            self.renders += 1                       # 作成した数を加算
+            status, ctype, body = self.render(*key) # 毎回作成
+            start_response(status, [('Content-type', ctype)] if ctype else [])
+            return [body]                           # 応答メッセージを返却
+        with self.lock:                             # 応答の作成と排他
+            self.requests += 1                      # 応答した数を加算
+            response = self.responses.get(key)      # 作成済みの応答
+            if response is None:                    # 更新後に初めての時
+                response = self.responses[key] = self.cached(key)
+        status, headers, body, etag, modified = response
+        match = environ.get('HTTP_IF_NONE_MATCH')   # 前回受け取ったETag
+        if etag and (match == etag if match else    # ETagを優先して判定
+                     not_modified_since(environ.get('HTTP_IF_MODIFIED_SINCE'), modified)):
+            self.not_modified += 1                  # 304を応答した数を加算(概数)
+            start_response('304 Not Modified', headers[1:])
+            return [b'']                            # 本文なし
+        start_response(status, headers)             # ヘッダを設定
+        return [body]                               # 応答メッセージを返却
+    def cached(self, key):                          # 保持する応答を作成
+        status, ctype, body = self.render(*key)     # 応答を作成
+        self.renders += 1                           # 作成した数を加算
+        headers = [('Content-type', ctype)] if ctype else []
+        if not status.startswith('200'):            # エラーの時
+            return (status, headers, body, None, None)  # ETagなし
+        etag = '"%08x"' % zlib.crc32(body)          # 本文からETagを作成
+        tag = self.tags.get(key)                    # 前回のETagと更新時刻
+        modified = tag[1] if tag and tag[0] == etag else int(time())
+        if len(self.tags) >= 256:                   # クエリの種類が多すぎる時
+            self.tags = dict()                      # 保持したETagを破棄
+        self.tags[key] = (etag, modified)           # ETagと更新時刻を保持
+        headers += [('ETag', etag), ('Last-Modified', formatdate(modified, usegmt=True)),
+                    ('Cache-Control', 'no-cache')]  # 毎回確認するよう指示
+        return (status, headers, body, etag, modified)
+    def render(self, path, query):                  # 応答(状態,形式,本文)を作成
+        if path == '/stats':                        # 状態の取得の時
+            return ('200 OK', 'application/json', json.dumps(self.pipeline.stats()).encode())
+        if path == '/metrics':                      # 計測値の時
+            return ('200 OK', content_type, registry.render().encode())
+        if path == '/devices':                      # アドレスごとの状態の時
+            return self.devices_app(query)          # 状態表を応答
+        if path == '/history':                      # 値の履歴の時
+            return self.history_app(query)          # 履歴を応答
+        if path == '/nodes':                        # ノードごとの値の時
+            return self.nodes_app()                 # ノードごとの値を応答
+        if path == '/analytics':                    # RSSIの分析結果の時
+            return self.analytics_app()             # 分析結果を応答
+        if self.chart:                              # 棒グラフ表示の時
+            return self.chart_app(path)             # 棒グラフを応答
+        res = ''                                    # 応答文
+        for key, val in self.values.items():        # 各値について
+            res += key + ' = ' + str(val) + '\r\n'  # 応答文を作成
+        return ('200 OK', 'text/plain; charset=utf-8', res.encode('utf-8'))
+    def devices_app(self, query):                   # アドレスごとの状態の応答
+        table = getattr(self.pipeline, 'table', None)   # 状態表
+        if table is None:                           # 状態表が無い時
+            return ('404 Not Found', None, '404 Not Found'.encode())
+        query = parse_qs(query)                     # クエリを分解
+        try:                                        # 例外処理の監視を開始
+            since = float(query['since'][0])        # 直近since秒間
+        except (KeyError, ValueError):              # 指定が無い・不正な時
+            since = self.pipeline.MAC.spans[0]      # 最短の時間窓
+        return ('200 OK', 'application/json', json.dumps(table.records(since)).encode())
+    def nodes_app(self):                            # ノードごとの値の応答
+        report = getattr(self.pipeline, 'report_nodes', None)   # 集計(Collector)
+        if report is None:                          # 集計していない時
+            return ('404 Not Found', None, '404 Not Found'.encode())
+        return ('200 OK', 'application/json', json.dumps(report()).encode())
+    def analytics_app(self):                        # RSSIの分析結果の応答
+        analytics = getattr(self.pipeline, 'analytics', None)   # 分析(ble_analytics.py)
+        if analytics is None:                       # 分析していない時
+            return ('404 Not Found', None, '404 Not Found'.encode())
+        return ('200 OK', 'application/json', json.dumps(analytics.report()).encode())
+    def history_app(self, query):                   # 値の履歴の応答
+        history = getattr(self.pipeline, 'history', None)   # 値の履歴
+        if history is None:                         # 履歴が無い時
+            return ('404 Not Found', None, '404 Not Found'.encode())
+        query = parse_qs(query)                     # クエリを分解
+        try:                                        # 例外処理の監視を開始
+            res = int(query.get('res', ['0'])[0])   # 解像度(秒)
+            since = float(query['since'][0]) if 'since' in query else None
+            if 'name' in query:                     # 項目名の指定がある時
+                body = {name: history.get(name, res, since) for name in query['name']}
+            else:                                   # 項目名の指定が無い時
+                body = history.stats()              # 項目名と解像度の一覧
+        except (KeyError, ValueError):              # 不明な項目・解像度の時
+            return ('400 Bad Request', None, '400 Bad Request'.encode())
+        return ('200 OK', 'application/json', json.dumps(body).encode())
+    def chart_app(self, path):                      # 棒グラフ用の応答処理
+        if path != '/':                             # パスがルート以外のとき
+            return ('404 Not Found', None, '404 Not Found'.encode())
+        values = self.values                        # 最新の値
+        html = '<html>\n<head>\n'                   # HTMLコンテンツを作成
+        if self.stream is None:                     # SSEで配信しない時
+            html += '<meta http-equiv="refresh" content="10;">\n'   # 自動再読み込み
+        else:                                       # SSEで配信する時
+            html += '<noscript><meta http-equiv="refresh" content="10;"></noscript>\n'
+        html += '</head>\n<body>\n'                 # 以下は本文
+        html += '<table id="chart" border=1>\n'     # 作表を開始
+        html += '<tr><th>項目</th><th width=50>値</th>' # 「項目」「値」を表示
+        html += '<th width=200>グラフ</th>\n'       # 「グラフ」を表示
+        for name, key, max in self.chart:           # 各棒グラフについて
+            html += barChartHtml(name, values.get(key) or 0, max)   # 棒グラフ化
+        html += '</tr>\n</table>\n'                 # 作表の終了
+        if self.stream is not None:                 # SSEで配信する時
+            html += chart_script % json.dumps(self.chart)   # 値の変化で表示を更新
+        html += '</body>\n</html>\n'                # htmlの終了
+        return ('200 OK', 'text/html; charset=utf-8', html.encode('utf-8'))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Log File ble_logfile.py
+# 受信したアドバタイジングを JSON Lines または CSV 形式でファイルに記録します。
+#
+#   書き込みはバッファを経由し、flush_interval 秒ごとにまとめて書き出すため、
+#   受信ごとにSDカードへ書き込むことはありません。ファイルが max_bytes を
+#   超えた時、または rotate_interval 秒を過ぎた時は、ファイル名に日時を
+#   付けて退避し、新しいファイルに切り替えます(max_files より古いものは削除)。
+#
+#   ChangeFilter は同じアドレスの同じ内容の繰り返しを除き、ADの内容が
+#   変わった時か、RSSIが閾値(dB)を超えて変化した時だけ記録します。RSSIは
+#   受信ごとのばらつきが大きいため、平滑化した値を前回記録した値と比べます。
+#   ttl 秒以上受信しなかったアドレスは、次の受信を新しいものとして記録します。
+#   ADは、アドバタイジングとスキャン応答をまとめた内容(merged_ad)で比べて
+#   記録します(rawData はアクティブスキャンでは両者が交互に入るため)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_logfile import LogWriter, ChangeFilter
+#   log = LogWriter('ble.jsonl')                    # 'ble.csv' でCSV形式
+#   changes = ChangeFilter(rssi_threshold=6)        # 変化時のみ記録
+#   def found(dev):                                 # 受信ごとに呼ばれる関数
+#       if changes.changed(dev):                    # 変化した時
+#           log.write(dev)                          # 1行を記録
+#       (終了時)
+#   log.close()                                     # 書き出してファイルを閉じる
+#
+#【記録形式】
+#   {"t":1622505600.123,"addr":"72:3b:..","type":"random","rssi":-60,"conn":0,"adv":"02011a.."}
+#   t,addr,type,rssi,conn,adv                       (CSV形式、ファイルごとに見出し行)
+
+max_bytes = 4 * 1024 * 1024                         # 切り替えるファイルの大きさ
+rotate_interval = 3600                              # 切り替える間隔(秒)
+max_files = 24                                      # 退避したファイルの保持数
+flush_interval = 10                                 # 書き出し間隔(秒)
+buffer_size = 64 * 1024                             # 書き込みバッファの大きさ
+rssi_threshold = 6                                  # 記録するRSSIの変化(dB)
+ttl = 300                                           # 同じ内容を省く時間(秒)
+alpha = 0.3                                         # RSSI平滑化の係数
+
+from collections import OrderedDict                 # 順序付き辞書を組み込む
+from time import time, monotonic, strftime, localtime   # 時間取得を組み込む
+from ble_record import merged_ad                    # まとめたADの取得を組み込む
+import glob                                         # ファイル名の検索を組み込む
+import json                                         # JSON変換を組み込む
+import os                                           # ファイル操作を組み込む
+
+columns = ('t', 'addr', 'type', 'rssi', 'conn', 'adv')  # 記録する項目
+
+class LogWriter:                                    # クラスLogWriterの定義
+    def __init__(self, path, fmt=None, max_bytes=max_bytes,
+                 rotate_interval=rotate_interval, max_files=max_files,
+                 flush_interval=flush_interval, clock=time):
+        self.path = path                            # 記録するファイル名
+        if fmt is None:                             # 形式が未指定の時
+            fmt = 'csv' if path.endswith('.csv') else 'jsonl'   # 拡張子で判断
+        self.fmt = fmt                              # 形式(jsonl または csv)
+        self.max_bytes = max_bytes                  # 切り替えるファイルの大きさ
+        self.rotate_interval = rotate_interval      # 切り替える間隔(秒)
+        self.max_files = max_files                  # 退避したファイルの保持数
+        self.flush_interval = flush_interval        # 書き出し間隔(秒)
+        self.clock = clock                          # 記録する時刻の取得関数
+        self.lines = 0                              # 記録した行数
+        self.bytes = 0                              # 記録したバイト数
+        self.rotations = 0                          # 切り替えた回数
+        self.fp = None                              # ファイル(未作成)
+        self._open()                                # ファイルを作成
+    def _open(self):                                # ファイルを作成
+        self.fp = open(self.path, 'a', buffering=buffer_size, newline='')
+        self.size = self.fp.tell()                  # 現在の大きさ
+        self.opened = self.flushed = monotonic()    # 作成・書き出し時刻
+        if self.fmt == 'csv' and self.size == 0:    # 新しいCSVファイルの時
+            self._write(','.join(columns) + '\n')   # 見出し行を書き込む
+    def _write(self, line):                         # 1行を書き込む
+        self.fp.write(line)                         # バッファへ書き込む
+        n = len(line)                               # 書き込んだ大きさ(ASCII)
+        self.size += n                              # ファイルの大きさ
+        self.bytes += n                             # 記録したバイト数
+    def rotate(self):                               # ファイルを切り替える
+        self.fp.close()                             # 書き出してファイルを閉じる
+        if self.size > 0:                           # 記録がある時
+            stamp = strftime('%Y%m%d-%H%M%S', localtime(self.clock()))
+            root, ext = os.path.splitext(self.path) # 拡張子を分離
+            os.replace(self.path, '%s.%s%s' % (root, stamp, ext))   # 日時付きで退避
+            old = sorted(glob.glob(glob.escape(root) + '.*-*' + ext))
+            for name in old[:max(len(old) - self.max_files, 0)]:
+                os.remove(name)                     # 古いものを削除
+            self.rotations += 1                     # 切り替えた回数を加算
+        self._open()                                # 新しいファイルを作成
+    def write(self, dev):                           # 1件を記録
+        t = round(self.clock(), 3)                  # 受信時刻
+        adv = merged_ad(dev).hex()                  # まとめたAD(16進数)
+        if self.fmt == 'csv':                       # CSV形式の時
+            line = '%.3f,%s,%s,%d,%d,%s\n' % (t, dev.addr, dev.addrType, dev.rssi,
+                                              bool(dev.connectable), adv)
+        else:                                       # JSON Lines形式の時
+            line = json.dumps(dict(zip(columns, (t, dev.addr, dev.addrType, dev.rssi,
+                              int(bool(dev.connectable)), adv))), separators=(',', ':')) + '\n'
+        self._write(line)                           # 1行を書き込む
+        self.lines += 1                             # 行数を加算
+        self.poll()                                 # 書き出しと切り替えの確認
+    def poll(self):                                 # 書き出しと切り替えの確認
+        now = monotonic()                           # 現在の時刻
+        if self.size >= self.max_bytes or now - self.opened >= self.rotate_interval:
+            self.rotate()                           # ファイルを切り替える
+        elif now - self.flushed >= self.flush_interval: # 書き出し間隔を過ぎた時
+            self.fp.flush()                         # バッファを書き出す
+            self.flushed = now                      # 書き出し時刻を更新
+    def stats(self):                                # 状態の取得
+        return {'lines': self.lines, 'bytes': self.bytes, 'rotations': self.rotations}
+    def close(self):                                # 終了時の処理
+        self.fp.close()                             # 書き出してファイルを閉じる
+
+class ChangeFilter:                                 # クラスChangeFilterの定義
+    def __init__(self, rssi_threshold=rssi_threshold, ttl=ttl, clock=monotonic):
+        self.rssi_threshold = rssi_threshold        # 記録するRSSIの変化(dB)
+        self.ttl = ttl                              # 同じ内容を省く時間(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.seen = OrderedDict()                   # アドレス→[AD,RSSI,時刻,平滑値]
+        self.passed = 0                             # 記録した数
+        self.suppressed = 0                         # 省いた数
+    def changed(self, dev, now=None):               # 記録するかどうか
+        if now is None:                             # 時刻が未指定の時
+            now = self.clock()                      # 現在の時刻を取得
+        seen = self.seen                            # アドレス→[AD,RSSI,時刻,平滑値]
+        while seen:                                 # アドレスがある間
+            addr, last = next(iter(seen.items()))   # 最も古いアドレス
+            if last[2] > now - self.ttl:            # 期限内の時
+                break                               # 削除を終了
+            del seen[addr]                          # 期限切れを削除
+        raw = merged_ad(dev)                        # まとめたAD
+        last = seen.get(dev.addr)                   # 前回記録した内容
+        if last is not None:                        # 記録済みの時
+            last[2] = now                           # 最終受信時刻を更新
+            last[3] += (dev.rssi - last[3]) * alpha # RSSIを平滑化
+            seen.move_to_end(dev.addr)              # 最も新しい位置へ移動
+            if last[0] == raw and abs(last[3] - last[1]) <= self.rssi_threshold:
+                self.suppressed += 1                # 省いた数を加算
+                return False                        # 記録しない
+            last[0], last[1] = raw, last[3]         # 記録する内容を更新
+        else:                                       # 新しいアドレスの時
+            seen[dev.addr] = [raw, dev.rssi, now, float(dev.rssi)]  # 記録した内容
+        self.passed += 1                            # 記録した数を加算
+        return True                                 # 記録する
+    def stats(self):                                # 状態の取得
+        return {'addresses': len(self.seen), 'passed': self.passed,
+                'suppressed': self.suppressed}
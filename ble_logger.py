@@ -15,46 +15,99 @@
 #   実行するときは sudoを付与してください
 #       sudo ./ble_logger_basic.py &
 #
+#   受信したアドバタイジングの記録と再生(ble_record.py)
+#       sudo ./ble_logger.py --record night.blerec
+#       ./ble_logger.py --replay night.blerec [--fast]
+#
+#   表示の代わりに JSON Lines / CSV 形式でファイルに記録(ble_logfile.py)
+#       sudo ./ble_logger.py --log ble.jsonl --changes
+#       sudo ./ble_logger.py --log ble.csv --changes 10
+#
+#   --log ファイル      拡張子 .csv はCSV形式、その他はJSON Lines形式
+#                       (1時間ごと、または4MBごとに日時付きで退避)
+#   --changes [dB]      ADの内容が変わった時か、RSSIが dB(既定6)を超えて
+#                       変化した時だけ記録・表示
+#
 #【参考文献】
 #   本プログラムを作成するにあたり下記を参考にしました
 #   https://ianharvey.github.io/bluepy-doc/scanner.html
 
 interval = 1.01                                     # 動作間隔(秒)
 
-from bluepy import btle                             # bluepyからbtleを組み込む
 from sys import argv                                # sysから引数取得を組み込む
-from time import sleep                              # timeからsleepを組み込む
+from time import time, monotonic                    # timeから時間関連を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
+from ble_supervisor import Supervisor               # スキャンの監視と復旧を組み込む
+from ble_record import Recorder, ReplayScanner      # 記録と再生を組み込む
+from ble_adcache import AdCache                     # ADの変換結果の保持を組み込む
+from ble_logfile import LogWriter, ChangeFilter     # ファイルへの記録を組み込む
+
+def found(dev):                                     # アドバタイジング受信時の処理
+    if changes and not changes.changed(dev):        # 変化していない時
+        return                                      # 何もしない
+    if log:                                         # ファイルに記録する時
+        log.write(dev)                              # 1行を記録
+        return                                      # 表示はしない
+    print('\nDevice',dev.addr, end='')              # MACアドレスを表示
+    print(' (' + dev.addrType + ')', end='')        # アドレス種別を表示
+    print(', RSSI=' + str(dev.rssi), end='')        # 受信強度RSSIを表示
+    if dev.connectable:                             # GATT接続が可能なデバイス
+        print(', Connectable', end='')              # 接続可能を表示
+    print('\n+----+--------------------------+----------------------------')
+    print('|type|              description | value')
+    for d in ads.scan_data(dev):                    # タプル型変数dに代入
+        print('|%4d|%25s' %(d[0],d[1]), end='')     # アドバタイズTypeとType名
+        print('\t|', d[2])                          # データ値を表示
+
+def option(name):                                   # オプションの値を取得
+    if name in argv[1:-1]:                          # 値のあるオプションの時
+        return argv[argv.index(name) + 1]           # 次の引数を応答
+    return None                                     # 無い時はNone
+
+def closeAll():                                     # 終了時の処理
+    print('\nAD cache', ads.stats())                # キャッシュのヒット率を表示
+    print('scanner', scanner.stats())               # 復旧の回数と停止時間を表示
+    if changes:                                     # 変化時のみの時
+        print('changes', changes.stats())           # 省いた数を表示
+    if log:                                         # ファイルに記録中の時
+        log.close()                                 # 書き出してファイルを閉じる
+        print('log', log.stats())                   # 記録した量を表示
+    if recorder:                                    # 記録中の時
+        recorder.close()                            # 記録を終了
 
 # 設定確認
-if getuser() != 'root':                             # 実行したユーザがroot以外
-    print('使用方法: sudo', argv[0], '[対象MACアドレス(省略可)]...')
+recorder = replay = log = changes = None            # 記録と再生(無しはNone)
+if option('--record'):                              # 記録する時
+    recorder = Recorder(option('--record'))         # 記録用ファイルを作成
+    found = recorder.wrap(found)                    # 記録してからfoundを実行
+if option('--replay'):                              # 再生する時
+    replay = ReplayScanner(option('--replay'), speed=0 if '--fast' in argv else 1)
+if option('--log'):                                 # ファイルに記録する時
+    log = LogWriter(option('--log'), clock=replay.clock if replay else time)
+if '--changes' in argv:                             # 変化時のみの時
+    db = option('--changes')                        # RSSIの閾値
+    changes = ChangeFilter(clock=replay.clock if replay else monotonic)
+    if db and db.isdigit():                         # 閾値の指定がある時
+        changes.rssi_threshold = int(db)            # 閾値を設定
+if replay is None and getuser() != 'root':          # 実行したユーザがroot以外
+    print('使用方法: sudo', argv[0], '[--record ファイル] [--log ファイル] [--changes [dB]]')
+    print('          ', argv[0], '--replay ファイル [--fast] [--log ファイル] [--changes [dB]]')
     exit()                                          # プログラムの終了
 
 # MAIN
-scanner = btle.Scanner()                            # インスタンスscannerを生成
+ads = AdCache()                                     # ADの変換結果を保持
+scanner = Supervisor(found, scanner=replay)         # 異常時は自動で復旧するscanner
 while True:                                         # 永久ループ
     try:
-        devices = scanner.scan(interval)            # BLEアドバタイジング取得
-    except Exception as e:                          # エラー発生時
-        print('ERROR',e)                            # エラー表示
-        print('Rebooting HCI, please wait...')      # HCI再起動中表示
-        subprocess.call(['hciconfig','hci0','down'])# HCIの切断
-        sleep(5)                                    # 5秒間待機
-        subprocess.call(['hciconfig','hci0','up'])  # HCIの再接続
-        sleep(interval)                             # 1秒間待機
-        continue                                    # 永久ループの先頭に戻る
-    for dev in devices:                             # 発見した各デバイスについて
-        print('\nDevice',dev.addr, end='')          # MACアドレスを表示
-        print(' (' + dev.addrType + ')', end='')    # アドレス種別を表示
-        print(', RSSI=' + str(dev.rssi), end='')    # 受信強度RSSIを表示
-        if dev.connectable:                         # GATT接続が可能なデバイス
-            print(', Connectable', end='')          # 接続可能を表示
-        print('\n+----+--------------------------+----------------------------')
-        print('|type|              description | value')
-        for d in dev.getScanData():                 # タプル型変数dに代入
-            print('|%4d|%25s' %(d[0],d[1]), end='') # アドバタイズTypeとType名
-            print('\t|', d[2])                      # データ値を表示
+        scanner.process(interval)                   # 受信ごとにfoundを実行
+        if log:                                     # ファイルに記録中の時
+            log.poll()                              # 書き出しと切り替えの確認
+    except EOFError:                                # 再生が終了した時
+        closeAll()                                  # 記録を終了
+        break                                       # 永久ループを抜ける
+    except KeyboardInterrupt:                       # キー入力による中断
+        closeAll()                                  # 記録を終了
+        raise                                       # 中断する
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Metrics ble_metrics.py
+# スキャンや送信の処理時間・件数を、軽量なカウンタとヒストグラムで集計し、
+# Prometheus のテキスト形式(/metrics)で出力します。
+#
+#   記録(inc, dec, observe)は値ごとのロックの中で加算と二分探索だけを行い
+#   ます。ble_multiscan.py ではアダプタごとのスレッドの Supervisor が同じ値
+#   (ble_scanner_recoveries_total など)を更新するため、加算が欠けないよう
+#   ロックを確保します(記録は受信ごとではないため、ロックの負荷は僅かです)。
+#   外部のライブラリ(prometheus_client)は不要です。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_metrics import Counter, Histogram, registry
+#   errors = Counter('ble_errors_total', 'Number of errors.')
+#   latency = Histogram('ble_post_seconds', 'Post latency.', ('sink',), (0.1, 1, 10))
+#   errors.inc()                                    # 1を加算
+#   latency.labels('ambient').observe(0.25)         # 値を記録
+#   print(registry.render())                        # Prometheusのテキスト形式
+#
+#【出力形式】
+#   # HELP ble_post_seconds Post latency.
+#   # TYPE ble_post_seconds histogram
+#   ble_post_seconds_bucket{sink="ambient",le="0.1"} 0
+#   ble_post_seconds_bucket{sink="ambient",le="1"} 1
+#   ...
+
+from bisect import bisect_left                      # 二分探索を組み込む
+import threading                                    # スレッド管理を組み込む
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'   # /metrics の形式
+
+def number(value):                                  # 値を文字列に変換
+    if value == float('inf'):                       # 無限大の時
+        return '+Inf'                               # Prometheusの表記
+    return '%d' % value if value == int(value) else repr(float(value))
+
+def label_text(names, values, extra=''):            # ラベルを文字列に変換
+    pairs = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+             for n, v in zip(names, values)]        # 名前="値" の列
+    if extra:                                       # 追加のラベルがある時
+        pairs.append(extra)                         # 末尾に追加
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry:                                     # 値の登録先
+    def __init__(self):                             # コンストラクタ作成
+        self.metrics = dict()                       # 名前→値
+    def register(self, metric):                     # 値を登録
+        if metric.name in self.metrics:             # 同じ名前がある時
+            raise ValueError('duplicate metric: ' + metric.name)
+        self.metrics[metric.name] = metric          # 登録順に保持
+    def render(self):                               # Prometheusのテキスト形式
+        lines = list()                              # 出力する行
+        for metric in self.metrics.values():        # 各値について
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for values, child in list(metric.children.items()):
+                lines += child.samples(metric.name, metric.labelnames, values)
+        return '\n'.join(lines) + '\n'              # 末尾は改行
+
+registry = Registry()                               # 既定の登録先
+
+class CounterValue:                                 # 増加だけする値
+    def __init__(self):                             # コンストラクタ作成
+        self.value = 0                              # 累計
+        self.lock = threading.Lock()                # 複数スレッドからの更新用
+    def inc(self, amount=1):                        # 加算
+        with self.lock:                             # 排他制御
+            self.value += amount                    # 累計に加算
+    def samples(self, name, names, values):         # 出力する行
+        return ['%s%s %s' % (name, label_text(names, values), number(self.value))]
+
+class GaugeValue(CounterValue):                     # 増減する値
+    def set(self, value):                           # 値を設定
+        self.value = value                          # 最新の値
+    def dec(self, amount=1):                        # 減算
+        with self.lock:                             # 排他制御
+            self.value -= amount                    # 値から減算
+
+class HistogramValue:                               # 分布(区間ごとの件数)
+    def __init__(self, bounds):                     # コンストラクタ作成
+        self.bounds = bounds                        # 区間の上限(昇順)
+        self.counts = [0] * (len(bounds) + 1)       # 区間ごとの件数(最後は+Inf)
+        self.sum = 0.0                              # 合計
+        self.lock = threading.Lock()                # 複数スレッドからの更新用
+    def observe(self, value):                       # 値を記録
+        i = bisect_left(self.bounds, value)         # 値以上の最初の区間
+        with self.lock:                             # 排他制御
+            self.counts[i] += 1                     # 区間の件数を加算
+            self.sum += value                       # 合計に加算
+    def samples(self, name, names, values):         # 出力する行
+        lines = list()                              # 出力する行
+        total = 0                                   # 累積の件数
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count                          # 上限以下の件数
+            lines.append('%s_bucket%s %d' % (name, label_text(names, values,
+                         'le="%s"' % number(bound)), total))
+        lines.append('%s_sum%s %s' % (name, label_text(names, values), number(self.sum)))
+        lines.append('%s_count%s %d' % (name, label_text(names, values), total))
+        return lines                                # 行の列を応答
+
+class Metric:                                       # 値(ラベルごとの子を持つ)
+    kind = 'untyped'                                # 値の種類
+    def __init__(self, name, help, labelnames=(), registry=registry):
+        self.name = name                            # 名前
+        self.help = help                            # 説明
+        self.labelnames = tuple(labelnames)         # ラベルの名前
+        self.children = dict()                      # ラベルの値→子
+        self.lock = threading.Lock()                # 子の作成用
+        if not self.labelnames:                     # ラベルが無い時
+            self.child = self.labels()              # 子は1つだけ
+        if registry is not None:                    # 登録先がある時
+            registry.register(self)                 # 登録
+    def labels(self, *values):                      # ラベルの値の子を取得
+        child = self.children.get(values)           # 作成済みの子
+        if child is None:                           # 初めての時
+            if len(values) != len(self.labelnames): # ラベルの数が違う時
+                raise ValueError('%s: labels %s' % (self.name, self.labelnames))
+            with self.lock:                         # 同時に作成しないよう排他
+                child = self.children.setdefault(values, self.make())
+        return child                                # 子を応答
+
+class Counter(Metric):                              # 累計
+    kind = 'counter'                                # 値の種類
+    def make(self):                                 # 子を作成
+        return CounterValue()                       # 累計
+    def inc(self, amount=1):                        # 加算(ラベルなし)
+        self.child.inc(amount)                      # 累計に加算
+    def get(self):                                  # 値を取得(ラベルなし)
+        return self.child.value                     # 累計を応答
+
+class Gauge(Counter):                               # 最新の値
+    kind = 'gauge'                                  # 値の種類
+    def make(self):                                 # 子を作成
+        return GaugeValue()                         # 最新の値
+    def set(self, value):                           # 値を設定(ラベルなし)
+        self.child.value = value                    # 最新の値
+
+class Histogram(Metric):                            # 分布
+    kind = 'histogram'                              # 値の種類
+    def __init__(self, name, help, labelnames=(), buckets=(0.01, 0.1, 1, 10),
+                 registry=registry):                # コンストラクタ作成
+        self.buckets = tuple(sorted(buckets))       # 区間の上限(昇順)
+        Metric.__init__(self, name, help, labelnames, registry)
+    def make(self):                                 # 子を作成
+        return HistogramValue(self.buckets)         # 分布
+    def observe(self, value):                       # 値を記録(ラベルなし)
+        self.child.observe(value)                   # 子に記録
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE MultiScan ble_multiscan.py
+# 複数のBLEアダプタ(hci0, hci1, ...)で同時にスキャンし、受信したアドバタイ
+# ジングを1つの時刻順の列にまとめます。
+#
+#   アダプタごとにスレッドを起動し、Supervisor(ble_supervisor.py)で異常から
+#   復旧しながらスキャンを続けます(bluepy は受信を bluepy-helper の別プロセス
+#   で行うため、スレッドでも並行に受信できます)。受信時刻を付けて待ち行列へ
+#   送り、process() を呼んだスレッドが delay 秒だけ遅らせて時刻順に並べ直して
+#   から、コールバック関数を呼び出します。
+#   別のアダプタが dedup 秒以内に受信した同じアドレス・同じ内容のアドバタイ
+#   ジングは重複として除きます(同じアダプタの繰り返しの受信は除きません)。
+#
+#   アダプタごとの受信数、重複数、受信したアドレス数、そのアダプタだけが受信
+#   したアドレス数を coverage_span 秒ごとに集計し、stats() で応答します。
+#   gain は全アダプタで受信したアドレス数と、最も多いアダプタ単独の数の比で、
+#   アダプタを増やした効果を表します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_multiscan import MultiScanner
+#   scanner = MultiScanner(found, ifaces=(0, 1))    # hci0とhci1で受信
+#   while True:
+#       scanner.process(interval)                   # 受信ごとにfoundを実行
+#   print(scanner.stats())                          # アダプタごとの受信状況
+#
+#   ble_pipeline.py では --hci オプションで指定します
+#       sudo ./ble_pipeline.py --hci 0,1 print http
+
+ifaces = (0, 1)                                     # 使用するアダプタ(hciN)
+slice_s = 0.1                                       # スレッドの1回の受信時間(秒)
+delay = 0.2                                         # 並べ直しの待ち時間(秒)
+dedup = 0.1                                         # 重複とみなす時間差(秒)
+coverage_span = 300                                 # 受信状況の集計周期(秒)
+
+from ble_supervisor import Supervisor               # スキャンの監視と復旧を組み込む
+from ble_record import ReplayEntry, merged_ad       # ScanEntry相当を組み込む
+from heapq import heappush, heappop                 # 優先度付きキューを組み込む
+from itertools import count                         # 連番を組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+import threading                                    # スレッド管理を組み込む
+import queue                                        # 待ち行列を組み込む
+
+def snapshot(dev):                                  # 受信内容の複製(bluepyは上書きするため)
+    data = getattr(dev, 'scanData', None)           # 広告とスキャン応答をまとめた内容
+    return ReplayEntry(dev.addr, dev.addrType, dev.rssi, dev.connectable,
+                       getattr(dev, 'rawData', None) or b'', dict(data) if data else None)
+
+class Adapter:                                      # アダプタごとの状態
+    def __init__(self, index, name):                # コンストラクタ作成
+        self.index = index                          # 番号(0から)
+        self.name = name                            # 名前(hci0など)
+        self.scanner = None                         # スキャン(Supervisor)
+        self.thread = None                          # 受信スレッド
+        self.events = 0                             # 受信数
+        self.duplicates = 0                         # 重複として除いた数
+        self.done = False                           # 受信を終了した
+    def stats(self, coverage):                      # 状態の取得
+        addresses, exclusive = coverage.get(self.index, (0, 0))
+        return {'events': self.events, 'duplicates': self.duplicates,
+                'addresses': addresses, 'exclusive': exclusive,
+                'scanner': self.scanner.stats()}
+
+class MultiScanner:                                 # クラスMultiScannerの定義
+    def __init__(self, callback, ifaces=ifaces, scanners=None, passive=False,
+                 slice_s=slice_s, delay=delay, dedup=dedup,
+                 coverage_span=coverage_span, clock=monotonic):
+        self.callback = callback                    # 受信時に呼び出す関数
+        self.slice = slice_s                        # スレッドの1回の受信時間
+        self.delay = delay                          # 並べ直しの待ち時間
+        self.dedup = dedup                          # 重複とみなす時間差
+        self.coverage_span = coverage_span          # 受信状況の集計周期
+        self.clock = clock                          # 時刻取得関数
+        self.queue = queue.SimpleQueue()            # 受信スレッドからの待ち行列
+        self.heap = list()                          # 並べ直し用(時刻,連番,番号,内容)
+        self.seq = count()                          # 同じ時刻の順序用の連番
+        self.last = dict()                          # アドレス→(時刻,番号,内容)
+        self.seen = dict()                          # アドレス→受信したアダプタ(ビット)
+        self.coverage = None                        # 前回の集計結果
+        self.span_start = clock()                   # 集計の開始時刻
+        self.events = 0                             # 重複を除いた累計受信数
+        self.time = None                            # 処理中の受信の受信時刻
+        self.running = True                         # 受信スレッドの動作中フラグ
+        if scanners is None:                        # 実機の時
+            self.adapters = [Adapter(i, 'hci%d' % n) for i, n in enumerate(ifaces)]
+        else:                                       # btle.Scanner相当の指定時
+            self.adapters = [Adapter(i, 'scanner%d' % i) for i in range(len(scanners))]
+        for a in self.adapters:                     # 各アダプタについて
+            if scanners is None:                    # 実機の時
+                a.scanner = Supervisor(self.receiver(a), iface=ifaces[a.index],
+                                       passive=passive)
+            else:                                   # btle.Scanner相当の指定時
+                a.scanner = Supervisor(self.receiver(a), scanner=scanners[a.index],
+                                       passive=passive)
+            a.thread = threading.Thread(target=self.run, args=(a,), daemon=True)
+            a.thread.start()                        # 受信スレッドを起動
+    def receiver(self, adapter):                    # 受信スレッド用のコールバック
+        put = self.queue.put                        # 待ち行列への追加
+        clock = self.clock                          # 時刻取得関数
+        seq = self.seq                              # 連番
+        index = adapter.index                       # アダプタの番号
+        def found(dev):                             # 受信時の処理(受信スレッド)
+            adapter.events += 1                     # 受信数を加算
+            put((clock(), next(seq), index, snapshot(dev)))
+        return found                                # 関数を応答
+    def run(self, adapter):                         # 受信スレッド
+        try:                                        # 例外処理の監視を開始
+            while self.running:                     # 動作中の間
+                adapter.scanner.process(self.slice) # 異常時は内部で復旧
+        except EOFError:                            # 再生が終了した時
+            pass                                    # 終了
+        finally:                                    # 終了時
+            adapter.done = True                     # 受信を終了
+            self.queue.put(None)                    # 終了を通知
+    def process(self, timeout):                     # 受信処理用メソッド
+        end = self.clock() + timeout                # 終了時刻
+        while True:                                 # 終了時刻まで
+            now = self.clock()                      # 現在の時刻
+            self.release(now - self.delay)          # 待ち時間を過ぎた分を処理
+            if now >= end:                          # 終了時刻の時
+                break                               # 繰り返しを終了
+            try:                                    # 例外処理の監視を開始
+                item = self.queue.get(timeout=end - now)    # 受信を待つ
+            except queue.Empty:                     # 受信が無かった時
+                continue                            # 終了時刻の確認へ
+            if item is not None:                    # 受信内容の時
+                heappush(self.heap, item)           # 時刻順に並べる
+        if all(a.done for a in self.adapters) and self.queue.empty():
+            self.release(float('inf'))              # 残りをすべて処理
+            raise EOFError('all adapters stopped')  # 受信の終了を通知
+        if now - self.span_start >= self.coverage_span: # 集計周期の時
+            self.rollover(now)                      # 受信状況を集計
+        return self.events                          # 累計受信数を応答
+    def release(self, limit):                       # limit時刻までの受信を処理
+        heap = self.heap                            # 並べ直し用
+        last = self.last                            # 前回の受信
+        seen = self.seen                            # 受信したアダプタ
+        while heap and heap[0][0] <= limit:         # 待ち時間を過ぎた受信
+            t, n, i, dev = heappop(heap)            # 最も古い受信
+            seen[dev.addr] = seen.get(dev.addr, 0) | 1 << i
+            prev = last.get(dev.addr)               # 同じアドレスの前回の受信
+            ad = merged_ad(dev)                     # 広告とスキャン応答をまとめたAD
+            if (prev is not None and prev[1] != i and t - prev[0] < self.dedup
+                    and prev[2] == ad):             # 別のアダプタと同じ内容
+                self.adapters[i].duplicates += 1    # 重複数を加算
+                continue                            # 重複は渡さない
+            last[dev.addr] = (t, i, ad)             # 受信を記録
+            self.events += 1                        # 累計受信数を加算
+            self.time = t                           # 受信時刻(コールバック用)
+            self.callback(dev)                      # コールバック関数を実行
+    def measure(self):                              # アダプタごとの受信状況
+        addresses = [0] * len(self.adapters)        # 受信したアドレス数
+        exclusive = [0] * len(self.adapters)        # 単独で受信したアドレス数
+        for mask in self.seen.values():             # 各アドレスについて
+            for a in self.adapters:                 # 各アダプタについて
+                if mask >> a.index & 1:             # 受信していた時
+                    addresses[a.index] += 1         # アドレス数を加算
+                    if mask == 1 << a.index:        # 単独で受信した時
+                        exclusive[a.index] += 1     # 単独の数を加算
+        coverage = {a.index: (addresses[a.index], exclusive[a.index]) for a in self.adapters}
+        coverage['union'] = len(self.seen)          # 全体のアドレス数
+        return coverage                             # 集計結果を応答
+    def rollover(self, now):                        # 受信状況の集計
+        self.coverage = self.measure()              # 集計結果を保持
+        self.seen = dict()                          # 次の集計周期へ
+        self.last = {k: v for k, v in self.last.items() if now - v[0] < self.dedup}
+        self.span_start = now                       # 集計の開始時刻
+    def stop(self):                                 # スキャン停止用メソッド
+        self.running = False                        # 受信スレッドを終了
+        for a in self.adapters:                     # 各アダプタについて
+            a.thread.join(self.slice * 10)          # 終了を待つ
+            a.scanner.stop()                        # スキャンを停止
+    def stats(self):                                # 状態の取得
+        coverage = self.coverage or self.measure()  # 前回(無い時は途中)の集計
+        best = max([v[0] for k, v in coverage.items() if k != 'union'] + [1])
+        return {'events': self.events, 'pending': len(self.heap),
+                'addresses': coverage['union'], 'gain': round(coverage['union'] / best, 3),
+                'adapters': {a.name: a.stats(coverage) for a in self.adapters}}
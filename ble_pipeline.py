@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Pipeline ble_pipeline.py
+# 1つのBLEスキャンの結果を、複数の出力先(HTTP、Ambient、LINE、UDP)へ
+# 同時に配信します。
+#
+#   スキャン(Supervisor) → RSSIフィルタ → 重複除去・集計(AddressWindow)
+#   → 出力先(Sink) の順に処理します。ex2～ex6 の各サンプルは、本モジュールに
+#   出力先を指定して起動するだけの前段(フロントエンド)です。
+#
+#   fingerprint = True の時は、アドレスの変更を追跡した補正後のデバイス数
+#   (ble_fingerprint.py)を corrected, corrected_300s などの名前で一緒に
+#   出力先へ渡します(アドレスを保持するため、近似カウントの時は行いません)。
+#   device_table = True の時は、アドレスごとの受信回数やRSSIを状態表
+#   (ble_devices.py)に記録し、HTTPサーバの /devices で参照できます。
+#   history = True の時は、出力先へ渡す値(counter, co2 など)の履歴を複数の
+#   解像度で保持し(ble_history.py)、HTTPサーバの /history で参照できます。
+#   ifaces に複数のアダプタ(hci0, hci1, ...)を指定すると、同時にスキャンし、
+#   時刻順に並べ直して重複を除いた受信を処理します(ble_multiscan.py)。
+#   metrics = True の時は、スキャンの処理時間と間隔、1回あたりの受信数と
+#   異なるアドレスの割合、センサの読み取り時間を計測し(ble_metrics.py)、
+#   HTTPサーバの /metrics に Prometheus の形式で出力します。
+#   集計(window)は時計の30秒ごと(毎分0秒と30秒)、値の更新とセンサの読み取り
+#   は interval 秒ごと、出力先の一括送信は flush_interval 秒ごとに、単調増加
+#   時刻の予定表(ble_scheduler.py)で実行し、残りの時間はスキャンします。
+#   予定からの遅れは /stats の scheduler と /metrics で確認できます。
+#   analytics = True の時(NumPy がある時)は、集計ごとにRSSIの分布(rssi_hist)
+#   と近さで重み付けした在室数の推定(occupancy)を計算し(ble_analytics.py)、
+#   counter と一緒に出力先へ渡します。アドレスごとの平滑化したRSSIは
+#   HTTPサーバの /analytics で参照できます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【インストール方法】
+#   bluepy (Bluetooth LE interface for Python)をインストールしてください
+#       sudo pip3 install bluepy
+#
+#【実行方法】
+#   出力先とセンサを引数で指定します(省略時は print と http)
+#       sudo ./ble_pipeline.py print http ambient line udp
+#       sudo ./ble_pipeline.py print chart udp temp sgp30
+#
+#   出力先: print, verbose, http, chart, ambient, line, udp, telemetry
+#   センサ: temp, sgp30
+#   各出力先の設定は ble_sinks.py (Ambientは ble_ambient.py)に記入してください。
+#
+#   受信したアドバタイジングの記録と再生(ble_record.py)
+#       sudo ./ble_pipeline.py --record night.blerec print http
+#       ./ble_pipeline.py --replay night.blerec print       # 記録時と同じ速さ
+#       ./ble_pipeline.py --replay night.blerec --fast print    # 最速で再生
+#
+#   複数のアダプタで同時にスキャン(ble_multiscan.py)
+#       sudo ./ble_pipeline.py --hci 0,1 print http
+
+interval = 1.01                                     # 動作間隔(秒)
+target_rssi = -80                                   # 最低受信強度
+count_mode = 'exact'                                # 計数方式(exact:厳密, hll:近似)
+spans = (30, 300, 3600)                             # 時間窓の長さ(秒)
+fingerprint = True                                  # アドレス変更の補正を行う
+device_table = True                                 # アドレスごとの状態を記録
+history = True                                      # 値の履歴を保持
+metrics = True                                      # 処理時間などを計測
+analytics = True                                    # RSSIの分析を行う(NumPyがある時)
+ifaces = (0,)                                       # 使用するアダプタ(hciN)
+temp_offset = 15                                    # 温度補正値
+names = ['print', 'http']                           # 既定の出力先
+
+from ble_supervisor import Supervisor               # スキャンの監視と復旧を組み込む
+from ble_multiscan import MultiScanner              # 複数アダプタの受信を組み込む
+from ble_dedup import AddressWindow                 # 時間窓付きアドレス表を組み込む
+from ble_hll import SketchWindow                    # 近似カウントを組み込む
+from ble_fingerprint import FingerprintIndex        # アドレス変更の補正を組み込む
+from ble_devices import DeviceTable                 # アドレスごとの状態表を組み込む
+from ble_history import History                     # 値の履歴を組み込む
+from ble_sinks import Sink, PrintSink, LineSink, UdpSink
+from ble_ambient import AmbientSink                 # Ambientの出力先を組み込む
+from ble_httpd import HttpSink                      # HTTP出力先を組み込む
+from ble_telemetry import TelemetrySink             # バイナリ形式のUDP送信を組み込む
+from ble_sensors import TempSensor, Sgp30, Sampler, baseline_file
+from ble_record import Recorder, ReplayScanner      # 記録と再生を組み込む
+from ble_scheduler import Scheduler                 # 予定表を組み込む
+from ble_analytics import Analytics, np as numpy    # RSSIの分析(NumPyが無い時はNone)
+from ble_metrics import Gauge, Histogram            # 計測値を組み込む
+from time import time, monotonic, perf_counter      # 時間取得を組み込む
+
+scan_seconds = Histogram('ble_scan_seconds', 'Duration of one scanner.process() call.',
+                         buckets=(0.1, 0.5, 0.9, 1.0, 1.02, 1.05, 1.1, 1.5, 2, 5))
+scan_gap = Histogram('ble_scan_gap_seconds', 'Time between scanner.process() calls.',
+                     buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+adverts_per_scan = Histogram('ble_adverts_per_scan', 'Advertisements received per scan call.',
+                             buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000))
+distinct_ratio = Gauge('ble_distinct_ratio',
+                       'Distinct addresses / advertisements in the last scan call.')
+sensor_seconds = Histogram('ble_sensor_read_seconds', 'Duration of one sensor read.',
+                           ('sensor',), (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1))
+
+class Pipeline:                                     # クラスPipelineの定義
+    def __init__(self, sinks, target_rssi=target_rssi, interval=interval,
+                 count_mode=count_mode, spans=spans, sensors=(), scanner=None,
+                 recorder=None, clock=None, fingerprint=fingerprint,
+                 device_table=device_table, history=history, metrics=metrics,
+                 ifaces=ifaces, analytics=analytics):
+        self.sinks = list(sinks)                    # 出力先のリスト
+        self.sensors = list(sensors)                # センサのリスト
+        self.target_rssi = target_rssi              # 最低受信強度
+        self.interval = interval                    # 動作間隔(秒)
+        self.clock = clock or time                  # 集計用の時刻取得関数
+        window = {'clock': clock} if clock else {}  # 再生時は再生中の時刻
+        if count_mode == 'hll':                     # 近似カウントの時
+            self.MAC = SketchWindow(spans, **window)    # 固定メモリの時間窓
+        else:                                       # 厳密カウントの時
+            self.MAC = AddressWindow(spans, **window)   # アドレス保存用の時間窓
+        if fingerprint and count_mode != 'hll':     # 補正を行う時(厳密カウント)
+            self.FP = FingerprintIndex(spans, **window) # アドレス変更の補正
+        else:                                       # 補正を行わない時
+            self.FP = None                          # 補正なし
+        self.table = DeviceTable(**window) if device_table else None
+        self.history = History(**window) if history else None
+        self.metrics = metrics                      # 処理時間などを計測する
+        self.analytics = Analytics(target_rssi) if analytics and numpy is not None else None
+        self.scan_addrs = set()                     # 1回のスキャンのアドレス
+        self.scan_events = 0                        # 前回までの累計受信数
+        self.scan_end = None                        # 前回のスキャンの終了時刻
+        self.values = {'counter': 0}                # 最新の値
+        self.readings = dict()                      # センサ値
+        self.scheduler = Scheduler(clock or monotonic, self.clock, metrics)   # 予定表
+        self.listeners = [s.found for s in self.sinks if type(s).found is not Sink.found]
+        self.recorder = recorder                    # 受信の記録(無しはNone)
+        callback = recorder.wrap(self.found) if recorder else self.found
+        if scanner is None and len(ifaces) > 1:     # 複数のアダプタの時
+            self.scanner = MultiScanner(callback, ifaces)   # 並べ直して重複を除く
+        else:                                       # 1つのアダプタ(または再生)の時
+            self.scanner = Supervisor(callback, ifaces[0], scanner)  # 異常時は自動で復旧
+    def found(self, dev):                           # アドバタイジング受信時の処理
+        if self.metrics:                            # 計測する時
+            self.scan_addrs.add(dev.addr)           # 異なるアドレスの数え上げ
+        if self.table is not None:                  # 状態表がある時
+            self.table.update(dev)                  # 閾値未満も含めて記録
+        if self.analytics is not None:              # RSSIの分析を行う時
+            self.analytics.add(dev.addr, dev.rssi)  # 閾値未満も含めて記録
+        if self.FP is not None:                     # 補正を行う時
+            self.FP.add(dev, count=(dev.rssi >= self.target_rssi))  # 途絶えの判断用
+        if dev.rssi < self.target_rssi:             # 受信強度が閾値より小さい時
+            return                                  # 処理を終了
+        new = self.MAC.add(dev.addr)                # アドレスと受信時刻を記録
+        for listener in self.listeners:             # 受信を待つ各出力先について
+            listener(dev, new)                      # 受信を通知
+    def scan(self, timeout):                        # timeout秒間のスキャン
+        start = perf_counter()                      # スキャンの開始時刻
+        events = self.scanner.process(timeout)      # 受信ごとにfoundを実行
+        if self.metrics:                            # 計測する時
+            self.observe(start, perf_counter(), events) # スキャンを計測
+        return events                               # 累計受信数を応答
+    def poll(self, sensor):                         # センサの読み取り
+        start = perf_counter()                      # 読み取りの開始時刻
+        self.readings.update(sensor.read())         # センサ値を取得
+        if self.metrics:                            # 計測する時
+            name = type(getattr(sensor, 'sensor', sensor)).__name__ # Samplerはセンサ名
+            sensor_seconds.labels(name).observe(perf_counter() - start)
+    def update(self):                               # 動作間隔ごとの処理
+        values = dict(self.values)                  # 前回の値を複製
+        counts = self.MAC.counts()                  # 時間窓ごとのデバイス数
+        values['counter'] = counts[self.MAC.spans[0]]   # 最短の窓のデバイス数
+        for span, n in counts.items():              # 各時間窓について
+            values['counter_%ds' % span] = n        # デバイス数を保持
+        if self.FP is not None:                     # 補正を行う時
+            counts = self.FP.counts()               # 補正後のデバイス数
+            values['corrected'] = counts[self.MAC.spans[0]] # 最短の窓の補正後
+            for span, n in counts.items():          # 各時間窓について
+                values['corrected_%ds' % span] = n  # 補正後のデバイス数を保持
+        values.update(self.readings)                # センサ値を追加
+        self.values = values                        # 最新の値を更新
+        if self.history is not None:                # 履歴を保持する時
+            self.history.add(values)                # 値を記録
+        for sink in self.sinks:                     # 各出力先について
+            sink.update(values)                     # 最新の値を通知
+        return values                               # 最新の値を応答
+    def window(self):                               # 集計時の処理
+        if self.analytics is not None:              # RSSIの分析を行う時
+            self.values = dict(self.values, **self.analytics.window(self.clock()))
+        for sink in self.sinks:                     # 各出力先について
+            sink.window(self.values)                # 集計結果を通知
+    def tick(self):                                 # 1回のスキャンと更新(予定表なし)
+        self.scan(self.interval)                    # 動作間隔だけスキャン
+        for sensor in self.sensors:                 # 各センサについて
+            self.poll(sensor)                       # センサ値を取得
+        return self.update()                        # 値を更新
+    def observe(self, start, end, events):          # 1回のスキャンを計測
+        scan_seconds.observe(end - start)           # スキャンの処理時間
+        if self.scan_end is not None:               # 前回のスキャンがある時
+            scan_gap.observe(start - self.scan_end) # スキャンしていない時間
+        self.scan_end = end                         # 終了時刻を保持
+        n = events - self.scan_events               # 今回の受信数
+        self.scan_events = events                   # 累計受信数を保持
+        adverts_per_scan.observe(n)                 # 受信数を記録
+        distinct_ratio.set(round(len(self.scan_addrs) / n, 4) if n else 0)
+        self.scan_addrs.clear()                     # 次のスキャンへ
+    def stats(self):                                # 各出力先の状態を取得
+        stats = dict()                              # 出力先ごとの状態
+        for i, sink in enumerate(self.sinks):       # 各出力先について
+            s = sink.stats()                        # 出力先の状態
+            if s:                                   # 状態がある時
+                stats['%d_%s' % (i, type(sink).__name__)] = s
+        if self.FP is not None:                     # 補正を行う時
+            stats['fingerprint'] = self.FP.stats()  # 補正の状態
+        if self.table is not None:                  # 状態表がある時
+            stats['devices'] = self.table.stats()   # 状態表の大きさ
+        if self.history is not None:                # 履歴を保持する時
+            stats['history'] = self.history.stats() # 履歴の項目と大きさ
+        if self.analytics is not None:              # RSSIの分析を行う時
+            stats['analytics'] = self.analytics.stats() # 分析した受信数
+        stats['scanner'] = self.scanner.stats()     # 復旧の回数と停止時間
+        stats['scheduler'] = self.scheduler.stats() # タスクごとの予定からの遅れ
+        for i, sensor in enumerate(self.sensors):   # 各センサについて
+            if hasattr(sensor, 'stats'):            # 状態がある時
+                stats['sensor_%d' % i] = sensor.stats() # 読み取り数や遅れ
+        return stats                                # 状態を応答
+    def run(self):                                  # 永久ループ
+        for sink in self.sinks:                     # 各出力先について
+            sink.start(self)                        # 出力先を開始
+        scheduler = self.scheduler                  # 予定表
+        for i, sensor in enumerate(self.sensors):   # 各センサについて(更新の前に実行)
+            scheduler.every('sensor_%d_%s' % (i, type(getattr(sensor, 'sensor', sensor)).__name__),
+                            self.interval, lambda sensor=sensor: self.poll(sensor))
+        scheduler.every('update', self.interval, self.update)  # 値の更新
+        scheduler.every('window', self.MAC.spans[0], self.window, align=True)  # 時計に揃えた集計
+        for i, sink in enumerate(self.sinks):       # 各出力先について
+            if sink.flush_interval:                 # 一括送信を行う時
+                scheduler.every('flush_%d_%s' % (i, type(sink).__name__),
+                                sink.flush_interval, sink.flush, delay=sink.flush_interval)
+        try:                                        # 例外処理の監視を開始
+            scheduler.run(idle=self.scan)           # 予定の間はスキャン
+        except EOFError:                            # 再生が終了した時
+            pass                                    # 終了処理へ
+        finally:                                    # 終了時
+            self.scanner.stop()                     # スキャンを停止
+            for sensor in self.sensors:             # 各センサについて
+                if hasattr(sensor, 'stop'):         # 読み取りスレッドの時
+                    sensor.stop()                   # 読み取りを停止
+            if self.recorder:                       # 記録中の時
+                self.recorder.close()               # 記録を終了
+            for sink in self.sinks:                 # 各出力先について
+                sink.close()                        # 出力先を終了
+
+def make_sink(name):                                # 名前から出力先を生成
+    if name in ('print', 'verbose'):                # 表示の時
+        return PrintSink(verbose=(name == 'verbose'))
+    if name == 'http':                              # HTTPサーバ(テキスト)の時
+        return HttpSink()                           # HTTP出力先を生成
+    if name == 'chart':                             # HTTPサーバ(棒グラフ)の時
+        return HttpSink(chart=[('Temperature', 'temp', 40), ('Counter', 'counter', 10),
+                               ('CO2', 'co2', 2000), ('TVOC', 'tvoc', 5000)])
+    if name == 'ambient':                           # Ambientの時
+        return AmbientSink()                        # Ambient出力先を生成
+    if name == 'line':                              # LINEの時
+        return LineSink()                           # LINE出力先を生成
+    if name == 'udp':                               # UDPの時
+        return UdpSink()                            # UDP出力先を生成
+    if name == 'telemetry':                         # バイナリ形式のUDPの時
+        return TelemetrySink()                      # マルチキャストで送信
+    raise ValueError('unknown sink: ' + name)       # 不明な出力先
+
+def make_sensor(name):                              # 名前からセンサを生成
+    if name == 'temp':                              # 温度センサの時
+        return TempSensor(temp_offset)              # 温度センサの実体化
+    if name == 'sgp30':                             # CO2センサの時
+        return Sampler(Sgp30(baseline=baseline_file))   # 1秒周期、ベースラインを保存
+    raise ValueError('unknown sensor: ' + name)     # 不明なセンサ
+
+if __name__ == '__main__':                          # 直接実行された時
+    from sys import argv                            # sysから引数取得を組み込む
+    from getpass import getuser                     # ユーザ取得を組み込む
+    args = argv[1:]                                 # 引数の列
+    recorder = scanner = None                       # 記録と再生(無しはNone)
+    if '--hci' in args:                             # アダプタの指定がある時
+        i = args.index('--hci')                     # オプションの位置
+        ifaces = tuple(int(n) for n in args.pop(i + 1).split(','))
+        args.pop(i)                                 # オプションを削除
+    if '--record' in args:                          # 記録する時
+        i = args.index('--record')                  # オプションの位置
+        recorder = Recorder(args.pop(i + 1))        # 記録用ファイルを作成
+        args.pop(i)                                 # オプションを削除
+    if '--replay' in args:                          # 再生する時
+        i = args.index('--replay')                  # オプションの位置
+        speed = 0 if '--fast' in args else 1        # 最速か記録時の速さか
+        scanner = ReplayScanner(args.pop(i + 1), speed=speed)
+        args.pop(i)                                 # オプションを削除
+        if '--fast' in args:                        # 最速の時
+            args.remove('--fast')                   # オプションを削除
+    if scanner is None and getuser() != 'root':     # 実行したユーザがroot以外
+        print('使用方法: sudo', argv[0], '[--record ファイル] [--hci 0,1] [出力先・センサ]...')
+        print('          ', argv[0], '--replay ファイル [--fast] [出力先・センサ]...')
+        exit()                                      # プログラムの終了
+    if args:                                        # 引数がある時
+        names = args                                # 出力先とセンサを設定
+    sinks = list()                                  # 出力先のリスト
+    sensors = list()                                # センサのリスト
+    try:                                            # 例外処理の監視を開始
+        for name in names:                          # 各名前について
+            if name in ('temp', 'sgp30'):           # センサの時
+                sensors.append(make_sensor(name))   # センサを追加
+            else:                                   # 出力先の時
+                sinks.append(make_sink(name))       # 出力先を追加
+    except Exception as e:                          # 例外処理発生時
+        print(e)                                    # エラー内容の表示
+        exit()                                      # プログラムの終了
+    clock = scanner.clock if scanner else None      # 再生時は再生中の時刻
+    Pipeline(sinks, sensors=sensors, scanner=scanner, recorder=recorder,
+             clock=clock, ifaces=ifaces).run()      # パイプラインを実行
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Record ble_record.py
+# 受信したアドバタイジングをバイナリ形式で記録し、後から再生します。
+#
+#   Recorder は StreamScanner のコールバックを包み、受信ごとに1件を追記します。
+#   ReplayScanner は btle.Scanner と同じメソッドを持ち、記録したファイルを
+#   StreamScanner(scanner=...) へ渡すと、実機と同じ処理で再生できます。
+#   speed=1 で記録時と同じ速さ、speed=0 で待ち時間なし(最速)で再生します。
+#   再生中の時刻は clock() で取得します(記録開始時の時刻+経過時間)。
+#   ファイル名の代わりに、ble_synth.py で合成した列も再生できます。
+#
+#   ファイル形式(リトルエンディアン)
+#       ヘッダ 16バイト  'BLEREC' 版数(1) 予約(0) 記録開始時刻(double, 秒)
+#       1件    13バイト  経過時間(uint32, ミリ秒) フラグ(uint8)
+#                        アドレス(6バイト) RSSI(int8) ADの長さ(uint8)
+#              + ADの長さ分の生データ(アドバタイジングとスキャン応答をまとめたAD)
+#       フラグ bit0: addrType が random, bit1: connectable
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_record import Recorder, ReplayScanner
+#   recorder = Recorder('night.blerec')             # 記録用ファイルを作成
+#   scanner = StreamScanner(recorder.wrap(found))   # 記録してからfoundを実行
+#       (終了時)
+#   recorder.close()                                # ファイルを閉じる
+#
+#   replay = ReplayScanner('night.blerec', speed=0) # 最速で再生
+#   scanner = StreamScanner(found, scanner=replay)  # 実機の代わりに再生
+#   scanner.process(interval)                       # 終了時はEOFError
+
+from time import time, monotonic, sleep             # 時間取得を組み込む
+import struct                                       # バイナリ変換を組み込む
+
+magic = b'BLEREC'                                   # ファイルの識別子
+version = 1                                         # ファイル形式の版数
+header = struct.Struct('<6sBBd')                    # ヘッダの形式
+entry = struct.Struct('<IB6sbB')                    # 1件の形式
+
+ad_types = {1: 'Flags', 2: 'Incomplete 16b Services', 3: 'Complete 16b Services',
+            4: 'Incomplete 32b Services', 5: 'Complete 32b Services',
+            6: 'Incomplete 128b Services', 7: 'Complete 128b Services',
+            8: 'Short Local Name', 9: 'Complete Local Name', 10: 'Tx Power',
+            22: '16b Service Data', 32: '32b Service Data', 33: '128b Service Data',
+            255: 'Manufacturer'}                    # ADタイプの名前
+
+def uuid_text(data):                                # UUIDを文字列に変換
+    if len(data) <= 4:                              # 16/32ビットUUIDの時
+        return '%08x-0000-1000-8000-00805f9b34fb' % int.from_bytes(data, 'little')
+    h = data[::-1].hex()                            # 128ビットUUID
+    return '-'.join((h[:8], h[8:12], h[12:16], h[16:20], h[20:]))
+
+def parse_ad(raw):                                  # ADを(タイプ,名前,値)の列に変換
+    scan_data = list()                              # 変換結果
+    i = 0                                           # 読み出し位置
+    while i + 1 < len(raw):                         # ADが残っている間
+        n = raw[i]                                  # ADの長さ(タイプを含む)
+        if n == 0 or i + 1 + n > len(raw):          # 終端または途中の時
+            break                                   # 変換を終了
+        tag, data = raw[i + 1], raw[i + 2:i + 1 + n]    # タイプとデータ
+        if tag in (2, 3, 4, 5):                     # 16/32ビットUUIDの列
+            size = 2 if tag in (2, 3) else 4        # UUIDの長さ
+            value = ','.join(uuid_text(data[j:j + size]) for j in range(0, len(data), size))
+        elif tag in (6, 7):                         # 128ビットUUIDの列
+            value = ','.join(uuid_text(data[j:j + 16]) for j in range(0, len(data), 16))
+        elif tag in (8, 9):                         # デバイス名
+            value = data.decode('utf-8', 'replace') # 文字列に変換
+        else:                                       # その他
+            value = data.hex()                      # 16進数に変換
+        scan_data.append((tag, ad_types.get(tag, '0x%02X' % tag), value))
+        i += 1 + n                                  # 次のADへ
+    return scan_data                                # 変換結果を応答
+
+def merged_ad(dev):                                 # 広告とスキャン応答をまとめたAD
+    data = getattr(dev, 'scanData', None)           # タイプ→データ(bluepy)
+    if not data:                                    # 無い時(記録の再生など)
+        return bytes(dev.rawData or b'')            # 生データをそのまま使用
+    return b''.join(bytes((len(v) + 1, tag)) + v for tag, v in sorted(data.items()))
+
+class ReplayEntry:                                  # ScanEntry相当のクラス
+    def __init__(self, addr, addrType, rssi, connectable, rawData, scanData=None):
+        self.addr = addr                            # アドレス
+        self.addrType = addrType                    # アドレス種別
+        self.rssi = rssi                            # 受信強度
+        self.connectable = connectable              # 接続可否
+        self.rawData = rawData                      # ADの生データ(最後の1パケット)
+        self.scanData = scanData                    # タイプ→データ(まとめたAD、無しはNone)
+    def getScanData(self):                          # ADの一覧を取得
+        return parse_ad(self.rawData)               # (タイプ,名前,値)の列
+
+def read_records(path):                             # 記録の読み出し
+    with open(path, 'rb') as fp:                    # ファイルを開く
+        head = fp.read(header.size)                 # ヘッダを読み出す
+        if len(head) < header.size:                 # ヘッダが無い時
+            raise ValueError('not a BLE record file: ' + path)
+        (m, v, reserved, start) = header.unpack(head)   # ヘッダを分解
+        if m != magic or v != version:              # 識別子か版数が違う時
+            raise ValueError('not a BLE record file: ' + path)
+        yield start                                 # 最初に記録開始時刻を応答
+        while True:                                 # 終端まで
+            data = fp.read(entry.size)              # 1件を読み出す
+            if len(data) < entry.size:              # 終端(途中まで)の時
+                return                              # 読み出しを終了
+            (ms, flags, addr, rssi, n) = entry.unpack(data)
+            raw = fp.read(n)                        # ADの生データ
+            if len(raw) < n:                        # 途中で終わっている時
+                return                              # 読み出しを終了
+            dev = ReplayEntry(':'.join('%02x' % b for b in addr),
+                              'random' if flags & 1 else 'public',
+                              rssi, bool(flags & 2), raw)
+            yield (ms / 1000, dev)                  # (経過時間, デバイス)
+
+class Recorder:                                     # クラスRecorderの定義
+    def __init__(self, path, clock=monotonic):      # コンストラクタ作成
+        self.fp = open(path, 'wb')                  # 記録用ファイルを作成
+        self.fp.write(header.pack(magic, version, 0, time()))   # ヘッダを書き込む
+        self.clock = clock                          # 時刻取得関数
+        self.start = clock()                        # 記録開始時刻
+        self.count = 0                              # 記録した件数
+    def write(self, dev):                           # 1件を記録
+        ms = int((self.clock() - self.start) * 1000)    # 経過時間(ミリ秒)
+        flags = (dev.addrType == 'random') | (bool(dev.connectable) << 1)
+        raw = merged_ad(dev)[:255]                  # まとめたAD(rawDataは最後の1パケット)
+        rssi = max(-128, min(127, dev.rssi))        # int8の範囲に制限
+        self.fp.write(entry.pack(ms, flags, bytes.fromhex(dev.addr.replace(':', '')),
+                                 rssi, len(raw)) + raw)
+        self.count += 1                             # 件数を加算
+    def wrap(self, callback):                       # コールバック関数を包む
+        def found(dev):                             # 受信時の処理
+            self.write(dev)                         # 記録してから
+            callback(dev)                           # 元の関数を実行
+        return found                                # 包んだ関数を応答
+    def close(self):                                # 終了時の処理
+        self.fp.close()                             # ファイルを閉じる
+
+class ReplayScanner:                                # btle.Scanner相当のクラス
+    def __init__(self, source, speed=1.0):          # コンストラクタ作成
+        if isinstance(source, str):                 # ファイル名の時
+            self.records = read_records(source)     # 記録の読み出し
+        else:                                       # 合成した列(ble_synth.py)
+            self.records = iter(source)             # 開始時刻, (経過時間, デバイス)...
+        self.origin = next(self.records)            # 記録開始時刻
+        self.speed = speed                          # 再生速度(0は最速)
+        self.offset = 0.0                           # 再生済みの経過時間
+        self.pending = next(self.records, None)     # 次に再生する1件
+        self.delegate = None                        # デリゲート
+        self.scanned = dict()                       # 受信済みデバイス
+        self.events = 0                             # 再生した件数
+    def clock(self):                                # 再生中の時刻
+        return self.origin + self.offset            # 記録時の時刻を応答
+    def withDelegate(self, delegate):               # デリゲートの登録
+        self.delegate = delegate                    # デリゲートを保持
+        return self                                 # 自身を応答
+    def clear(self):                                # 受信済みデバイスの消去
+        self.scanned = dict()                       # 辞書を空にする
+    def start(self, passive=False):                 # スキャン開始
+        pass                                        # 再生では処理なし
+    def stop(self):                                 # スキャン停止
+        pass                                        # 再生では処理なし
+    def process(self, timeout):                     # timeout秒間の受信処理
+        if self.pending is None:                    # 最後まで再生した時
+            raise EOFError('end of replay')         # 再生の終了を通知
+        end = self.offset + timeout                 # この回の終了時刻
+        base = monotonic() - self.offset / self.speed if self.speed else None
+        while self.pending is not None and self.pending[0] < end:
+            (t, dev) = self.pending                 # 次の1件
+            if base is not None:                    # 速さを合わせる時
+                wait = base + t / self.speed - monotonic()
+                if wait > 0:                        # 再生時刻の前の時
+                    sleep(wait)                     # 再生時刻まで待つ
+            self.offset = t                         # 再生時刻を進める
+            self.scanned[dev.addr] = dev            # 受信済みに追加
+            self.events += 1                        # 再生数を加算
+            if self.delegate is not None:           # デリゲート登録時
+                self.delegate.handleDiscovery(dev, True, True)
+            self.pending = next(self.records, None) # 次の1件を読み出す
+        if base is not None:                        # 速さを合わせる時
+            wait = base + end / self.speed - monotonic()
+            if wait > 0:                            # 終了時刻の前の時
+                sleep(wait)                         # 終了時刻まで待つ
+        self.offset = end                           # 終了時刻まで進める
+        return True                                 # 受信処理の完了
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Scheduler ble_scheduler.py
+# スキャン、集計(時間窓)、センサの読み取り、出力先の一括送信を、1つの
+# 単調増加時刻(time.monotonic)の予定表で動かします。
+#
+#   各処理(タスク)は 開始時刻 + n × 周期 の予定時刻に実行するため、処理
+#   時間があっても周期はずれません。align=True のタスク(集計)は、予定時刻
+#   を時計(UNIX時刻)の周期の倍数(30秒なら毎分0秒と30秒)に合わせるため、
+#   複数のノードで集計の区切りが揃います。予定は単調増加時刻で進めるので、
+#   NTPで時計が飛んでも集計は飛ばず、realign 秒以上ずれた時だけ次の予定を
+#   時計に合わせ直します。
+#   次の予定時刻までの待ち時間は idle(待ち時間) で使います(ble_pipeline.py
+#   ではスキャン)。予定時刻から実行までの遅れ(lateness)をタスクごとに記録し、
+#   1周期以上遅れた分は実行せずに飛ばして数えます。遅れが大きい時や飛ばした
+#   数が増える時は、CPUの処理が追いついていません(stats() と /metrics)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_scheduler import Scheduler
+#   scheduler = Scheduler()
+#   scheduler.every('update', 1.0, update)          # 1秒ごと
+#   scheduler.every('window', 30, window, align=True)   # 毎分0秒と30秒
+#   scheduler.run(idle=scanner.process)             # 待ち時間はスキャン
+#   print(scheduler.stats())                        # タスクごとの遅れ
+#
+#【実行方法】
+#   仮想の時計で、時計の飛び(NTP)と処理の遅れを与えた動作を確認します
+#       ./ble_scheduler.py
+
+realign = 1.0                                       # 時計に合わせ直すずれ(秒)
+
+from time import time, monotonic, sleep, perf_counter   # 時間関連を組み込む
+from ble_metrics import Counter, Histogram          # 計測値を組み込む
+
+task_lateness = Histogram('ble_task_lateness_seconds',
+                          'Delay between the scheduled and the actual start of a task.',
+                          ('task',), (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+task_seconds = Histogram('ble_task_seconds', 'Duration of one task run.',
+                         ('task',), (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+task_skipped = Counter('ble_task_skipped_total', 'Task runs skipped by falling behind.',
+                       ('task',))
+
+class Task:                                         # 周期的に実行する処理
+    def __init__(self, name, period, func, due, align=False):
+        self.name = name                            # タスク名
+        self.period = period                        # 周期(秒)
+        self.func = func                            # 実行する関数
+        self.due = due                              # 次の予定時刻(単調増加時刻)
+        self.align = align                          # 時計の周期の倍数に合わせる
+        self.runs = 0                               # 実行した数
+        self.skipped = 0                            # 遅れて飛ばした数
+        self.realigned = 0                          # 時計に合わせ直した数
+        self.late_max = 0.0                         # 遅れの最大値(秒)
+        self.late_sum = 0.0                         # 遅れの合計(平均の計算用)
+        self.busy = 0.0                             # 実行に要した時間の合計(秒)
+        self.lateness = task_lateness.labels(name)  # 遅れの分布(/metrics)
+        self.seconds = task_seconds.labels(name)    # 実行時間の分布(/metrics)
+        self.skips = task_skipped.labels(name)      # 飛ばした数(/metrics)
+    def stats(self):                                # 状態の取得
+        return {'period': self.period, 'runs': self.runs, 'skipped': self.skipped,
+                'realigned': self.realigned, 'late_max': round(self.late_max, 4),
+                'late_mean': round(self.late_sum / max(self.runs, 1), 4),
+                'busy': round(self.busy / max(self.runs, 1), 4)}
+
+class Scheduler:                                    # クラスSchedulerの定義
+    def __init__(self, clock=monotonic, wall=time, metrics=True):
+        self.clock = clock                          # 単調増加時刻の取得関数
+        self.wall = wall                            # 時計(UNIX時刻)の取得関数
+        self.metrics = metrics                      # 遅れを/metricsへ記録する
+        self.tasks = list()                         # タスクのリスト
+    def aligned(self, period):                      # 時計の次の周期の倍数(単調時刻)
+        return self.clock() + period - self.wall() % period
+    def every(self, name, period, func, align=False, delay=0.0):
+        due = self.aligned(period) if align else self.clock() + delay
+        task = Task(name, period, func, due, align) # タスクを生成
+        self.tasks.append(task)                     # タスクを追加
+        return task                                 # タスクを応答
+    def next_due(self):                             # 最も早い予定時刻
+        return min(task.due for task in self.tasks)
+    def run_pending(self):                          # 予定時刻を過ぎたタスクを実行
+        for task in sorted(self.tasks, key=lambda t: t.due):
+            if task.due <= self.clock():            # 予定時刻を過ぎた時
+                self.run_task(task)                 # タスクを実行
+    def run_task(self, task):                       # 1つのタスクを実行
+        now = self.clock()                          # 実行の開始時刻
+        late = now - task.due                       # 予定時刻からの遅れ
+        task.late_max = max(task.late_max, late)    # 遅れの最大値
+        task.late_sum += late                       # 遅れの合計
+        task.runs += 1                              # 実行数を加算
+        start = perf_counter()                      # 実行時間の計測開始
+        try:                                        # 例外処理の監視を開始
+            task.func()                             # タスクを実行
+        finally:                                    # 終了・再生の終了時も
+            busy = perf_counter() - start           # 実行に要した時間
+            task.busy += busy                       # 実行時間の合計
+            if self.metrics:                        # 計測する時
+                task.lateness.observe(late)         # 遅れを記録
+                task.seconds.observe(busy)          # 実行時間を記録
+            self.advance(task)                      # 次の予定時刻へ
+    def advance(self, task):                        # 次の予定時刻を計算
+        task.due += task.period                     # 開始時刻 + n × 周期
+        behind = self.clock() - task.due            # 次の予定時刻からの遅れ
+        if behind >= task.period:                   # 1周期以上遅れた時
+            missed = int(behind // task.period)     # 間に合わない周期の数
+            task.due += missed * task.period        # 周期の位相は保つ
+            task.skipped += missed                  # 飛ばした数を加算
+            if self.metrics:                        # 計測する時
+                task.skips.inc(missed)              # 飛ばした数を記録
+        if task.align:                              # 時計に合わせる時
+            at = self.wall() + task.due - self.clock()  # 予定時刻の時計の時刻
+            error = (at + task.period / 2) % task.period - task.period / 2
+            if abs(error) >= realign:               # 時計が飛んだ時
+                task.due -= error                   # 周期の倍数に合わせ直す
+                task.realigned += 1                 # 合わせ直した数を加算
+    def run(self, idle=None, until=None):           # 予定表に沿って実行
+        idle = idle or sleep                        # 待ち時間の処理(既定は待機)
+        while until is None or self.clock() < until:
+            wait = self.next_due() - self.clock()   # 次の予定時刻までの時間
+            if wait > 0:                            # 予定時刻の前の時
+                idle(wait)                          # 待ち時間の処理(スキャン等)
+            self.run_pending()                      # 予定時刻のタスクを実行
+    def stats(self):                                # 状態の取得
+        return {task.name: task.stats() for task in self.tasks}
+
+class VirtualClock:                                 # 試験用の仮想の時計
+    def __init__(self, wall=1600000007.5):          # コンストラクタ作成
+        self.now = 0.0                              # 単調増加時刻
+        self.offset = wall                          # 時計との差(NTPで変化)
+    def monotonic(self):                            # 単調増加時刻
+        return self.now                             # 現在の時刻
+    def time(self):                                 # 時計(UNIX時刻)
+        return self.now + self.offset               # 時計の時刻
+    def sleep(self, seconds):                       # 待機(時刻を進める)
+        self.now += seconds                         # 時刻を進める
+
+if __name__ == '__main__':                          # 直接実行された時
+    clock = VirtualClock()                          # 仮想の時計(UNIX時刻の端数7.5秒)
+    scheduler = Scheduler(clock.monotonic, clock.time, metrics=False)
+    windows = list()                                # 集計した時計の時刻
+    def update():                                   # 1秒ごとの処理(0.2秒かかる)
+        clock.sleep(2.5 if 100 <= clock.now < 101 else 0.2) # 100秒目だけ2.5秒かかる
+    def window():                                   # 30秒ごとの集計
+        windows.append(round(clock.time() % 60, 3)) # 時計の秒を記録
+        if len(windows) == 3:                       # 3回目の集計の時
+            clock.offset += 12.0                    # NTPで時計が12秒進む
+    scheduler.every('update', 1.0, update)          # 1秒ごと
+    scheduler.every('window', 30, window, align=True)   # 時計の30秒ごと
+    scheduler.run(clock.sleep, until=300)           # 仮想の300秒間
+    print('window at (sec of minute):', windows)
+    for name, stats in scheduler.stats().items():   # 各タスクについて
+        print(name, stats)                          # タスクの状態を表示
+
+''' 実行結果の一例 (仮想の時計、UNIX時刻の端数7.5秒で開始、3回目の集計の後に
+                  時計が12秒進み、100秒目の更新だけ2.5秒かかる)
+$ ./ble_scheduler.py
+window at (sec of minute): [0.0, 30.0, 0.0, 30.0, 0.0, 30.0, 0.0, 30.0, 0.0, 30.0]
+update {'period': 1.0, 'runs': 300, 'skipped': 1, 'realigned': 0, 'late_max': 0.5, 'late_mean': 0.0017, 'busy': 0.0}
+window {'period': 30, 'runs': 10, 'skipped': 0, 'realigned': 1, 'late_max': 0.0, 'late_mean': 0.0, 'busy': 0.0}
+'''
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Sensors ble_sensors.py
+# BLEビーコン数と一緒に送信する温度センサとCO2センサ(SENSIRION SGP30)です。
+#
+#   各センサは read() で {'temp': 値} や {'co2': 値, 'tvoc': 値} のような
+#   辞書を応答します。ble_pipeline.py はこの辞書を出力先へ渡します。
+#
+#   SGP30 のベースライン補正は、1秒ごとの測定(measure_air_quality)を前提と
+#   しています。Sampler はセンサを専用のスレッドで、単調増加時刻に対して
+#   ずれの蓄積しない周期(開始時刻 + n × 1秒)で読み取り、時刻付きの最新値と
+#   履歴を保持します。read() は最新値を返すだけなので、スキャンを止めません。
+#   最新値は1つのタプルの置き換えで更新するため、ロックは不要です。
+#   SGP30 の応答(6バイト)は2バイトごとのCRCを確認し、不一致の時は
+#   その測定を捨てます。FakeSMBus は smbus.SMBus の代わりの模擬センサです。
+#
+#   SGP30 は初期化(init_air_quality)のたびにベースラインを学習し直すため、
+#   正確な値になるまで何時間もかかります。baseline にファイル名を指定すると、
+#   1時間ごとにベースラインを取得(get_baseline)して保存し、次回の起動時に
+#   保存から1週間以内であれば設定(set_baseline)して学習を引き継ぎます。
+#   保存したベースラインが無い時は、12時間の学習後から保存を始めます。
+#   初期化直後の約15秒間は固定値(400ppm/0ppb)のため、Sampler には渡しません。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【ハードウェア】
+# CO2センサ SENSIRION SGP30 のI2Cインタフェースを Raspberry Piに接続します。
+#   Raspberry Piの3番ピンにSDAを、5番ピンにSCLを接続してください。
+#   注意：SGP30の電源VDD,VDDH、信号電圧は1.8Vです。
+#       　1.8Vの電源を供給し、Raspberry PiのI2C信号を3.3V→1.8に変換する
+#       　必要があります。
+
+sgp30 = 0x58                                        # センサSGP30のI2Cアドレス
+period = 1.0                                        # Samplerの読み取り周期(秒)
+history = 600                                       # Samplerの履歴の件数
+stale = 3                                           # 最新値を古いとみなす周期の数
+baseline_file = '/var/tmp/ble_scan/sgp30_baseline'  # SGP30のベースラインの保存先
+baseline_interval = 3600                            # ベースラインの保存間隔(秒)
+baseline_learn = 12 * 3600                          # 保存が無い時の学習時間(秒)
+baseline_max_age = 7 * 24 * 3600                    # 設定に使う保存の古さの上限(秒)
+warmup = 15                                         # 初期化直後の固定値の測定回数
+
+from time import sleep, time, monotonic             # 時間関連を組み込む
+from collections import deque                       # 両端キューを組み込む
+import threading                                    # スレッド管理を組み込む
+import random                                       # 乱数を組み込む
+import os                                           # ファイル操作を組み込む
+try:                                                # 例外処理の監視を開始
+    import smbus                                    # SMBus(I2C)管理を組み込む
+except ImportError:                                 # smbusが無い時
+    smbus = None                                    # SGP30は使用不可
+
+def word2uint(d1,d2):                               # 2バイトデータを結合します
+    i = d1                                          # 1バイト目を変数iに代入
+    i <<= 8                                         # 8ビット左シフト(上位)
+    i += d2                                         # 2バイト目を変数iに加算
+    return i                                        # 変数iの値を返却
+
+def crc8(d1, d2):                                   # SGP30のCRC(多項式0x31,初期値0xff)
+    crc = 0xff                                      # 初期値
+    for byte in (d1, d2):                           # 2バイトについて
+        crc ^= byte                                 # バイトを加える
+        for i in range(8):                          # 各ビットについて
+            crc = ((crc << 1) ^ 0x31) & 0xff if crc & 0x80 else (crc << 1) & 0xff
+    return crc                                      # CRCを応答
+
+def words(data):                                    # 応答を2バイトの値の列に変換
+    if len(data) % 3:                               # 3バイト単位でない時
+        raise ValueError('SGP30 short read: %d bytes' % len(data))
+    for i in range(0, len(data), 3):                # 値(2バイト)とCRCの組ごと
+        if crc8(data[i], data[i + 1]) != data[i + 2]:   # CRCが一致しない時
+            raise ValueError('SGP30 CRC mismatch')  # 例外を応答
+    return [word2uint(data[i], data[i + 1]) for i in range(0, len(data), 3)]
+
+class TempSensor:                                   # クラスTempSensorの定義
+    _filename = '/sys/class/thermal/thermal_zone0/temp' # デバイスのファイル名
+    def __init__(self, offset=30.0):                # コンストラクタ作成
+        try:                                        # 例外処理の監視を開始
+            self.fp = open(self._filename)          # ファイルを開く
+        except Exception as e:                      # 例外処理発生時
+            raise Exception('SensorDeviceNotFound') # 例外を応答
+        self.offset = float(offset)                 # 温度センサ補正用
+        self.value = float()                        # 測定結果の保持用
+    def get(self):                                  # 温度値取得用メソッド
+        self.fp.seek(0)                             # 温度ファイルの先頭へ
+        val = float(self.fp.read()) / 1000          # 温度センサから取得
+        val -= self.offset                          # 温度を補正
+        val = round(val,1)                          # 丸め演算
+        self.value = val                            # 測定結果を保持
+        return val                                  # 測定結果を応答
+    def read(self):                                 # 出力先へ渡す値を取得
+        return {'temp': round(self.get())}          # 温度値(整数)を応答
+    def __del__(self):                              # インスタンスの削除
+        if hasattr(self, 'fp'):                     # ファイルを開いていた時
+            self.fp.close()                         # ファイルを閉じる
+
+def word_crc(value):                                # 2バイトの値をCRC付きの3バイトに変換
+    d1, d2 = value >> 8 & 0xff, value & 0xff        # 上位と下位のバイト
+    return [d1, d2, crc8(d1, d2)]                   # 値とCRC
+
+class Sgp30:                                        # クラスSgp30の定義
+    def __init__(self, bus=1, addr=sgp30, i2c=None, baseline=None,
+                 interval=baseline_interval, learn=baseline_learn):
+        if i2c is None and smbus is None:           # smbusが無い時
+            raise Exception('SensorDeviceNotFound') # 例外を応答
+        self.addr = addr                            # I2Cアドレスを保持
+        self.i2c = i2c or smbus.SMBus(bus)          # I2Cバスを実体化
+        self.i2c.write_byte_data(addr, 0x20, 0x03)  # SGP30の初期設定を実行
+        sleep(1.012)                                # 1.012秒間の待ち時間処理
+        self.value = (0, 0)                         # 測定結果の保持用
+        self.crc_errors = 0                         # CRCが一致しなかった数
+        self.measures = 0                           # 初期化後の測定回数
+        self.baseline = baseline                    # ベースラインの保存先
+        self.interval = interval                    # ベースラインの保存間隔
+        self.baseline_errors = 0                    # 保存・設定に失敗した数
+        self.saved = None                           # 最後に保存したベースライン
+        self.restored = self.restore() if baseline else None    # 設定したベースライン
+        self.save_at = monotonic() + (interval if self.restored else learn)
+    def get_baseline(self):                         # ベースラインを取得
+        self.i2c.write_byte_data(self.addr, 0x20, 0x15) # get_baseline の送信
+        sleep(0.010)                                # 10msの待ち時間処理
+        data = self.i2c.read_i2c_block_data(self.addr, 0x00, 6) # I2C通信で受信
+        (co2, tvoc) = words(data)                   # CRCを確認して値に変換
+        return (co2, tvoc)                          # CO2とTVOCのベースライン
+    def set_baseline(self, co2, tvoc):              # ベースラインを設定
+        data = [0x1e] + word_crc(tvoc) + word_crc(co2)  # set_baseline(TVOCが先)
+        self.i2c.write_i2c_block_data(self.addr, 0x20, data)    # I2C通信で送信
+        sleep(0.010)                                # 10msの待ち時間処理
+    def restore(self):                              # 保存したベースラインを設定
+        try:                                        # 例外処理の監視を開始
+            with open(self.baseline) as fp:         # 保存先を開く
+                t, co2, tvoc = (int(v, 0) for v in fp.read().split())
+        except FileNotFoundError:                   # 保存が無い時
+            return None                             # 学習し直す
+        except (OSError, ValueError):               # 読めない・壊れている時
+            self.baseline_errors += 1               # 失敗数を加算
+            return None                             # 学習し直す
+        if not 0 <= time() - t <= baseline_max_age: # 古い(または未来の)時
+            return None                             # 学習し直す
+        self.set_baseline(co2, tvoc)                # ベースラインを設定
+        return (co2, tvoc)                          # 設定したベースライン
+    def save(self):                                 # ベースラインを取得して保存
+        (co2, tvoc) = self.get_baseline()           # ベースラインを取得
+        os.makedirs(os.path.dirname(self.baseline) or '.', exist_ok=True)
+        with open(self.baseline + '.tmp', 'w') as fp:   # 一時ファイルに書き込み
+            fp.write('%d 0x%04x 0x%04x\n' % (time(), co2, tvoc))   # 時刻と値
+        os.replace(self.baseline + '.tmp', self.baseline)   # 一括で置き換え
+        self.saved = (co2, tvoc)                    # 保存したベースライン
+    def keep(self):                                 # 保存の時刻なら保存
+        if self.baseline is None or monotonic() < self.save_at:
+            return                                  # 保存しない
+        try:                                        # 例外処理の監視を開始
+            self.save()                             # ベースラインを保存
+        except (OSError, ValueError) as e:          # 取得・保存できない時
+            print(e)                                # エラー内容を表示
+            self.baseline_errors += 1               # 失敗数を加算(次の測定で再試行)
+            return                                  # 保存時刻は進めない
+        self.save_at = monotonic() + self.interval  # 次の保存時刻
+    def measure(self):                              # CO2とTVOCを測定(CRC確認付き)
+        self.i2c.write_byte_data(self.addr, 0x20, 0x08) # 取得コマンド送信
+        sleep(0.014)                                # 14msの待ち時間処理
+        data = self.i2c.read_i2c_block_data(self.addr, 0x00, 6) # I2C通信で受信
+        try:                                        # 例外処理の監視を開始
+            (co2, tvoc) = words(data)               # CRCを確認して値に変換
+        except ValueError:                          # CRCが一致しない時
+            self.crc_errors += 1                    # 不一致の数を加算
+            raise                                   # 呼び出し元へ
+        self.value = (co2, tvoc)                    # 測定結果を保持
+        self.measures += 1                          # 測定回数を加算
+        self.keep()                                 # ベースラインを保存
+        return self.value                           # それぞれを戻り値として返却
+    def get(self):                                  # CO2とTVOCを取得
+        try:                                        # 例外処理の監視を開始
+            return self.measure()                   # 測定結果を応答
+        except ValueError:                          # CRCが一致しない時
+            return self.value                       # 前回の測定結果を応答
+    def sample(self):                               # Samplerが使う読み取り
+        (co2, tvoc) = self.measure()                # 不一致の時は例外
+        if self.measures <= warmup and (co2, tvoc) == (400, 0):
+            return dict()                           # 初期化直後の固定値は渡さない
+        return {'co2': co2, 'tvoc': tvoc}           # 辞書型で応答
+    def read(self):                                 # 出力先へ渡す値を取得
+        (co2, tvoc) = self.get()                    # SGP30からCO2とTVOCを取得
+        return {'co2': co2, 'tvoc': tvoc}           # 辞書型で応答
+    def stats(self):                                # 状態の取得
+        stats = {'crc_errors': self.crc_errors}     # CRCの不一致数
+        if self.baseline:                           # ベースラインを保存する時
+            stats.update({'baseline_restored': self.restored,
+                          'baseline_saved': self.saved,
+                          'baseline_errors': self.baseline_errors})
+        return stats                                # 状態を応答
+
+class Sampler:                                      # 一定周期で読み取るスレッド
+    def __init__(self, sensor, period=period, history=history, clock=monotonic,
+                 sleep=None, start=True):           # コンストラクタ作成
+        self.sensor = sensor                        # センサ
+        self.read_sensor = getattr(sensor, 'sample', sensor.read)   # 読み取り関数
+        self.period = period                        # 読み取り周期(秒)
+        self.clock = clock                          # 単調増加時刻の取得関数
+        self.stopped = threading.Event()            # 停止の通知
+        self.sleep = sleep or self.stopped.wait     # 待機関数(停止時は即座に戻る)
+        self.latest = None                          # 最新値(時刻,単調時刻,値)
+        self.history = deque(maxlen=history)        # 履歴(時刻,値)
+        self.samples = 0                            # 読み取った数
+        self.errors = 0                             # 読み取りに失敗した数
+        self.skipped = 0                            # 遅れて飛ばした周期の数
+        self.late_max = 0.0                         # 予定時刻からの遅れの最大値(秒)
+        self.late_sum = 0.0                         # 遅れの合計(平均の計算用)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        if start:                                   # すぐに開始する時
+            self.thread.start()                     # スレッドを起動
+    def run(self):                                  # 読み取りスレッド
+        due = self.clock()                          # 次の予定時刻
+        while not self.stopped.is_set():            # 停止するまで
+            wait = due - self.clock()               # 予定時刻までの時間
+            if wait > 0:                            # 予定時刻の前の時
+                self.sleep(wait)                    # 予定時刻まで待機
+                if self.stopped.is_set():           # 停止した時
+                    break                           # 繰り返しを終了
+            self.step(due)                          # 1回の読み取り
+            due += self.period                      # 次の予定時刻(開始時刻+n周期)
+            behind = self.clock() - due             # 次の予定時刻からの遅れ
+            if behind >= self.period:               # 1周期以上遅れた時
+                missed = int(behind // self.period) # 間に合わない周期の数
+                self.skipped += missed              # 飛ばした数を加算
+                due += missed * self.period         # 周期の位相は保つ
+    def step(self, due):                            # 1回の読み取り
+        now = self.clock()                          # 読み取りの開始時刻
+        late = now - due                            # 予定時刻からの遅れ
+        self.late_max = max(self.late_max, late)    # 遅れの最大値
+        self.late_sum += late                       # 遅れの合計
+        try:                                        # 例外処理の監視を開始
+            values = self.read_sensor()             # センサ値を取得
+        except Exception as e:                      # 読み取れなかった時(CRC等)
+            self.errors += 1                        # 失敗数を加算
+            return                                  # 最新値は更新しない
+        self.samples += 1                           # 読み取った数を加算
+        reading = (time(), now, values)             # 時刻付きの値
+        self.latest = reading                       # 最新値を置き換え(ロック不要)
+        self.history.append(reading[0::2])          # 履歴に追加(時刻,値)
+    def read(self):                                 # 出力先へ渡す値を取得
+        latest = self.latest                        # 最新値(1回だけ参照)
+        if latest is None or self.clock() - latest[1] > self.period * stale:
+            return dict()                           # 値が無い・古い時
+        return latest[2]                            # 最新の値を応答
+    def recent(self, seconds):                      # 直近seconds秒間の履歴
+        since = time() - seconds                    # 開始時刻
+        return [r for r in list(self.history) if r[0] >= since]
+    def stop(self):                                 # スレッドを停止
+        self.stopped.set()                          # 停止を通知
+        if self.thread.is_alive():                  # 動作中の時
+            self.thread.join(self.period * 2)       # 終了を待つ
+    def stats(self):                                # 状態の取得
+        stats = {'samples': self.samples, 'errors': self.errors, 'skipped': self.skipped,
+                 'late_max': round(self.late_max, 4),
+                 'late_mean': round(self.late_sum / max(self.samples + self.errors, 1), 4)}
+        if hasattr(self.sensor, 'stats'):           # センサの状態がある時
+            stats.update(self.sensor.stats())       # センサの状態を追加
+        return stats                                # 状態を応答
+
+class FakeSMBus:                                    # smbus.SMBus相当の模擬SGP30
+    def __init__(self, bus=1, co2=600, tvoc=100, warmup=15, corrupt=0.0, seed=1):
+        self.co2 = co2                              # 模擬のCO2濃度(ppm)
+        self.tvoc = tvoc                            # 模擬のTVOC濃度(ppb)
+        self.warmup = warmup                        # 初期化後に固定値を返す回数
+        self.corrupt = corrupt                      # 応答を壊す割合
+        self.rnd = random.Random(seed)              # 再現可能な乱数
+        self.command = None                         # 最後のコマンド
+        self.commands = list()                      # 受け取ったコマンドの列
+        self.measures = 0                           # 初期化後の測定回数
+        self.baseline = (0x8a3b, 0x8f21)            # 模擬のベースライン
+        self.restored = None                        # 設定されたベースライン
+    def write_byte_data(self, addr, cmd, value):    # コマンドの送信
+        self.command = cmd << 8 | value             # コマンド(2バイト)
+        self.commands.append(self.command)          # コマンドを記録
+        if self.command == 0x2003:                  # init_air_quality の時
+            self.measures = 0                       # 測定回数を消去
+            self.restored = None                    # 設定を消去
+        elif self.command == 0x2008:                # measure_air_quality の時
+            self.measures += 1                      # 測定回数を加算
+    def write_i2c_block_data(self, addr, cmd, data):    # パラメータ付きの送信
+        self.command = cmd << 8 | data[0]           # コマンド(2バイト)
+        self.commands.append(self.command)          # コマンドを記録
+        if self.command == 0x201e:                  # set_baseline の時
+            (tvoc, co2) = words(data[1:])           # CRCを確認(TVOCが先)
+            self.baseline = self.restored = (co2, tvoc) # ベースラインを設定
+    def reply(self, values):                        # 応答(値,CRC)の列を作成
+        data = list()                               # 応答
+        for value in values:                        # 各値について
+            data += word_crc(value)                 # 値とCRC
+        if self.corrupt and self.rnd.random() < self.corrupt:
+            data[self.rnd.randrange(len(data))] ^= 1 << self.rnd.randrange(8)
+        return data                                 # 応答を返却
+    def read_i2c_block_data(self, addr, cmd, length):   # 応答の受信
+        if self.command == 0x2008:                  # measure_air_quality の時
+            if self.measures <= self.warmup:        # 初期化直後の時
+                return self.reply((400, 0))[:length]    # 固定値
+            co2 = self.co2 + self.rnd.randint(-5, 5)    # 模擬のCO2濃度
+            tvoc = self.tvoc + self.rnd.randint(-2, 2)  # 模擬のTVOC濃度
+            return self.reply((co2, tvoc))[:length] # 測定値
+        if self.command == 0x2015:                  # get_baseline の時
+            return self.reply(self.baseline)[:length]   # ベースライン
+        return [0xff] * length                      # 不明なコマンド
+
+if __name__ == '__main__':                          # 直接実行された時
+    bus = FakeSMBus(corrupt=0.1)                    # 1割の応答を壊す模擬SGP30
+    sensor = Sgp30(i2c=bus, baseline='/tmp/sgp30_baseline', learn=10)  # 10秒で保存
+    sampler = Sampler(sensor)                       # 1秒周期で読み取り
+    for i in range(20):                             # 20秒間
+        sleep(1.0)                                  # 1秒間待機
+        print(sampler.read(), sampler.stats())      # 最新値と状態を表示
+    sampler.stop()                                  # 読み取りを停止
+
+''' 実行結果の一例 (FakeSMBus、応答の1割を破損、初期化直後の15回は400ppm/0ppb)
+$ rm -f /tmp/sgp30_baseline
+$ ./ble_sensors.py                                  (保存が無い時、10秒の学習後に保存)
+{} {'samples': 1, 'errors': 0, 'skipped': 0, 'late_max': 0.0, 'late_mean': 0.0, 'crc_errors': 0, 'baseline_restored': None, 'baseline_saved': None, 'baseline_errors': 0}
+...
+{} {'samples': 9, 'errors': 1, 'skipped': 0, 'late_max': 0.0003, 'late_mean': 0.0002, 'crc_errors': 1, 'baseline_restored': None, 'baseline_saved': None, 'baseline_errors': 0}
+SGP30 CRC mismatch
+{} {'samples': 10, 'errors': 1, 'skipped': 0, 'late_max': 0.0003, 'late_mean': 0.0002, 'crc_errors': 1, 'baseline_restored': None, 'baseline_saved': None, 'baseline_errors': 1}
+{} {'samples': 13, 'errors': 1, 'skipped': 0, 'late_max': 0.0003, 'late_mean': 0.0002, 'crc_errors': 1, 'baseline_restored': None, 'baseline_saved': (35387, 36641), 'baseline_errors': 1}
+...
+{'co2': 601, 'tvoc': 99} {'samples': 14, 'errors': 2, 'skipped': 0, 'late_max': 0.0003, 'late_mean': 0.0002, 'crc_errors': 2, 'baseline_restored': None, 'baseline_saved': (35387, 36641), 'baseline_errors': 1}
+$ cat /tmp/sgp30_baseline
+1792309069 0x8a3b 0x8f21
+$ ./ble_sensors.py                                  (再起動、保存したベースラインを設定)
+{} {'samples': 1, 'errors': 0, 'skipped': 0, 'late_max': 0.0, 'late_mean': 0.0, 'crc_errors': 0, 'baseline_restored': (35387, 36641), 'baseline_saved': None, 'baseline_errors': 0}
+...
+{'co2': 595, 'tvoc': 102} {'samples': 15, 'errors': 3, 'skipped': 0, 'late_max': 0.0005, 'late_mean': 0.0002, 'crc_errors': 3, 'baseline_restored': (35387, 36641), 'baseline_saved': None, 'baseline_errors': 0}
+'''
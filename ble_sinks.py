@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Sinks ble_sinks.py
+# BLEビーコン数やセンサ値の出力先(表示、LINE、UDP)です。
+#
+#   出力先は Sink クラスを継承し、必要なメソッドだけを実装します。
+#       start(pipeline)   開始時に1回だけ呼ばれる
+#       found(dev, new)   RSSIが閾値以上のアドバタイジングを受信するたび
+#       update(values)    動作間隔(約1秒)ごとに最新値を受け取る
+#       window(values)    30秒ごとの集計時に最新値を受け取る
+#       stats()           待ち行列の長さや送信遅延などの状態を応答する
+#   values は {'counter': 5, 'co2': 402, ...} のような辞書です。
+#
+#   LINEへの送信は DeliveryWorker の送信スレッドが行うため、送信先が
+#   応答しなくてもスキャンは止まりません。Ambientは ble_ambient.py、
+#   HTTPサーバは ble_httpd.py にあります。
+#
+#   UdpSink(sketch=True) の時は、集計ごとに最短の時間窓のアドレスを近似
+#   カウントのスケッチ(ble_hll.py)にして、値の行の次に送信します。複数の
+#   ノードのスケッチを ble_collector.py で結合すると、ノード間で重複した
+#   アドレスを除いた会場全体のデバイス数が求まります。
+#
+#   LINEとUDPの未送信データはスプール(ble_spool.py)に保存し、回線が復旧
+#   した時に古い順に再送します。spool_dir=None の時はメモリ上に保持します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+line_token='xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
+                                            # ↑ここにLINEで取得したTOKENを入力
+alart_n = 5                                         # LINE送信閾値
+
+udp_to = '255.255.255.255'                          # UDPブロードキャスト
+udp_port = 1024                                     # UDP送信ポート番号を1024に
+device_s = 'e_co2_3'                                # デバイス識別名
+udp_batch = 100                                     # 1回の集計で再送する件数
+udp_sketch = False                                  # アドレスのスケッチも送信する
+
+from ble_delivery import DeliveryWorker, post_seconds, post_failures
+from ble_spool import open_spool, spool_dir         # スプールを組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+import urllib.request                               # HTTP通信を組み込む
+import socket                                       # ソケット通信を組み込む
+import os                                           # ファイル操作を組み込む
+
+def urlopen(post, timeout):                         # タイムアウト付きHTTPアクセス
+    with urllib.request.urlopen(post, timeout=timeout) as res:
+        res.read()                                  # 応答を読み捨てる
+
+class Sink:                                         # 出力先の基底クラス
+    flush_interval = None                           # 一括送信の間隔(秒、Noneは無し)
+    def start(self, pipeline):                      # 開始時の処理
+        self.pipeline = pipeline                    # パイプラインを保持
+    def found(self, dev, new):                      # 受信時の処理
+        pass                                        # 既定では何もしない
+    def update(self, values):                       # 動作間隔ごとの処理
+        pass                                        # 既定では何もしない
+    def window(self, values):                       # 集計時の処理
+        pass                                        # 既定では何もしない
+    def flush(self):                                # 一括送信(flush_interval秒ごと)
+        pass                                        # 既定では何もしない
+    def stats(self):                                # 状態の取得
+        return dict()                               # 既定では状態なし
+    def close(self):                                # 終了時の処理
+        pass                                        # 既定では何もしない
+
+class PrintSink(Sink):                              # 表示用の出力先
+    def __init__(self, verbose=False):              # コンストラクタ作成
+        self.verbose = verbose                      # 受信ごとに表示するか
+    def found(self, dev, new):                      # 受信時の処理
+        if self.verbose:                            # 受信ごとに表示する時
+            print(len(self.pipeline.MAC), 'Devices found', end=', ')
+            print(dev.addr, end=', ')               # アドレスを表示
+            print('RSSI=' + str(dev.rssi))          # 受信強度RSSIを表示
+        elif new:                                   # 新たなアドレスの時
+            print(len(self.pipeline.MAC), 'Devices found')  # 発見済み数を表示
+    def window(self, values):                       # 集計時の処理
+        spans = self.pipeline.MAC.spans             # 時間窓の長さ
+        print(values['counter'], 'Counts/%dseconds' % spans[0], end='')
+        if self.verbose:                            # 詳細表示の時
+            for span in spans[1:]:                  # 長い時間窓について
+                print(', %d Counts/%dseconds' % (values['counter_%ds' % span], span), end='')
+            if 'corrected_%ds' % spans[-1] in values:   # 補正後の値がある時
+                print(' (corrected %d)' % values['corrected_%ds' % spans[-1]], end='')
+        if 'temp' in values:                        # 温度値がある時
+            print(', Temp = %d ℃' % values['temp'], end='')   # tempを表示
+        if 'co2' in values:                         # CO2濃度がある時
+            print(', CO2 = %d ppm' % values['co2'], end='') # co2を表示
+        if 'tvoc' in values:                        # TVOC濃度がある時
+            print(', TVOC= %d ppb' % values['tvoc'], end='')    # tvocを表示
+        print()                                     # 改行
+
+class LineSink(Sink):                               # LINE送信用の出力先
+    def __init__(self, token=line_token, alart_n=alart_n, spool_dir=spool_dir):
+        self.url_s = 'https://notify-api.line.me/api/notify'    # アクセス先
+        self.head = {'Authorization':'Bearer ' + token,
+             'Content-Type':'application/x-www-form-urlencoded; charset=UTF-8'}
+        self.alart_n = alart_n                      # LINE送信閾値
+        self.spool = open_spool(spool_dir and os.path.join(spool_dir, 'line'))
+        self.worker = DeliveryWorker(self.send, name='line')   # 送信スレッド
+    def send(self, item, timeout):                  # 送信スレッドでの送信処理
+        while True:                                 # スプールが空になるまで
+            bodies = self.spool.peek(1)             # 最も古い通知を取得
+            if not bodies:                          # 未送信の通知が無い時
+                return                              # 送信完了
+            post = urllib.request.Request(self.url_s, bodies[0].encode(), self.head)
+            urlopen(post, timeout)                  # 送信(失敗時は例外)
+            self.spool.ack()                        # 送信済みとして消す
+    def start(self, pipeline):                      # 開始時の処理
+        Sink.start(self, pipeline)                  # パイプラインを保持
+        self.drain()                                # 前回の起動時の未送信を再送
+    def drain(self):                                # スプールの送信を待ち行列へ
+        if len(self.spool):                         # 未送信の通知がある時
+            self.worker.put(None, key='drain')      # 送信スレッドで古い順に送信
+    def window(self, values):                       # 集計時の処理
+        counter = values['counter']                 # カウンタ値
+        if counter >= self.alart_n:                 # カウンタ値が閾値以上の時
+            body = 'message=密集度は ' + str(counter) + ' です。'
+            print(body)                             # メッセージを表示
+            self.spool.append(body)                 # スプールに保存
+        self.drain()                                # 新しい通知と失敗分を再送
+    def stats(self):                                # 状態の取得
+        stats = self.worker.stats()                 # 送信スレッドの状態
+        stats['spool'] = self.spool.stats()         # スプールの状態
+        return stats                                # 状態を応答
+    def close(self):                                # 終了時の処理
+        self.worker.close(5)                        # 未送信を5秒まで待つ
+        self.spool.close()                          # 未送信は次回の起動時に再送
+
+class UdpSink(Sink):                                # UDP送信用の出力先
+    def __init__(self, device_s=device_s, udp_to=udp_to, udp_port=udp_port,
+                 spool_dir=spool_dir, sketch=udp_sketch):
+        self.device_s = device_s                    # デバイス識別名
+        self.sketch = sketch                        # アドレスのスケッチも送信する
+        self.addr = (udp_to, udp_port)              # 送信先
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # ソケットを作成
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST,1)
+        self.spool = open_spool(spool_dir and os.path.join(spool_dir, 'udp'))
+        self.sent = 0                               # 送信数
+        self.failed = 0                             # 送信失敗数
+        self.post_seconds = post_seconds.labels('udp')  # 送信時間の分布
+        self.post_failures = post_failures.labels('udp')    # 送信失敗数
+    def replay(self):                               # 保存済みのデータを再送
+        sent = self.sent                            # 再送前の送信数
+        try:                                        # 例外処理の監視を開始
+            for i in range(udp_batch):              # 最大udp_batch件
+                lines = self.spool.peek(1)          # 最も古いデータを取得
+                if not lines:                       # 未送信のデータが無い時
+                    break                           # 再送を終了
+                self.sock.sendto((lines[0] + '\n').encode(), self.addr)    # 失敗時は例外
+                self.spool.ack()                    # 1件ごとに送信済みとして消す
+                self.sent += 1                      # 送信数を加算
+        finally:                                    # 失敗時も
+            if self.sent > sent:                    # 再送した時
+                print('resend :', self.sent - sent, 'lines, pending =', len(self.spool))
+    def window(self, values):                       # 集計時の処理
+        udp_s = self.device_s + ', ' + str(values.get('temp', 0)) + ', 0, 0, '
+        udp_s += str(values.get('co2', 0)) + ', ' + str(values.get('tvoc', 0))
+        udp_s += ', ' + str(values['counter'])      # カウンタ値を追加
+        if 'occupancy' in values:                   # 在室数の推定がある時
+            udp_s += ', ' + str(values['occupancy'])    # 8番目の項目に追加
+        print('send :', udp_s)                      # 送信データを出力
+        if len(self.spool):                         # 未送信のデータがある時
+            self.spool.append(udp_s)                # 順番を守るため後ろに保存
+        start = monotonic()                         # 送信の開始時刻
+        try:                                        # 作成部
+            if len(self.spool):                     # 未送信のデータがある時
+                self.replay()                       # 古い順に再送
+            else:                                   # 未送信のデータが無い時
+                self.sock.sendto((udp_s + '\n').encode(), self.addr)   # UDP送信
+                self.sent += 1                      # 送信数を加算
+        except Exception as e:                      # 例外処理発生時
+            print(e)                                # エラー内容を表示
+            self.failed += 1                        # 送信失敗数を加算
+            self.post_failures.inc()                # 送信失敗数を加算(/metrics)
+            if not len(self.spool):                 # スプールに無い時
+                self.spool.append(udp_s)            # スプールに保存
+        self.post_seconds.observe(monotonic() - start)  # 送信時間を記録
+        if self.sketch:                             # スケッチも送信する時
+            self.send_sketch()                      # スケッチを送信
+    def send_sketch(self):                          # スケッチの送信(再送なし)
+        span = self.pipeline.MAC.spans[0]           # 最短の時間窓
+        line = '%s, hll, %d, %s' % (self.device_s, span, self.pipeline.MAC.sketch(span).dumps())
+        try:                                        # 例外処理の監視を開始
+            self.sock.sendto((line + '\n').encode(), self.addr)   # UDP送信
+        except Exception as e:                      # 例外処理発生時
+            print(e)                                # エラー内容を表示
+            self.post_failures.inc()                # 送信失敗数を加算(/metrics)
+    def stats(self):                                # 状態の取得
+        return {'sent': self.sent, 'failed': self.failed, 'spool': self.spool.stats()}
+    def close(self):                                # 終了時の処理
+        self.sock.close()                           # ソケットの切断
+        self.spool.close()                          # 未送信は次回の起動時に再送
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Spool ble_spool.py
+# 送信できなかった(または送信前の)データをSDカード等に追記保存し、回線が
+# 復旧した時に古い順にまとめて再送するための保存領域(スプール)です。
+#
+#   ・データは1件1行(CRC32とJSON)で、セグメントファイルへ追記するだけです
+#   ・電源断で途中まで書かれた行はCRCで検出して読み飛ばします
+#   ・送信済みの位置は cursor ファイルに記録し、再起動後も続きから送ります
+#   ・合計サイズが上限を超えると、最も古いセグメントから削除します
+#   ・fsync は fsync_interval 秒に1回だけ行い、SDカードへの負担を抑えます
+#     (プロセスが異常終了してもOSへ書き出し済みのデータは残ります)
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_spool import open_spool
+#   spool = open_spool('/var/tmp/ble_scan/udp')     # Noneならメモリ上に保持
+#   spool.append({'counter': 5})                    # 追記
+#   records = spool.peek(10)                        # 古い順に最大10件を取得
+#   (送信に成功したら)
+#   spool.ack()                                     # peekした分を送信済みに
+
+spool_dir = '/var/tmp/ble_scan'                     # 保存先のディレクトリ
+max_bytes = 16 * 1024 * 1024                        # 合計サイズの上限(バイト)
+segment_bytes = 1024 * 1024                         # 1ファイルのサイズ(バイト)
+fsync_interval = 30                                 # fsyncの間隔(秒)
+
+from collections import deque                       # 両端キューを組み込む
+from time import monotonic                          # 単調増加時刻を組み込む
+from zlib import crc32                              # CRC32を組み込む
+import threading                                    # スレッド管理を組み込む
+import json                                         # JSON変換を組み込む
+import os                                           # ファイル操作を組み込む
+
+def encode(record):                                 # 1件を1行のバイト列に変換
+    line = json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode()
+    return b'%08x ' % crc32(line) + line + b'\n'    # CRC32 + JSON + 改行
+
+def decode(line):                                   # 1行を1件に変換(破損はNone)
+    if not line.endswith(b'\n') or len(line) < 10:  # 途中までの行の時
+        return None                                 # 破損として応答
+    try:                                            # 例外処理の監視を開始
+        if int(line[:8], 16) != crc32(line[9:-1]):  # CRCが一致しない時
+            return None                             # 破損として応答
+        return (json.loads(line[9:-1]),)            # 1件を応答
+    except ValueError:                              # 変換できない時
+        return None                                 # 破損として応答
+
+class Spool:                                        # クラスSpoolの定義
+    def __init__(self, path, max_bytes=max_bytes, segment_bytes=segment_bytes,
+                 fsync_interval=fsync_interval, clock=monotonic):
+        self.path = path                            # 保存先のディレクトリ
+        self.max_bytes = max_bytes                  # 合計サイズの上限
+        self.segment_bytes = segment_bytes          # 1ファイルのサイズ
+        self.fsync_interval = fsync_interval        # fsyncの間隔(秒)
+        self.clock = clock                          # 時刻取得関数
+        self.lock = threading.Lock()                # 追記と再送の排他制御
+        self.dropped = 0                            # 上限のため削除した件数
+        self.corrupt = 0                            # 破損により読み飛ばした行数
+        self.peeked = None                          # peek後の読み出し位置
+        os.makedirs(path, exist_ok=True)            # ディレクトリを作成
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(path)
+                               if name.endswith('.log') and name[:-4].isdigit())
+        self.sizes = {n: os.path.getsize(self._name(n)) for n in self.segments}
+        self.cursor = self._load_cursor()           # 送信済みの位置
+        self.pending = self._count(self.cursor)     # 未送信の件数
+        self.fp = None                              # 追記中のファイル
+        if self.segments and self._torn(self.segments[-1]):
+            self._rotate()                          # 途中の行の後には追記しない
+        self.last_sync = clock()                    # 前回のfsync時刻
+    def _name(self, n):                             # セグメントのファイル名
+        return os.path.join(self.path, '%08d.log' % n)
+    def _torn(self, n):                             # 最後の行が途中までか
+        if self.sizes[n] == 0:                      # 空のファイルの時
+            return False                            # 途中ではない
+        with open(self._name(n), 'rb') as fp:       # ファイルを開く
+            fp.seek(-1, os.SEEK_END)                # 最後の1バイトへ
+            return fp.read(1) != b'\n'              # 改行でなければ途中
+    def _load_cursor(self):                         # 送信済みの位置を読み込む
+        try:                                        # 例外処理の監視を開始
+            with open(os.path.join(self.path, 'cursor')) as fp:
+                seg, offset = (int(v) for v in fp.read().split())
+        except (OSError, ValueError):               # 無い・壊れている時
+            seg, offset = 0, 0                      # 先頭から
+        if seg not in self.sizes:                   # セグメントが無い時
+            later = [n for n in self.segments if n > seg]
+            seg, offset = (later[0] if later else seg), 0
+        return (seg, offset)                        # 位置を応答
+    def _save_cursor(self):                         # 送信済みの位置を保存
+        name = os.path.join(self.path, 'cursor')    # ファイル名
+        with open(name + '.tmp', 'w') as fp:        # 一時ファイルに書き込み
+            fp.write('%d %d\n' % self.cursor)       # セグメント番号と位置
+        os.replace(name + '.tmp', name)             # 一括で置き換え
+    def _count(self, cursor):                       # 未送信の件数を数える
+        n = 0                                       # 件数
+        for seg in self.segments:                   # 各セグメントについて
+            if seg < cursor[0]:                     # 送信済みのセグメント
+                continue                            # 数えない
+            with open(self._name(seg), 'rb') as fp: # ファイルを開く
+                if seg == cursor[0]:                # 送信途中のセグメント
+                    fp.seek(cursor[1])              # 送信済みの位置へ
+                n += sum(1 for line in fp if line.endswith(b'\n'))
+        return n                                    # 件数を応答
+    def _rotate(self):                              # 新しいセグメントへ切替
+        if self.fp is not None:                     # 追記中のファイルがある時
+            self._sync()                            # 書き出しを確定
+            self.fp.close()                         # ファイルを閉じる
+        n = self.segments[-1] + 1 if self.segments else 1
+        self.segments.append(n)                     # セグメントを追加
+        self.sizes[n] = 0                           # サイズは0
+        self.fp = open(self._name(n), 'ab')         # 追記用に開く
+    def _evict(self, size):                         # 上限を超える古いデータを削除
+        while len(self.segments) > 1 and sum(self.sizes.values()) + size > self.max_bytes:
+            seg = self.segments.pop(0)              # 最も古いセグメント
+            if seg >= self.cursor[0]:               # 未送信のデータを含む時
+                self.dropped += self._count_one(seg, self.cursor if seg == self.cursor[0] else (seg, 0))
+                self.cursor = (self.segments[0], 0) # 次のセグメントの先頭へ
+                self.peeked = None                  # peek結果は無効
+            os.remove(self._name(seg))              # ファイルを削除
+            del self.sizes[seg]                     # サイズ情報を削除
+        self.pending = self._count(self.cursor)     # 未送信の件数を再計算
+    def _count_one(self, seg, cursor):              # 1セグメントの未送信件数
+        with open(self._name(seg), 'rb') as fp:     # ファイルを開く
+            fp.seek(cursor[1])                      # 送信済みの位置へ
+            return sum(1 for line in fp if line.endswith(b'\n'))
+    def _sync(self):                                # ディスクへの書き出しを確定
+        self.fp.flush()                             # OSへ書き出し
+        os.fsync(self.fp.fileno())                  # ディスクへ書き出し
+        self.last_sync = self.clock()               # fsync時刻を保持
+    def append(self, record):                       # 1件を追記
+        data = encode(record)                       # 1行のバイト列に変換
+        with self.lock:                             # 排他制御
+            if self.fp is None or self.sizes[self.segments[-1]] + len(data) > self.segment_bytes:
+                self._rotate()                      # 新しいセグメントへ
+            if sum(self.sizes.values()) + len(data) > self.max_bytes:
+                self._evict(len(data))              # 古いデータを削除
+            self.fp.write(data)                     # 追記
+            self.fp.flush()                         # OSへ書き出し(fsyncなし)
+            self.sizes[self.segments[-1]] += len(data)  # サイズを加算
+            self.pending += 1                       # 未送信の件数を加算
+            if self.clock() - self.last_sync >= self.fsync_interval:
+                self._sync()                        # 定期的にfsync
+    def peek(self, n):                              # 古い順に最大n件を取得
+        records = list()                            # 取得したデータ
+        with self.lock:                             # 排他制御
+            seg, offset = self.cursor               # 送信済みの位置
+            for s in [x for x in self.segments if x >= seg]:
+                if s != seg:                        # 次のセグメントの時
+                    seg, offset = s, 0              # 先頭から
+                with open(self._name(seg), 'rb') as fp: # ファイルを開く
+                    fp.seek(offset)                 # 読み出し位置へ
+                    for line in fp:                 # 各行について
+                        if not line.endswith(b'\n'):    # 書き込み途中の行
+                            break                   # 次回に読む
+                        offset += len(line)         # 読み出し位置を進める
+                        record = decode(line)       # 1件に変換
+                        if record is None:          # 破損した行の時
+                            self.corrupt += 1       # 破損数を加算
+                            continue                # 読み飛ばす
+                        records.append(record[0])   # データを追加
+                        if len(records) >= n:       # n件に達した時
+                            break                   # 読み出しを終了
+                if len(records) >= n:               # n件に達した時
+                    break                           # 読み出しを終了
+            self.peeked = (seg, offset, len(records))   # 読み出し後の位置
+        return records                              # データを応答
+    def ack(self):                                  # peekした分を送信済みに
+        with self.lock:                             # 排他制御
+            if self.peeked is None:                 # peekしていない時
+                return                              # 処理を終了
+            seg, offset, n = self.peeked            # 読み出し後の位置
+            self.peeked = None                      # peek結果を消去
+            self.cursor = (seg, offset)             # 送信済みの位置を更新
+            self.pending = max(self.pending - n, 0) # 未送信の件数を減算
+            while len(self.segments) > 1 and self.segments[0] < seg:
+                old = self.segments.pop(0)          # 送信済みのセグメント
+                os.remove(self._name(old))          # ファイルを削除
+                del self.sizes[old]                 # サイズ情報を削除
+            self._save_cursor()                     # 位置を保存
+    def __len__(self):                              # len()は未送信の件数
+        return self.pending                         # 未送信の件数を応答
+    def stats(self):                                # 状態の取得
+        return {'pending': self.pending, 'bytes': sum(self.sizes.values()),
+                'segments': len(self.segments), 'dropped': self.dropped,
+                'corrupt': self.corrupt}
+    def close(self):                                # 終了時の処理
+        with self.lock:                             # 排他制御
+            if self.fp is not None:                 # 追記中のファイルがある時
+                self._sync()                        # 書き出しを確定
+                self.fp.close()                     # ファイルを閉じる
+                self.fp = None                      # 追記中のファイルなし
+
+class MemorySpool:                                  # メモリ上のスプール
+    def __init__(self, max_records=10000):          # コンストラクタ作成
+        self.records = deque()                      # 未送信のデータ
+        self.max_records = max_records              # 件数の上限
+        self.lock = threading.Lock()                # 追記と再送の排他制御
+        self.dropped = 0                            # 上限のため削除した件数
+        self.peeked = 0                             # peekした件数
+    def append(self, record):                       # 1件を追記
+        with self.lock:                             # 排他制御
+            if len(self.records) >= self.max_records:   # 上限に達した時
+                self.records.popleft()              # 最も古いデータを削除
+                self.dropped += 1                   # 削除数を加算
+                self.peeked = 0                     # peek結果は無効
+            self.records.append(record)             # 追記
+    def peek(self, n):                              # 古い順に最大n件を取得
+        with self.lock:                             # 排他制御
+            records = [self.records[i] for i in range(min(n, len(self.records)))]
+            self.peeked = len(records)              # peekした件数
+        return records                              # データを応答
+    def ack(self):                                  # peekした分を送信済みに
+        with self.lock:                             # 排他制御
+            for i in range(self.peeked):            # peekした件数だけ
+                self.records.popleft()              # 先頭から削除
+            self.peeked = 0                         # peek結果を消去
+    def __len__(self):                              # len()は未送信の件数
+        return len(self.records)                    # 未送信の件数を応答
+    def stats(self):                                # 状態の取得
+        return {'pending': len(self.records), 'dropped': self.dropped}
+    def close(self):                                # 終了時の処理
+        pass                                        # 何もしない
+
+def open_spool(path, **kwargs):                     # スプールを開く
+    if path is None:                                # 保存先が無い時
+        return MemorySpool()                        # メモリ上に保持
+    return Spool(path, **kwargs)                    # ファイルに保存
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Stream ble_stream.py
+# BLEのスキャンを停止せずに継続し、受信したアドバタイジングを逐次処理します。
+#
+#   scanner.scan(interval) は呼び出しごとにスキャンを停止・再開するため、
+#   その間に送信されたアドバタイジングを取りこぼします。本モジュールでは
+#   btle.DefaultDelegate.handleDiscovery を使い、受信と同時にコールバック
+#   関数へ渡します。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_stream import StreamScanner
+#   def found(dev):                                 # 受信ごとに呼ばれる関数
+#       print(dev.addr, dev.rssi)
+#   scanner = StreamScanner(found)                  # 連続スキャンを生成
+#   while True:
+#       scanner.process(interval)                   # interval秒間だけ受信処理
+#
+#【参考文献】
+#   https://ianharvey.github.io/bluepy-doc/scanner.html
+#   https://ianharvey.github.io/bluepy-doc/delegate.html
+
+try:                                                # 例外処理の監視を開始
+    from bluepy import btle                         # bluepyからbtleを組み込む
+    DefaultDelegate = btle.DefaultDelegate          # デリゲートの基底クラス
+except ImportError:                                 # bluepyが無い時(ベンチ等)
+    btle = None                                     # btleは使用不可
+    DefaultDelegate = object                        # 基底クラスをobjectに
+from ble_metrics import Counter                     # 計測値を組み込む
+
+hci_resets = Counter('ble_hci_resets_total', 'Number of HCI adapter resets.')
+
+class ScanDelegate(DefaultDelegate):                # クラスScanDelegateの定義
+    def __init__(self, callback):                   # コンストラクタ作成
+        DefaultDelegate.__init__(self)              # 基底クラスの初期化
+        self.callback = callback                    # 受信時に呼び出す関数
+        self.events = 0                             # 受信アドバタイジング数
+    def handleDiscovery(self, dev, isNewDev, isNewData):    # 受信時の処理
+        self.events += 1                            # 受信数を加算
+        self.callback(dev)                          # コールバック関数を実行
+
+class StreamScanner:                                # クラスStreamScannerの定義
+    def __init__(self, callback, iface=0, scanner=None, passive=False):
+        if scanner is None:                         # scanner未指定の時
+            scanner = btle.Scanner(iface)           # インスタンスscannerを生成
+        self.delegate = ScanDelegate(callback)      # デリゲートを生成
+        self.scanner = scanner.withDelegate(self.delegate)  # デリゲートを登録
+        self.passive = passive                      # パッシブスキャン設定
+        self.running = False                        # スキャン中フラグ
+    def start(self):                                # スキャン開始用メソッド
+        self.scanner.clear()                        # 受信済みデバイスを消去
+        self.scanner.start(passive=self.passive)    # スキャンを開始
+        self.running = True                         # スキャン中に設定
+    def process(self, timeout):                     # 受信処理用メソッド
+        if not self.running:                        # スキャン停止中の時
+            self.start()                            # スキャンを開始
+        self.scanner.process(timeout)               # timeout秒間だけ受信処理
+        self.scanner.clear()                        # ScanEntryの蓄積を防止
+        return self.delegate.events                 # 累計受信数を応答
+    def abort(self):                                # 異常発生時の中断用メソッド
+        self.running = False                        # 停止中に設定
+        try:                                        # 例外処理の監視を開始
+            self.scanner.stop()                     # スキャンを停止
+        except Exception:                           # 停止できなかった時
+            pass                                    # 次回のstartで再開する
+    def stop(self):                                 # スキャン停止用メソッド
+        if self.running:                            # スキャン中の時
+            self.running = False                    # 停止中に設定
+            self.scanner.stop()                     # スキャンを停止
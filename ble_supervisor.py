@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Supervisor ble_supervisor.py
+# スキャンの異常(例外や受信の途絶え)を検出し、段階的に復旧します。
+#
+#   StreamScanner と同じ process() / stop() を持ち、異常時は例外を外へ出さずに
+#   次の順で復旧を試みます。同じ障害の間は、失敗するたびに次の段階へ進み、
+#   試行の間隔を backoff 秒から倍々に(max_backoff 秒まで)延ばします。
+#       restart   スキャンを停止して再開
+#       reset     アダプタを再起動(hciconfig hciN down / up)
+#       recreate  btle.Scanner を作り直す(bluepy-helper も起動し直す)
+#   試行の間の待ちやアダプタの再起動(down/up)の完了は、process() の中で
+#   待ち続けずに次の試行の時刻として記録し、その時刻までは timeout 秒以内で
+#   戻ります(ble_scheduler.py の他のタスクを止めません)。
+#   bluepy-helper が終了したまま stall_seconds 秒間受信が無い時も、異常として
+#   扱います。helper が動作中でも quiet_seconds 秒間受信が無い時は、アダプタ
+#   が応答しなくなったとみなして復旧を試みます。夜間の無人の部屋などと区別
+#   するため quiet_seconds は長めにし、復旧の各段階も quiet_seconds ごとに
+#   進めます。障害の開始から復旧までの時間を outages に記録します。
+#
+#   scanner を指定した時(記録の再生など)は、アダプタの再起動を行いません。
+#
+#   FakeAdapter は障害を注入できる btle.Scanner 相当の実装で、実機が無くても
+#   復旧の動作を確認できます(本ファイルを直接実行すると試験します)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_supervisor import Supervisor
+#   scanner = Supervisor(found)                     # StreamScannerの代わりに使用
+#   while True:
+#       scanner.process(interval)                   # 異常時は内部で復旧
+#   print(scanner.stats())                          # 復旧の回数と停止時間
+#
+#【実行方法】
+#   障害を注入した FakeAdapter で復旧を試験します(root権限は不要)
+#       ./ble_supervisor.py
+
+stall_seconds = 60                                  # helper停止中に受信が無ければ異常(秒)
+quiet_seconds = 600                                 # helper動作中に受信が無ければ異常(秒)
+backoff = 0.5                                       # 2回目の復旧までの待ち(秒)
+max_backoff = 30.0                                  # 復旧の待ち時間の上限(秒)
+reset_wait = 0.5                                    # アダプタのdown/upの間隔(秒)
+steps = ('restart', 'reset', 'recreate')            # 復旧の段階
+
+from collections import deque                       # 両端キューを組み込む
+from time import monotonic, sleep                   # 時間関連を組み込む
+from ble_stream import StreamScanner, btle, hci_resets  # 連続スキャンを組み込む
+from ble_metrics import Counter, Histogram          # 計測値を組み込む
+from ble_record import ReplayEntry                  # ScanEntry相当を組み込む
+import subprocess                                   # 外部コマンドを組み込む
+
+recoveries = Counter('ble_scanner_recoveries_total', 'Scanner recovery attempts by step.',
+                     ('step',))
+outage_seconds = Histogram('ble_scanner_outage_seconds', 'Duration of scanner outages.',
+                           buckets=(1, 2, 5, 10, 30, 60, 300, 900, 3600))
+
+def reset_adapter(iface=0, wait=reset_wait):        # アダプタを再起動(完了を待たない)
+    hci = 'hci%d' % iface                           # アダプタ名
+    return subprocess.Popen(['sh', '-c', 'hciconfig %s down; sleep %s; hciconfig %s up'
+                             % (hci, wait, hci)])   # 完了はpoll()で確認
+
+def helper_alive(scanner):                          # bluepy-helperの動作確認
+    if not hasattr(scanner, '_helper'):             # bluepy以外(再生など)の時
+        return True                                 # 動作中とみなす
+    helper = scanner._helper                        # helperのプロセス
+    return helper is not None and helper.poll() is None
+
+def release(scanner):                               # bluepy-helperを終了
+    stop = getattr(scanner, '_stopHelper', None)    # bluepyのhelper終了処理
+    if stop is not None:                            # bluepyの時
+        stop()                                      # helperを終了
+
+class Supervisor:                                   # クラスSupervisorの定義
+    def __init__(self, callback, iface=0, scanner=None, passive=False, factory=None,
+                 reset=None, stall_seconds=stall_seconds, quiet_seconds=quiet_seconds,
+                 backoff=backoff, max_backoff=max_backoff, clock=monotonic, sleep=sleep):
+        if factory is None:                         # 作り直す方法が未指定の時
+            if scanner is not None:                 # scanner指定(再生など)の時
+                factory = lambda: scanner           # 同じものを使う
+            else:                                   # 実機の時
+                factory = lambda: btle.Scanner(iface)   # 新しいScannerを生成
+        self.callback = callback                    # 受信時に呼び出す関数
+        self.passive = passive                      # パッシブスキャン設定
+        self.factory = factory                      # Scannerの生成関数
+        if reset is None:                           # 再起動の方法が未指定の時
+            reset = (lambda: None) if scanner else (lambda: reset_adapter(iface))
+        self.reset = reset                          # アダプタの再起動(再生時は無し)
+        self.stall_seconds = stall_seconds          # 途絶えと判断する時間
+        self.quiet_seconds = quiet_seconds          # 途絶えと判断する時間(helper動作中)
+        self.backoff = backoff                      # 2回目の復旧までの待ち
+        self.max_backoff = max_backoff              # 待ち時間の上限
+        self.clock = clock                          # 時刻取得関数
+        self.sleep = sleep                          # 待機関数
+        self.stream = StreamScanner(callback, scanner=factory(), passive=passive)
+        self.events = 0                             # 累計受信数(作り直しても継続)
+        self.heard = clock()                        # 最後に受信した時刻
+        self.outage = None                          # 障害中の[開始時刻,原因,試行数]
+        self.retry_at = 0.0                         # 次の復旧の試行の時刻
+        self.tried = 0.0                            # 最後に復旧を試行した時刻
+        self.quiet = False                          # helper動作中の途絶えによる障害
+        self.pending = None                         # 実行中のアダプタの再起動
+        self.outages = deque(maxlen=100)            # 過去の障害(開始,時間,原因,試行)
+        self.counts = dict.fromkeys(steps, 0)       # 段階ごとの復旧の試行数
+        self.downtime = 0.0                         # 停止時間の累計(秒)
+    @property
+    def delegate(self):                             # 受信数の参照用(互換)
+        return self.stream.delegate                 # 現在のデリゲート
+    def process(self, timeout):                     # 受信処理用メソッド
+        start = self.clock()                        # 呼び出し時刻
+        if self.outage is not None and (start < self.retry_at or self.resetting()):
+            self.sleep(min(timeout, max(self.retry_at - start, 0.1)))   # 試行の時刻まで
+            return self.events                      # 累計受信数を応答
+        before = self.stream.delegate.events        # 受信数(呼び出し前)
+        try:                                        # 例外処理の監視を開始
+            self.stream.process(timeout)            # timeout秒間だけ受信処理
+        except (EOFError, KeyboardInterrupt):       # 再生の終了や中断の時
+            raise                                   # そのまま外へ
+        except Exception as e:                      # スキャンの異常時
+            self.recover('%s: %s' % (type(e).__name__, e), start)
+            return self.events                      # 累計受信数を応答
+        n = self.stream.delegate.events - before    # 今回の受信数
+        self.events += n                            # 累計に加算
+        now = self.clock()                          # 現在の時刻
+        if n > 0:                                   # 受信があった時
+            self.heard = now                        # 最後に受信した時刻
+        alive = helper_alive(self.stream.scanner)   # bluepy-helperの動作確認
+        if self.outage is not None and (n > 0 or (alive and not self.quiet)):
+            self.recovered()                        # 停止時間を記録
+        elif n == 0 and not alive and self.stall_seconds and (
+                self.outage is not None or now - self.heard >= self.stall_seconds):
+            self.recover('stall: bluepy-helper exited, no advertisements for %.0f s'
+                         % (now - self.heard), self.heard)  # 最後の受信から障害とする
+        elif n == 0 and self.quiet_seconds and hasattr(self.stream.scanner, '_helper') and \
+                now - max(self.heard, self.tried) >= self.quiet_seconds:
+            self.recover('stall: no advertisements for %.0f s' % (now - self.heard),
+                         self.heard, quiet=True)    # helper動作中の途絶え
+        return self.events                          # 累計受信数を応答
+    def resetting(self):                            # アダプタの再起動中の確認
+        if self.pending is not None and self.pending.poll() is not None:
+            self.pending = None                     # 再起動の完了
+        return self.pending is not None             # 再起動中ならTrue
+    def recover(self, reason, start, quiet=False):  # 段階的な復旧
+        if self.outage is None:                     # 新しい障害の時
+            self.outage = [start, reason, 0]        # 障害の開始を記録
+            self.quiet = quiet                      # 受信の再開まで復旧としない
+            print('Scanner ERROR', reason)          # エラー内容を表示
+        n = self.outage[2]                          # この障害での試行数
+        self.outage[2] += 1                         # 試行数を加算
+        step = steps[min(n, len(steps) - 1)]        # 試行数に応じた段階
+        print('Scanner recovery:', step)            # 復旧の段階を表示
+        self.counts[step] += 1                      # 試行数を加算
+        recoveries.labels(step).inc()               # 試行数を加算(/metrics)
+        self.stream.abort()                         # スキャンを中断
+        try:                                        # 例外処理の監視を開始
+            if step == 'reset':                     # アダプタを再起動する時
+                hci_resets.inc()                    # HCIの再起動数を加算
+                self.pending = self.reset()         # アダプタを再起動(完了を待たない)
+            elif step == 'recreate':                # Scannerを作り直す時
+                try:                                # 例外処理の監視を開始
+                    release(self.stream.scanner)    # 古いhelperを終了
+                finally:                            # 終了できなくても
+                    self.stream = StreamScanner(self.callback, scanner=self.factory(),
+                                                passive=self.passive)
+        except Exception as e:                      # 復旧に失敗した時
+            print('Scanner recovery ERROR', e)      # エラー内容を表示
+        self.tried = self.clock()                   # 試行した時刻
+        self.retry_at = self.tried + min(self.backoff * 2 ** n, self.max_backoff)
+    def recovered(self):                            # 障害からの復旧を記録
+        start, reason, tries = self.outage          # 障害の内容
+        duration = self.clock() - start             # 停止時間(秒)
+        self.outages.append((start, round(duration, 3), reason, tries))
+        self.downtime += duration                   # 停止時間の累計
+        outage_seconds.observe(duration)            # 停止時間を記録(/metrics)
+        print('Scanner recovered in %.1f s after %d tries' % (duration, tries))
+        self.outage = None                          # 障害の終了
+    def stop(self):                                 # スキャン停止用メソッド
+        self.stream.stop()                          # スキャンを停止
+    def stats(self):                                # 状態の取得
+        stats = dict(self.counts)                   # 段階ごとの試行数
+        stats.update({'outages': len(self.outages), 'down': self.outage is not None,
+                      'downtime': round(self.downtime, 3),
+                      'last_outage': self.outages[-1][1] if self.outages else None})
+        return stats                                # 状態を応答
+
+class FakeAdapter:                                  # 障害を注入できるアダプタ
+    def __init__(self, devices=20, rate=50):        # コンストラクタ作成
+        self.devices = devices                      # 周囲のデバイス数
+        self.rate = rate                            # 1秒あたりの受信数
+        self.now = 0.0                              # 仮想の時刻(秒)
+        self.faults = list()                        # 予定の障害(時刻,種類,直す段階)
+        self.fault = None                           # 発生中の障害(種類,直す段階)
+        self.generation = 0                         # Scannerを作った回数
+        self.calls = 0                              # 受信処理の回数
+        self.quiets = list()                        # 無人の時間帯(開始,終了)
+        self.resetting = 0.0                        # 再起動の完了時刻
+    def inject(self, at, kind='error', fix='restart'):  # 障害を予定
+        self.faults.append((at, kind, fix))         # kind: error, stall, wedge
+        self.faults.sort()                          # 時刻順に並べる
+    def quiet(self, start, end):                    # 無人の時間帯を予定(障害ではない)
+        self.quiets.append((start, end))            # 受信が無い時間帯
+    def clock(self):                                # 仮想の時刻
+        return self.now                             # 時刻を応答
+    def sleep(self, seconds):                       # 仮想の待機
+        self.now += seconds                         # 時刻を進める
+    def reset(self):                                # アダプタの再起動(完了を待たない)
+        self.resetting = self.now + reset_wait      # down/upの完了時刻
+        return self                                 # poll()で完了を確認
+    def poll(self):                                 # 再起動の完了の確認(Popen相当)
+        if self.now < self.resetting:               # down/upの途中の時
+            return None                             # 実行中
+        if self.fault and self.fault[1] in ('restart', 'reset'):
+            self.fault = None                       # 障害を解消
+        return 0                                    # 完了
+    def scanner(self):                              # btle.Scanner相当を生成
+        self.generation += 1                        # 作った回数を加算
+        if self.fault:                              # 障害中の時
+            self.fault = None                       # 作り直しで解消
+        return FakeScanner(self, self.generation)   # 新しいScanner
+
+class FakeScanner:                                  # btle.Scanner相当のクラス
+    def __init__(self, adapter, generation):        # コンストラクタ作成
+        self.adapter = adapter                      # アダプタ
+        self.generation = generation                # 何番目のScannerか
+        self.delegate = None                        # デリゲート
+        self._helper = None                         # bluepy-helper相当(開始時に起動)
+    def withDelegate(self, delegate):               # デリゲートを登録
+        self.delegate = delegate                    # デリゲートを保持
+        return self                                 # 自分を応答
+    def clear(self):                                # 受信済みデバイスを消去
+        pass                                        # 何もしない
+    def start(self, passive=False):                 # スキャンを開始
+        a = self.adapter                            # アダプタ
+        if a.fault and a.fault[1] == 'restart':     # 再開で直る障害の時
+            a.fault = None                          # 障害を解消
+        if self.generation < a.generation:          # 古いScannerの時
+            raise RuntimeError('stale scanner')     # 使用できない
+        self._helper = self                         # helperを起動
+    def poll(self):                                 # helperの終了の確認(Popen相当)
+        a = self.adapter                            # アダプタ
+        return 1 if a.fault and a.fault[0] == 'stall' else None
+    def stop(self):                                 # スキャンを停止
+        self._stopHelper()                          # helperを終了
+    def _stopHelper(self):                          # helperを終了
+        self._helper = None                         # 終了
+    def process(self, timeout):                     # timeout秒間だけ受信処理
+        a = self.adapter                            # アダプタ
+        a.calls += 1                                # 受信処理の回数を加算
+        while a.faults and a.faults[0][0] <= a.now: # 予定の時刻になった障害
+            at, kind, fix = a.faults.pop(0)         # 障害を取り出す
+            a.fault = (kind, fix)                   # 障害を発生
+        a.now += timeout                            # 仮想の時刻を進める
+        if a.fault and a.fault[0] == 'error':       # 例外の障害の時
+            raise RuntimeError('Failed to execute management command (injected)')
+        if a.fault or any(s <= a.now < e for s, e in a.quiets):
+            return                                  # 何も受信しない
+        for i in range(int(a.rate * timeout)):      # 受信数だけ
+            k = (a.calls * 7 + i) % a.devices       # デバイスの番号
+            self.delegate.handleDiscovery(ReplayEntry('c0:00:00:00:00:%02x' % k, 'random',
+                                          -60, False, b''), True, True)
+
+if __name__ == '__main__':                          # 直接実行された時
+    adapter = FakeAdapter()                         # 障害を注入できるアダプタ
+    adapter.inject(60, 'error', 'restart')          # 60秒後: 再開で直る例外
+    adapter.inject(300, 'error', 'reset')           # 300秒後: 再起動で直る例外
+    adapter.inject(600, 'stall', 'reset')           # 600秒後: 再起動で直る途絶え
+    adapter.inject(1200, 'error', 'recreate')       # 1200秒後: 作り直しで直る例外
+    adapter.inject(900, 'wedge', 'reset')           # 900秒後: helper動作中で受信0
+    adapter.quiet(1400, 1500)                       # 1400～1500秒: 無人(障害ではない)
+    scanner = Supervisor(lambda dev: None, factory=adapter.scanner, reset=adapter.reset,
+                         stall_seconds=10, quiet_seconds=120, clock=adapter.clock,
+                         sleep=adapter.sleep)
+    while adapter.now < 1800:                       # 仮想の30分間
+        scanner.process(1.0)                        # 受信処理
+    for start, duration, reason, tries in scanner.outages:  # 各障害について
+        print('outage at %6.1f s: %5.1f s, %d tries, %s' % (start, duration, tries, reason))
+    print(scanner.stats())                          # 復旧の回数と停止時間
+
+''' 実行結果の一例
+$ ./ble_supervisor.py | grep -v '^Scanner'
+outage at   60.0 s:   2.5 s, 1 tries, RuntimeError: Failed to execute management command (injected)
+outage at  300.5 s:   4.5 s, 2 tries, RuntimeError: Failed to execute management command (injected)
+outage at  600.0 s:  13.5 s, 2 tries, stall: bluepy-helper exited, no advertisements for 10 s
+outage at  900.5 s: 242.5 s, 2 tries, stall: no advertisements for 120 s
+outage at 1200.0 s:   7.5 s, 3 tries, RuntimeError: Failed to execute management command (injected)
+{'restart': 5, 'reset': 4, 'recreate': 1, 'outages': 5, 'down': False, 'downtime': 270.5, 'last_outage': 7.5}
+'''
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Synth ble_synth.py
+# 会場規模のアドバタイジング列を合成します(実機の無線は使いません)。
+#
+#   デバイス数、アドレスの変更周期(ランダムアドレスのローテーション)、
+#   送信間隔、RSSIの分布を指定し、時刻順の (経過時間, デバイス) の列を
+#   逐次生成します。列は ble_record.ReplayScanner で btle.Scanner の代わりに
+#   再生できるため、ble_pipeline.py の処理をそのまま計測できます。
+#   名前付きの機器(約1割)は固定のランダムアドレス(static)で、アドレスを
+#   変更しません。
+#   scan_response=True の時は、アクティブスキャンと同様にスマートフォンと
+#   名前付きの機器がスキャン応答も返し、rawData が アドバタイジングとスキャン
+#   応答で交互に変わります(scanData は bluepy と同じく両方をまとめた内容)。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_synth import Workload
+#   from ble_record import ReplayScanner
+#   workload = Workload(devices=1000, rotation=900, duration=600)
+#   scanner = ReplayScanner(workload.records(), speed=0)    # 最速で再生
+#   Pipeline(sinks, scanner=scanner, clock=scanner.clock).run()
+
+devices = 1000                                      # デバイス数
+rotation = 900                                      # アドレスの変更周期(秒)
+adv_interval = (0.1, 1.0)                           # 送信間隔の範囲(秒)
+rssi = (-75, 10)                                    # RSSIの平均と標準偏差
+noise = 4                                           # 受信ごとのRSSIのゆらぎ
+duration = 300                                      # 合成する時間(秒)
+
+from ble_record import ReplayEntry                  # ScanEntry相当を組み込む
+from heapq import heapify, heapreplace              # 優先度付きキューを組み込む
+import random                                       # 乱数を組み込む
+
+def randbytes(rnd, n):                              # nバイトの乱数(Random.randbytesは3.9以降)
+    return rnd.getrandbits(8 * n).to_bytes(n, 'little')
+
+def random_addr(rnd, static=False):                 # ランダムアドレスの生成
+    b = bytearray(randbytes(rnd, 6))                # 6バイトの乱数
+    b[0] = (b[0] & 0x3f) | (0xc0 if static else 0x40)   # 上位2ビットは11か01
+    return ':'.join('%02x' % x for x in b)          # 文字列に変換
+
+def random_ad(rnd, kind):                           # 種類ごとのADの生成
+    if kind == 0:                                   # 接触確認アプリ(COCOA等)
+        return bytes.fromhex('03036ffd17166ffd') + randbytes(rnd, 20)
+    if kind == 1:                                   # スマートフォン(Apple)
+        return bytes.fromhex('02011a020a0c0bff4c001006') + randbytes(rnd, 6)
+    name = b'SENSOR-%04d' % rnd.randrange(10000)    # 名前付きの機器
+    return bytes.fromhex('020106') + bytes([len(name) + 1, 9]) + name
+
+scan_responses = {1: bytes.fromhex('03030a18'),     # スマートフォン: サービスUUID
+                  2: bytes.fromhex('051206000c00')} # 名前付き: 接続間隔
+
+def scan_data(*raws):                               # ADをタイプ→データにまとめる
+    data = dict()                                   # bluepyのscanData相当
+    for raw in raws:                                # 各パケットについて
+        i = 0                                       # 読み出し位置
+        while i + 1 < len(raw) and raw[i]:          # ADが残っている間
+            data[raw[i + 1]] = raw[i + 2:i + 1 + raw[i]]    # 同じタイプは後のもの
+            i += 1 + raw[i]                         # 次のADへ
+    return data                                     # まとめた内容
+
+class Workload:                                     # クラスWorkloadの定義
+    def __init__(self, devices=devices, rotation=rotation, adv_interval=adv_interval,
+                 rssi=rssi, noise=noise, duration=duration, origin=0.0, seed=1,
+                 scan_response=False):
+        self.devices = devices                      # デバイス数
+        self.rotation = rotation                    # アドレスの変更周期(秒)
+        self.adv_interval = adv_interval            # 送信間隔の範囲(秒)
+        self.rssi = rssi                            # RSSIの平均と標準偏差
+        self.noise = noise                          # 受信ごとのゆらぎ
+        self.duration = duration                    # 合成する時間(秒)
+        self.origin = origin                        # 開始時刻(再生時のclock)
+        self.seed = seed                            # 乱数の種
+        self.scan_response = scan_response          # スキャン応答も合成する
+    def records(self):                              # 時刻順の列を逐次生成
+        yield self.origin                           # 最初に開始時刻を応答
+        for t, i, dev in self.generate():           # 各送信について
+            yield (t, dev)                          # (経過時間, デバイス)
+    def generate(self):                             # (時刻, 番号, デバイス)を生成
+        rnd = random.Random(self.seed)              # 再現可能な乱数
+        state = list()                              # デバイスごとの状態
+        heap = list()                               # (次の送信時刻, 番号)
+        for i in range(self.devices):               # 各デバイスについて
+            adv = rnd.uniform(*self.adv_interval)   # 送信間隔(秒)
+            level = rnd.gauss(*self.rssi)           # 平均的な受信強度
+            kind = rnd.choices((0, 1, 2), (6, 3, 1))[0] # ADの種類
+            rotate = rnd.uniform(0, self.rotation) if kind < 2 else float('inf')
+            dev = ReplayEntry(random_addr(rnd, kind == 2), 'random', 0, kind == 1,
+                              random_ad(rnd, kind))
+            state.append([dev, adv, level, kind, rotate, self.merged(dev, kind)])
+            heap.append((rnd.uniform(0, adv), i))   # 最初の送信時刻
+        heapify(heap)                               # 時刻順に並べる
+        gauss, uniform = rnd.gauss, rnd.uniform     # メソッドを変数に保持
+        while heap and heap[0][0] < self.duration:  # 合成する時間内について
+            (t, i) = heap[0]                        # 最も早い送信
+            s = state[i]                            # デバイスの状態
+            dev = s[0]                              # デバイス
+            if t >= s[4]:                           # アドレスの変更時刻の時
+                dev = ReplayEntry(random_addr(rnd), 'random', 0, dev.connectable,
+                                  random_ad(rnd, s[3]))
+                s[0] = dev                          # 新しいアドレスに変更
+                s[4] += self.rotation               # 次の変更時刻
+                s[5] = self.merged(dev, s[3])       # まとめた内容
+            r = max(-100, min(-20, int(gauss(s[2], self.noise))))   # 今回の受信強度
+            heapreplace(heap, (t + s[1] + uniform(0, 0.01), i)) # 次の送信(advDelay付き)
+            yield (t, i, ReplayEntry(dev.addr, dev.addrType, r, dev.connectable,
+                                     dev.rawData, s[5]))
+            if s[5] is not None and s[3] in scan_responses: # スキャン応答を返す時
+                yield (t, i, ReplayEntry(dev.addr, dev.addrType, r, dev.connectable,
+                                         scan_responses[s[3]], s[5]))
+    def merged(self, dev, kind):                    # bluepyのscanData相当
+        if not self.scan_response:                  # スキャン応答が無い時
+            return None                             # rawDataのみ
+        return scan_data(dev.rawData, scan_responses.get(kind, b''))
+    def truth(self, span=30, target_rssi=-999, devices=False):
+        windows = dict()                            # 窓番号ごとのアドレス集合
+        for t, i, dev in self.generate():           # 各送信について
+            if dev.rssi >= target_rssi:             # 受信強度が閾値以上の時
+                key = i if devices else dev.addr    # 実デバイス数かアドレス数か
+                windows.setdefault(int(t // span), set()).add(key)
+        return [len(windows[k]) for k in sorted(windows)]
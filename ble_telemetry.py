@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Telemetry ble_telemetry.py
+# センサ値とデバイス数を、固定長のバイナリ形式でまとめてUDP送信します。
+#
+#   テキスト形式(UdpSink)は集計ごと(30秒)に1行だけ送り、順番や欠落が
+#   分かりません。本形式は動作間隔ごとの値(サンプル)を貯め、集計ごとに
+#   複数のサンプルを1つのパケットで送ります。パケットには形式の版、ノード名、
+#   連番(seq)を、サンプルには時刻を付けるため、受信側で欠落と順序の入れ替わり
+#   を検出できます。アドレスのスケッチ(ble_hll.py)も同じパケットに入れます。
+#   送信先にマルチキャストのアドレス(239.0.0.0/8 など)を指定すると、
+#   ネットワーク全体へのブロードキャストの代わりに、参加した受信側にだけ
+#   届きます(既定は 239.255.24.1、ルータを越えないよう TTL=1)。
+#
+#   パケットの形式(ネットワークバイトオーダー)
+#       ヘッダ  11バイト  'BT', 版(1), フラグ, 名前の長さ, 連番(4バイト), サンプル数
+#       名前    可変      ノード名(UTF-8、最大255バイト)
+#       サンプル 12バイト×サンプル数
+#               時刻(UNIX秒, 4バイト), 温度(0.01℃, 符号付き2バイト),
+#               CO2(ppm, 2バイト), TVOC(ppb, 2バイト), カウンタ(2バイト)
+#               値が無い時は 0x8000(温度)/ 0xffff(その他)
+#       スケッチ フラグ sketch の時のみ、時間窓(秒, 2バイト), 精度p(1バイト),
+#               圧縮したレジスタ(残り全て)
+#
+#   ble_collector.py は、テキスト形式とバイナリ形式のどちらも受信できます。
+#
+#                                               Copyright (c) 2021 Wataru KUNINO
+################################################################################
+
+#【使用方法】
+#   from ble_telemetry import TelemetrySink
+#   sinks = [TelemetrySink('e_co2_3')]              # ble_pipeline.py の出力先
+#
+#   受信側(参照用のデコーダ)
+#   from ble_telemetry import Decoder
+#   decoder = Decoder()
+#   packet = decoder.feed(data)                     # 欠落数などは decoder.stats()
+#   for t, temp, co2, tvoc, counter in packet['samples']: ...
+
+telemetry_to = '239.255.24.1'                       # マルチキャストの送信先
+telemetry_port = 1024                               # UDP送信ポート番号
+device_s = 'e_co2_3'                                # デバイス識別名
+max_samples = 100                                   # 1パケットのサンプル数の上限
+multicast_ttl = 1                                   # マルチキャストの到達範囲
+reorder = 100                                       # 遅れとみなす連番の戻りの上限
+
+from ble_sinks import Sink                          # 出力先の基底クラス
+from ble_delivery import post_seconds, post_failures    # 計測値を組み込む
+from ble_hll import HyperLogLog                     # 近似カウントを組み込む
+from time import time, monotonic                    # 時間取得を組み込む
+import ipaddress                                    # IPアドレスの判定を組み込む
+import socket                                       # ソケット通信を組み込む
+import struct                                       # バイナリ変換を組み込む
+import zlib                                         # 圧縮を組み込む
+
+magic = b'BT'                                       # パケットの識別子
+version = 1                                         # 形式の版
+SKETCH = 0x01                                       # フラグ: スケッチ付き
+header = struct.Struct('!2sBBBIB')                  # 識別子,版,フラグ,名前長,連番,数
+sample = struct.Struct('!IhHHH')                    # 時刻,温度,CO2,TVOC,カウンタ
+sketch_header = struct.Struct('!HB')                # 時間窓,精度p
+NO_TEMP = -0x8000                                   # 温度が無い時の値
+NO_VALUE = 0xffff                                   # その他の値が無い時の値
+
+def unsigned(value):                                # 2バイトの値へ変換
+    return NO_VALUE if value is None else max(0, min(0xfffe, int(value)))
+
+def to_sample(t, values):                           # 値の辞書をサンプルへ変換
+    temp = values.get('temp')                       # 温度
+    return (int(t), NO_TEMP if temp is None else max(-0x7fff, min(0x7fff, round(temp * 100))),
+            unsigned(values.get('co2')), unsigned(values.get('tvoc')),
+            unsigned(values.get('counter')))
+
+def encode(name, seq, samples, sketch=None, span=0):    # パケットを作成
+    name = name.encode()[:255]                      # ノード名(UTF-8)
+    flags = SKETCH if sketch is not None else 0     # フラグ
+    data = header.pack(magic, version, flags, len(name), seq & 0xffffffff, len(samples))
+    data += name + b''.join(sample.pack(*s) for s in samples)
+    if sketch is not None:                          # スケッチ付きの時
+        data += sketch_header.pack(span, sketch.p) + zlib.compress(bytes(sketch.registers), 9)
+    return data                                     # パケットを応答
+
+def decode(data):                                   # パケットを分解
+    if len(data) < header.size or data[:2] != magic:    # 本形式でない時
+        raise ValueError('not a telemetry packet')
+    m, v, flags, n, seq, count = header.unpack_from(data)
+    if v != version:                                # 版が異なる時
+        raise ValueError('unsupported telemetry version %d' % v)
+    i = header.size + n                             # サンプルの位置
+    end = i + sample.size * count                   # サンプルの終わり
+    if len(data) < end:                             # 長さが足りない時
+        raise ValueError('truncated telemetry packet')
+    samples = [(t, None if temp == NO_TEMP else temp / 100,
+                None if co2 == NO_VALUE else co2, None if tvoc == NO_VALUE else tvoc,
+                None if counter == NO_VALUE else counter)
+               for t, temp, co2, tvoc, counter in sample.iter_unpack(data[i:end])]
+    packet = {'name': data[header.size:i].decode(errors='replace'), 'seq': seq,
+              'samples': samples, 'sketch': None, 'span': 0}
+    if flags & SKETCH:                              # スケッチ付きの時
+        span, p = sketch_header.unpack_from(data, end)  # 時間窓と精度
+        hll = HyperLogLog(p=p)                      # 同じ精度で生成
+        registers = zlib.decompress(data[end + sketch_header.size:])
+        if len(registers) != hll.m:                 # レジスタ数が合わない時
+            raise ValueError('HyperLogLog size mismatch')
+        hll.registers[:] = registers                # レジスタを復元
+        packet['sketch'], packet['span'] = hll, span
+    return packet                                   # 分解結果を応答
+
+class Decoder:                                      # 参照用のデコーダ(欠落の検出付き)
+    def __init__(self):                             # コンストラクタ作成
+        self.last = dict()                          # ノード名→最後の連番
+        self.packets = 0                            # 受信したパケット数
+        self.samples = 0                            # 受信したサンプル数
+        self.lost = 0                               # 欠落したパケット数(推定)
+        self.late = 0                               # 遅れて届いた・重複したパケット数
+        self.errors = 0                             # 分解できなかった数
+    def feed(self, data):                           # 1パケットを分解
+        try:                                        # 例外処理の監視を開始
+            packet = decode(data)                   # パケットを分解
+        except (ValueError, struct.error, zlib.error):  # 形式が不正な時
+            self.errors += 1                        # 分解できなかった数を加算
+            raise                                   # 呼び出し元へ
+        self.packets += 1                           # パケット数を加算
+        self.samples += len(packet['samples'])      # サンプル数を加算
+        seq = packet['seq']                         # 連番
+        last = self.last.get(packet['name'])        # 同じノードの最後の連番
+        ahead = (seq - last) & 0xffffffff if last is not None else 1  # 進んだ数
+        behind = (-ahead) & 0xffffffff              # 戻った数
+        packet['lost'] = 0                          # 直前に欠落したパケット数
+        if seq != 0 and (ahead == 0 or behind <= reorder):  # 重複・遅れて届いた時
+            self.late += 1                          # 遅れた・重複したパケット
+            return packet                           # 最後の連番は更新しない
+        if seq != 0 and ahead <= 0x7fffffff:        # 連番が進んだ時(再起動を除く)
+            packet['lost'] = ahead - 1              # 飛んだ連番の数
+            self.lost += ahead - 1                  # 欠落数を加算
+        self.last[packet['name']] = seq             # 最後の連番を更新
+        return packet                               # 分解結果を応答
+    def stats(self):                                # 状態の取得
+        return {'nodes': len(self.last), 'packets': self.packets, 'samples': self.samples,
+                'lost': self.lost, 'late': self.late, 'errors': self.errors}
+
+def open_socket(to):                                # 送信用のソケットを作成
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # ソケットを作成
+    if ipaddress.ip_address(to).is_multicast:       # マルチキャストの時
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+    else:                                           # ブロードキャスト等の時
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    return sock                                     # ソケットを応答
+
+def join_group(sock, group):                        # マルチキャストの受信に参加
+    mreq = socket.inet_aton(group) + socket.inet_aton('0.0.0.0')
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+
+class TelemetrySink(Sink):                          # バイナリ形式のUDP送信用の出力先
+    def __init__(self, device_s=device_s, to=telemetry_to, port=telemetry_port,
+                 sketch=True, max_samples=max_samples):
+        self.device_s = device_s                    # デバイス識別名
+        self.addr = (to, port)                      # 送信先
+        self.sock = open_socket(to)                 # ソケットを作成
+        self.sketch = sketch                        # スケッチも送信する
+        self.max_samples = max_samples              # 1パケットのサンプル数の上限
+        self.samples = list()                       # 未送信のサンプル
+        self.seq = 0                                # 次の連番
+        self.sent = 0                               # 送信数
+        self.failed = 0                             # 送信失敗数
+        self.bytes = 0                              # 送信したバイト数
+        self.post_seconds = post_seconds.labels('telemetry')    # 送信時間の分布
+        self.post_failures = post_failures.labels('telemetry')  # 送信失敗数
+    def update(self, values):                       # 動作間隔ごとの処理
+        self.samples.append(to_sample(time(), values))  # サンプルを追加
+        if len(self.samples) >= self.max_samples:   # 上限に達した時
+            self.send()                             # スケッチなしで送信
+    def window(self, values):                       # 集計時の処理
+        self.send(self.sketch)                      # 貯めたサンプルを送信
+    def send(self, sketch=False):                   # 1パケットの送信
+        hll = span = None                           # スケッチ
+        if sketch:                                  # スケッチも送信する時
+            span = self.pipeline.MAC.spans[0]       # 最短の時間窓
+            hll = self.pipeline.MAC.sketch(span)    # 時間窓のスケッチ
+        data = encode(self.device_s, self.seq, self.samples, hll, span or 0)
+        self.seq += 1                               # 送信できなくても連番を進める
+        self.samples = list()                       # 未送信のサンプルを消去
+        start = monotonic()                         # 送信の開始時刻
+        try:                                        # 例外処理の監視を開始
+            self.sock.sendto(data, self.addr)       # UDP送信
+            self.sent += 1                          # 送信数を加算
+            self.bytes += len(data)                 # 送信したバイト数を加算
+        except Exception as e:                      # 例外処理発生時
+            print(e)                                # エラー内容を表示
+            self.failed += 1                        # 送信失敗数を加算
+            self.post_failures.inc()                # 送信失敗数を加算(/metrics)
+        self.post_seconds.observe(monotonic() - start)  # 送信時間を記録
+    def stats(self):                                # 状態の取得
+        return {'sent': self.sent, 'failed': self.failed, 'bytes': self.bytes,
+                'pending': len(self.samples)}
+    def close(self):                                # 終了時の処理
+        if self.samples:                            # 未送信のサンプルがある時
+            self.send()                             # 送信
+        self.sock.close()                           # ソケットの切断
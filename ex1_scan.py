@@ -25,23 +25,29 @@
 
 interval = 1.01                                     # 動作間隔(秒)
 
-from bluepy import btle                             # bluepyからbtleを組み込む
 from sys import argv                                # sysから引数取得を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
+from ble_supervisor import Supervisor               # スキャンの監視と復旧を組み込む
+from ble_adcache import AdCache                     # ADの変換結果の保持を組み込む
+
+def found(dev):                                     # アドバタイジング受信時の処理
+    print()                                         # 改行
+    print('Address =',dev.addr, end=', ')           # アドレスを表示
+    print('AddrType =', dev.addrType, end=', ')     # アドレス種別を表示
+    print('RSSI =', str(dev.rssi))                  # 受信強度RSSIを表示
+    for d in ads.scan_data(dev):                    # タプル型変数dに代入
+        print('\t', d[0], d[1], '=', d[2])          # アドバタイズType番号,名,値
 
 if getuser() != 'root':                             # 実行したユーザがroot以外
     print('使用方法: sudo', argv[0])                # 使用方法の表示
     exit()                                          # プログラムの終了
-scanner = btle.Scanner()                            # インスタンスscannerを生成
-while True:                                         # 永久ループ
-    devices = scanner.scan(interval)                # BLEアドバタイジング取得
-    for dev in devices:                             # 発見した各デバイスについて
-        print()                                     # 改行
-        print('Address =',dev.addr, end=', ')       # アドレスを表示
-        print('AddrType =', dev.addrType, end=', ') # アドレス種別を表示
-        print('RSSI =', str(dev.rssi))              # 受信強度RSSIを表示
-        for d in dev.getScanData():                 # タプル型変数dに代入
-            print('\t', d[0], d[1], '=', d[2])      # アドバタイズType番号,名,値
+ads = AdCache()                                     # ADの変換結果を保持
+scanner = Supervisor(found)                         # 異常時は自動で復旧するscanner
+try:                                                # キー入力による中断を監視
+    while True:                                     # 永久ループ
+        scanner.process(interval)                   # 受信ごとにfoundを実行
+except KeyboardInterrupt:                           # キー入力による中断
+    print('\nAD cache', ads.stats())                # キャッシュのヒット率を表示
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd ~/ble_scan
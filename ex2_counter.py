@@ -26,35 +26,20 @@
 
 interval = 1.01                                     # 動作間隔(秒)
 target_rssi = -80                                   # 最低受信強度
-counter = None                                      # BLEビーコン発見数
+count_mode = 'exact'                                # 計数方式(exact:厳密, hll:近似)
 
-from bluepy import btle                             # bluepyからbtleを組み込む
+from ble_pipeline import Pipeline                   # パイプラインを組み込む
+from ble_sinks import PrintSink                     # 表示用の出力先を組み込む
 from sys import argv                                # sysから引数取得を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
-from time import time                               # 時間取得を組み込む
 
 if getuser() != 'root':                             # 実行したユーザがroot以外
     print('使用方法: sudo', argv[0])                # 使用方法の表示
     exit()                                          # プログラムの終了
 
-time_prev = time()                                  # 現在の時間を変数に保持
-MAC = list()                                        # アドレス保存用の配列変数
-scanner = btle.Scanner()                            # インスタンスscannerを生成
-while True:                                         # 永久ループ
-    devices = scanner.scan(interval)                # BLEアドバタイジング取得
-    for dev in devices:                             # 発見した各デバイスについて
-        if dev.rssi < target_rssi:                  # 受信強度が-80より小さい時
-            continue                                # forループの先頭に戻る
-        if dev.addr not in MAC:                     # アドレスが配列内に無い時
-            MAC.append(dev.addr)                    # 配列変数にアドレスを追加
-        print(len(MAC), 'Devices found', end=', ')  # 発見済みデバイス数を表示
-        print(dev.addr, end=', ')                   # アドレスを表示
-        print('RSSI=' + str(dev.rssi))              # 受信強度RSSIを表示
-    if time_prev + 30 < time():                     # 30秒以上経過した時
-        counter = len(MAC)                          # 発見済みデバイス数を保持
-        print(counter, 'Counts/30seconds')          # カウンタ値(30秒あたり)表示
-        MAC = list()                                # アドレスを廃棄
-        time_prev = time()                          # 現在の時間を変数に保持
+sinks = [PrintSink(verbose=True)]                   # 受信ごとに表示する出力先
+pipeline = Pipeline(sinks, target_rssi, interval, count_mode)
+pipeline.run()                                      # 永久ループ
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd ~/ble_scan
@@ -19,55 +19,30 @@
 #   実行するときは sudoを付与してください
 #       sudo ./ex3_server.py
 #
+#   過去の値はJSON形式で取得できます(ble_history.py)
+#       curl 'http://192.168.1.5/history?name=counter&res=60&since=3600'
+#
 #【参考文献】
 #   本プログラムを作成するにあたり下記を参考にしました
 #   https://ianharvey.github.io/bluepy-doc/scanner.html
 
 interval = 1.01                                     # 動作間隔(秒)
 target_rssi = -80                                   # 最低受信強度
-counter = None                                      # BLEビーコン発見数
+count_mode = 'exact'                                # 計数方式(exact:厳密, hll:近似)
 
-from wsgiref.simple_server import make_server       # WSGIサーバ
-from bluepy import btle                             # bluepyからbtleを組み込む
+from ble_pipeline import Pipeline                   # パイプラインを組み込む
+from ble_sinks import PrintSink                     # 表示用の出力先を組み込む
+from ble_httpd import HttpSink                      # HTTPサーバの出力先を組み込む
 from sys import argv                                # sysから引数取得を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
-from time import time                               # 時間取得を組み込む
-import threading                                    # スレッド管理を組み込む
-
-def wsgi_app(environ, start_response):              # HTTPアクセス受信時の処理
-    res = 'counter = ' + str(counter) + '\r\n'      # 応答文を作成
-    print(res, end='')                              # 応答文を表示
-    res = res.encode('utf-8')                       # バイト列へ変換
-    start_response('200 OK', [('Content-type', 'text/plain; charset=utf-8')])
-    return [res]                                    # 応答メッセージを返却
-
-def httpd(port = 80):
-    htserv = make_server('', port, wsgi_app)        # HTTPサーバ実体化
-    print('HTTP port', port)                        # ポート番号を表示
-    htserv.serve_forever()                          # HTTPサーバを起動
 
 if getuser() != 'root':                             # 実行したユーザがroot以外
     print('使用方法: sudo', argv[0])                # 使用方法の表示
     exit()                                          # プログラムの終了
 
-time_prev = time()                                  # 現在の時間を変数に保持
-MAC = list()                                        # アドレス保存用の配列変数
-scanner = btle.Scanner()                            # インスタンスscannerを生成
-thread = threading.Thread(target=httpd, daemon=True)# スレッドhttpdの実体化
-thread.start()                                      # スレッドhttpdの起動
-while thread.is_alive:                              # 永久ループ(httpd動作中)
-    devices = scanner.scan(interval)                # BLEアドバタイジング取得
-    for dev in devices:                             # 発見した各デバイスについて
-        if dev.rssi < target_rssi:                  # 受信強度が-80より小さい時
-            continue                                # forループの先頭に戻る
-        if dev.addr not in MAC:                     # アドレスが配列内に無い時
-            MAC.append(dev.addr)                    # 配列変数にアドレスを追加
-            print(len(MAC), 'Devices found')        # 発見済みデバイス数を表示
-    if time_prev + 30 < time():                     # 30秒以上経過した時
-        counter = len(MAC)                          # 発見済みデバイス数を保持
-        print(counter, 'Counts/30seconds')          # カウンタ値(30秒あたり)表示
-        MAC = list()                                # アドレスを廃棄
-        time_prev = time()                          # 現在の時間を変数に保持
+sinks = [PrintSink(), HttpSink(80)]                 # 表示とHTTPサーバ(ポート80)
+pipeline = Pipeline(sinks, target_rssi, interval, count_mode)
+pipeline.run()                                      # 永久ループ
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd ~/ble_scan
@@ -40,48 +40,20 @@ line_token='xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
 
 interval = 1.01                                     # 動作間隔(秒)
 target_rssi = -80                                   # 最低受信強度
-counter = None                                      # BLEビーコン発見数
 alart_n = 5                                         # LINE送信閾値
 
-from bluepy import btle                             # bluepyからbtleを組み込む
+from ble_pipeline import Pipeline                   # パイプラインを組み込む
+from ble_sinks import PrintSink, LineSink           # 表示とLINEの出力先
 from sys import argv                                # sysから引数取得を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
-from time import time                               # 時間取得を組み込む
-import urllib.request                               # HTTP通信を組み込む
-import json                                         # JSON変換を組み込む
-
-url_s = 'https://notify-api.line.me/api/notify'     # アクセス先
-head = {'Authorization':'Bearer ' + line_token,
-             'Content-Type':'application/x-www-form-urlencoded; charset=UTF-8'};
 
 if getuser() != 'root':                             # 実行したユーザがroot以外
     print('使用方法: sudo', argv[0])                # 使用方法の表示
     exit()                                          # プログラムの終了
 
-time_prev = time()                                  # 現在の時間を変数に保持
-MAC = list()                                        # アドレス保存用の配列変数
-scanner = btle.Scanner()                            # インスタンスscannerを生成
-while True:                                         # 永久ループ
-    devices = scanner.scan(interval)                # BLEアドバタイジング取得
-    for dev in devices:                             # 発見した各デバイスについて
-        if dev.rssi < target_rssi:                  # 受信強度が-80より小さい時
-            continue                                # forループの先頭に戻る
-        if dev.addr not in MAC:                     # アドレスが配列内に無い時
-            MAC.append(dev.addr)                    # 配列変数にアドレスを追加
-            print(len(MAC), 'Devices found')        # 発見済みデバイス数を表示
-    if time_prev + 30 < time():                     # 30秒以上経過した時
-        counter = len(MAC)                          # 発見済みデバイス数を保持
-        print(counter, 'Counts/30seconds')          # カウンタ値(30秒あたり)表示
-        MAC = list()                                # アドレスを廃棄
-        time_prev = time()                          # 現在の時間を変数に保持
-        if counter >= alart_n:                      # カウンタ値が5以上のとき
-            body = 'message=密集度は ' + str(counter) + ' です。'
-            print(body)                             # メッセージを表示
-            post = urllib.request.Request(url_s, body.encode(), head)
-            try:                                    # 例外処理の監視を開始
-                urllib.request.urlopen(post)        # HTTPアクセスを実行
-            except Exception as e:                  # 例外処理発生時
-                print(e,url_s)                      # エラー内容と変数url_s表示
+sinks = [PrintSink(), LineSink(line_token, alart_n)] # 表示とLINE送信
+pipeline = Pipeline(sinks, target_rssi, interval)   # パイプラインを生成
+pipeline.run()                                      # 永久ループ
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd ~/ble_scan
@@ -26,6 +26,9 @@
 #   実行するときは sudoを付与してください
 #       sudo ./ex6_co2.py
 #
+#   過去の値はJSON形式で取得できます(ble_history.py)
+#       curl 'http://192.168.1.5/history?name=co2&name=tvoc&res=900&since=86400'
+#
 #【参考文献】
 #   本プログラムを作成するにあたり下記を参考にしました
 #   https://ianharvey.github.io/bluepy-doc/scanner.html
@@ -33,78 +36,26 @@
 interval = 1.01                                     # 動作間隔(秒)
 target_rssi = -80                                   # 最低受信強度
 sgp30 = 0x58                                        # センサSGP30のI2Cアドレス
-counter = None                                      # BLEビーコン発見数
-co2 = None                                          # 推定CO2濃度
-tvoc = None                                         # TVOC濃度
 
-from wsgiref.simple_server import make_server       # WSGIサーバ
-from bluepy import btle                             # bluepyからbtleを組み込む
+from ble_pipeline import Pipeline                   # パイプラインを組み込む
+from ble_sinks import PrintSink                     # 表示用の出力先を組み込む
+from ble_httpd import HttpSink                      # HTTPサーバの出力先を組み込む
+from ble_sensors import Sgp30, Sampler, baseline_file # CO2センサSGP30
 from sys import argv                                # sysから引数取得を組み込む
 from getpass import getuser                         # ユーザ取得を組み込む
-from time import time                               # 時間取得を組み込む
-from time import sleep                              # スリープ機能を組み込む
-import threading                                    # スレッド管理を組み込む
-import smbus                                        # SMBus(I2C)管理を組み込む
-
-def wsgi_app(environ, start_response):              # HTTPアクセス受信時の処理
-    res = 'counter = ' + str(counter) + '\r\n'      # 応答文を作成(ビーコン数)
-    res += 'co2 = ' + str(co2) + '\r\n'             # 応答文を作成(推定CO2濃度)
-    res += 'tvoc = ' + str(tvoc) + '\r\n'           # 応答文を作成(TVOC濃度)
-    print(res, end='')                              # 応答文を表示
-    res = res.encode('utf-8')                       # バイト列へ変換
-    start_response('200 OK', [('Content-type', 'text/plain; charset=utf-8')])
-    return [res]                                    # 応答メッセージを返却
-
-def httpd(port = 80):
-    htserv = make_server('', port, wsgi_app)        # HTTPサーバ実体化
-    print('HTTP port', port)                        # ポート番号を表示
-    htserv.serve_forever()                          # HTTPサーバを起動
-
-def word2uint(d1,d2):                               # 2バイトデータを結合します
-    i = d1                                          # 1バイト目を変数iに代入
-    i <<= 8                                         # 8ビット左シフト(上位)
-    i += d2                                         # 2バイト目を変数iに加算
-    return i                                        # 変数iの値を返却
-
-def getCo2():                                       # SGP30からCO2とTVOCを取得
-    i2c.write_byte_data(sgp30, 0x20, 0x08)          # I2C通信で取得コマンド送信
-    sleep(0.014)                                    # 14msの待ち時間処理
-    data=i2c.read_i2c_block_data(sgp30,0x00,6)      # I2C通信で受信
-    if len(data) >= 5:                              # 5バイト以上を受信した時
-        co2 = word2uint(data[0],data[1])            # 推定CO2を変数co2に代入
-        tvoc= word2uint(data[3],data[4])            # TVOC濃度を変数tvocに代入
-    return (co2,tvoc)                               # それぞれを戻り値として返却
 
 if getuser() != 'root':                             # 実行したユーザがroot以外
     print('使用方法: sudo', argv[0])                # 使用方法の表示
     exit()                                          # プログラムの終了
 
-i2c = smbus.SMBus(1)                                # I2Cバス1を実体化
-i2c.write_byte_data(sgp30, 0x20, 0x03)              # SGP30の初期設定を実行
-sleep(1.012)                                        # 1.012秒間の待ち時間処理
-
-time_prev = time()                                  # 現在の時間を変数に保持
-MAC = list()                                        # アドレス保存用の配列変数
-scanner = btle.Scanner()                            # インスタンスscannerを生成
-thread = threading.Thread(target=httpd, daemon=True)# スレッドhttpdの実体化
-thread.start()                                      # スレッドhttpdの起動
-
-while thread.is_alive:                              # 永久ループ(httpd動作中)
-    devices = scanner.scan(interval)                # BLEアドバタイジング取得
-    (co2, tvoc) = getCo2()                          # SGP30からCO2とTVOCを取得
-    for dev in devices:                             # 発見した各デバイスについて
-        if dev.rssi < target_rssi:                  # 受信強度が-80より小さい時
-            continue                                # forループの先頭に戻る
-        if dev.addr not in MAC:                     # アドレスが配列内に無い時
-            MAC.append(dev.addr)                    # 配列変数にアドレスを追加
-            print(len(MAC), 'Devices found')        # 発見済みデバイス数を表示
-    if time_prev + 30 < time():                     # 30秒以上経過した時
-        counter = len(MAC)                          # 発見済みデバイス数を保持
-        print(counter, 'Counts/30sec.', end = ', ') # カウンタ値(30秒あたり)表示
-        print('CO2 = %d ppm' % co2, end = ', ')     # co2を表示
-        print("TVOC= %d ppb" % tvoc)                # tvodを表示
-        MAC = list()                                # アドレスを廃棄
-        time_prev = time()                          # 現在の時間を変数に保持
+try:                                                # 例外処理の監視を開始
+    sensors = [Sampler(Sgp30(addr=sgp30, baseline=baseline_file))] # SGP30の初期設定
+except Exception as e:                              # 例外処理発生時
+    print(e)                                        # エラー内容の表示
+    exit()                                          # プログラムの終了
+sinks = [PrintSink(), HttpSink(80)]                 # 表示とHTTPサーバ(ポート80)
+pipeline = Pipeline(sinks, target_rssi, interval, sensors=sensors)
+pipeline.run()                                      # 永久ループ
 
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd ~/ble_scan